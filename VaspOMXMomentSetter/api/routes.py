@@ -0,0 +1,225 @@
+"""
+Read-only JSON API for scripts and workflow engines, on the Flask server of
+the app. It runs the same code as the UI buttons and keeps no state between
+requests, so any number of gunicorn workers and threads can serve it.
+
+    POST /api/v1/magmom    -> {"magmom": "MAGMOM = ...", "natoms": N, "mag_type": ...}
+    POST /api/v1/openmx    -> {"openmx_input": "<modified .dat>", "natoms": N, "mag_type": ...}
+    POST /api/v1/propagation -> {"grid": [n1, n2, n3], "sublattices": [...], "dominant": [...], ...}
+
+The body is one request or a batch {"requests": [...]}. A request is
+
+    {"structure": "<POSCAR or OpenMX .dat text>",
+     one of
+     "moments":   [m1, m2, ...] (collinear) or [[mx, my, mz], ...],
+     "magmom":    "MAGMOM = 2*5 -5 ...",
+     "selection": {"Fe and fz 0:0.5": 3.0, "O": 0}   (collinear: magnitudes)
+                  {"1:4": [0, 0, 3], "5:8": {"mag": 3, "theta": 90, "phi": 0}}
+     and optionally "mag_type": "collinear" | "noncollinear"}
+
+Selections use the selection language of the UI (utils/selection.py) and are
+applied in order; atoms no selection picks get no moment. A batch is checked
+as a whole before anything is computed: any invalid request makes the
+response 400 with {"errors": [{"index": i, "error": ...}, ...]}. Requests of a
+batch with the same structure text parse it once.
+"""
+import hashlib
+import numpy as np
+from ..input_parsers.parser_wraper import parse_structure
+from ..input_creators.modify_openmx_moments import modify_openmx_spins, omx_input_coords
+from ..utils.format_magmom_vasp import parse_magmom_string, generate_magmom_string
+from ..utils.moment_array import moments_to_array, array_to_moments
+from ..utils.coordinate_transform import spherical_to_cartesian
+from ..utils.selection import select_mask
+from ..utils.propagation import propagation_vectors
+
+API_PREFIX = '/api/v1'
+MAG_TYPES = ('collinear', 'noncollinear')
+_SPEC_FIELDS = ('moments', 'magmom', 'selection')
+
+
+class RequestError(ValueError):
+    """Invalid request, reported back to the client."""
+
+
+def _check_fields(item):
+    if not isinstance(item, dict):
+        raise RequestError('a request must be a JSON object')
+    if not isinstance(item.get('structure'), str) or not item['structure'].strip():
+        raise RequestError("'structure' must be the text of a POSCAR or OpenMX .dat file")
+    given = [field for field in _SPEC_FIELDS if field in item]
+    if len(given) != 1:
+        raise RequestError(f"give exactly one of {', '.join(_SPEC_FIELDS)}")
+    mag_type = item.get('mag_type')
+    if mag_type is not None and mag_type not in MAG_TYPES:
+        raise RequestError(f"'mag_type' must be one of {', '.join(MAG_TYPES)}")
+    return given[0], mag_type
+
+
+def _moments_from_array(values, natoms, mag_type):
+    try:
+        array = np.asarray(values, dtype=float)
+    except (TypeError, ValueError):
+        raise RequestError("'moments' must be numbers")
+    if array.shape == (natoms,):
+        if mag_type == 'noncollinear':
+            raise RequestError("'moments' has one value per atom, 'noncollinear' needs [mx, my, mz]")
+        moments = np.zeros((natoms, 3))
+        moments[:, 0] = array
+        return moments, 'collinear'
+    if array.shape == (natoms, 3):
+        return array, mag_type or 'noncollinear'
+    raise RequestError(f"'moments' must have {natoms} values or {natoms} [mx, my, mz], got shape {array.shape}")
+
+
+def _moments_from_magmom(magmom, natoms, mag_type):
+    if not isinstance(magmom, str):
+        raise RequestError("'magmom' must be a string")
+    try:
+        moments_data, parsed_type = parse_magmom_string(magmom, natoms)
+    except ValueError as e:
+        raise RequestError(str(e))
+    if mag_type is not None and mag_type != parsed_type:
+        raise RequestError(f"'magmom' is {parsed_type}, 'mag_type' says {mag_type}")
+    return moments_to_array(moments_data, natoms), parsed_type
+
+
+def _moment_vector(value, mag_type):
+    """[mx, my, mz] of one selection value: a number (collinear), a vector or {mag, theta, phi}."""
+    if mag_type == 'collinear':
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise RequestError(f'collinear selection values must be numbers, got {value!r}')
+        return [float(value), 0.0, 0.0]
+    if isinstance(value, dict):
+        try:
+            return spherical_to_cartesian(float(value['mag']), float(value['theta']), float(value['phi']))
+        except (KeyError, TypeError, ValueError):
+            raise RequestError(f'spherical moments need numbers mag, theta, phi, got {value!r}')
+    try:
+        vector = [float(v) for v in value]
+    except (TypeError, ValueError):
+        vector = []
+    if len(vector) != 3:
+        raise RequestError(f'non-collinear selection values must be [mx, my, mz] or {{mag, theta, phi}}, got {value!r}')
+    return vector
+
+
+def _moments_from_selection(selection, structure, mag_type):
+    if not isinstance(selection, dict) or not selection:
+        raise RequestError("'selection' must be an object of selection expression -> moment")
+    if mag_type is None:
+        numbers = all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in selection.values())
+        mag_type = 'collinear' if numbers else 'noncollinear'
+    moments = np.full((len(structure), 3), np.nan)
+    for expression, value in selection.items():
+        vector = _moment_vector(value, mag_type)
+        try:
+            mask = select_mask(expression, structure)
+        except (ValueError, TypeError) as e:
+            raise RequestError(f'selection {expression!r}: {e}')
+        moments[mask] = vector
+    return moments, mag_type
+
+
+def resolve_request(item, parsed, require_omx=False):
+    """
+    (crystal_data, natoms-by-3 moments, mag_type) of one request; parsed caches
+    parse_structure results by structure text hash. Raises RequestError.
+    """
+    field, mag_type = _check_fields(item)
+    digest = hashlib.sha1(item['structure'].encode('utf-8')).hexdigest()
+    if digest not in parsed:
+        parsed[digest] = parse_structure(item['structure'].encode('utf-8'))
+    crystal_data = parsed[digest]
+    if crystal_data is None:
+        raise RequestError("'structure' could not be read as a POSCAR or OpenMX .dat file")
+    if require_omx and crystal_data['input_type'] != 'omx':
+        raise RequestError("'structure' must be an OpenMX .dat file")
+
+    structure = crystal_data['structure']
+    natoms = len(structure)
+    if field == 'moments':
+        moments, mag_type = _moments_from_array(item['moments'], natoms, mag_type)
+    elif field == 'magmom':
+        moments, mag_type = _moments_from_magmom(item['magmom'], natoms, mag_type)
+    else:
+        moments, mag_type = _moments_from_selection(item['selection'], structure, mag_type)
+    return crystal_data, moments, mag_type
+
+
+def magmom_result(crystal_data, moments, mag_type):
+    natoms = len(crystal_data['structure'])
+    magmom = generate_magmom_string(natoms, array_to_moments(moments), mag_type == 'collinear')
+    return {'magmom': magmom, 'natoms': natoms, 'mag_type': mag_type}
+
+
+def openmx_result(crystal_data, moments, mag_type):
+    structure = crystal_data['structure']
+    coords = omx_input_coords(crystal_data['file_str'], {'frac_coords': structure.frac_coords,
+                                                         'cart_coords': structure.cart_coords})
+    text = modify_openmx_spins(crystal_data['file_str'], np.nan_to_num(moments),
+                               mag_type == 'noncollinear', coords)
+    return {'openmx_input': text, 'natoms': len(structure), 'mag_type': mag_type}
+
+
+def propagation_result(crystal_data, moments, mag_type):
+    result = propagation_vectors(crystal_data['structure'], moments)
+    result.update({'natoms': len(crystal_data['structure']), 'mag_type': mag_type})
+    return result
+
+
+def run_batch(body, result_fn, require_omx=False, max_batch=64):
+    """
+    (status, response dict) of a request body: every request is resolved
+    first, results are computed only when all of them are valid.
+    """
+    batched = isinstance(body, dict) and 'requests' in body
+    items = body['requests'] if batched else [body]
+    if not isinstance(items, list) or not items:
+        return 400, {'errors': [{'index': None, 'error': "'requests' must be a non-empty list"}]}
+    if len(items) > max_batch:
+        return 400, {'errors': [{'index': None, 'error': f'at most {max_batch} requests per batch'}]}
+
+    parsed, resolved, errors = {}, [], []
+    for index, item in enumerate(items):
+        try:
+            resolved.append(resolve_request(item, parsed, require_omx))
+        except RequestError as e:
+            errors.append({'index': index, 'error': str(e)})
+    if errors:
+        return 400, {'errors': errors}
+
+    results = []
+    for index, args in enumerate(resolved):
+        try:
+            results.append(result_fn(*args))
+        except ValueError as e:
+            errors.append({'index': index, 'error': str(e)})
+    if errors:
+        return 422, {'errors': errors}
+    return 200, ({'results': results} if batched else results[0])
+
+
+def register_api_routes(server, config, prefix=API_PREFIX):
+    """Adds the API routes to the Flask server of the Dash app."""
+    from flask import jsonify, request
+    max_bytes = config['max_upload_bytes']
+    max_batch = config['api_max_batch']
+
+    def endpoint(result_fn, require_omx=False):
+        def view():
+            if max_bytes >= 0 and (request.content_length or 0) > max_bytes:
+                return jsonify({'errors': [{'index': None, 'error': f'body larger than {max_bytes} bytes'}]}), 413
+            body = request.get_json(silent=True)
+            if body is None:
+                return jsonify({'errors': [{'index': None, 'error': 'the body must be JSON'}]}), 400
+            status, response = run_batch(body, result_fn, require_omx, max_batch)
+            return jsonify(response), status
+        return view
+
+    routes = {'moment_setter_api_magmom': ('/magmom', endpoint(magmom_result)),
+              'moment_setter_api_openmx': ('/openmx', endpoint(openmx_result, require_omx=True)),
+              'moment_setter_api_propagation': ('/propagation', endpoint(propagation_result))}
+    for name, (path, view) in routes.items():
+        if name not in server.view_functions:
+            server.add_url_rule(prefix + path, name, view, methods=['POST'])
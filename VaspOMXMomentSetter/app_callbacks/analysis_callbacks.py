@@ -0,0 +1,83 @@
+from dash import Input, Output, State, no_update
+from ..input_parsers.parser_wraper import SimpleStructure
+from ..utils.moment_array import store_to_arrays, arrays_to_store
+from ..utils.coordinate_transform import cartesian_to_spherical_array
+from ..utils.propagation import propagation_vectors
+from ..utils.symmetrize import parse_operations, symmetrize_moments
+
+
+def format_k(k):
+    return '(' + ', '.join(f'{x:g}' for x in k) + ')'
+
+
+def format_propagation(result):
+    """Text table of a propagation_vectors result."""
+    if not result['sublattices']:
+        return 'No moments set.'
+    lines = [f"Translation grid {' x '.join(map(str, result['grid']))}, "
+             f"k in units of the reciprocal lattice of the cell divided by it"]
+    for peak in result['dominant']:
+        lines.append(f"  k = {format_k(peak['k']):24s} amplitude {peak['amplitude']:8.4f}  weight {peak['weight']:.4f}")
+    for sub in result['sublattices']:
+        lines.append(f"{sub['label']} ({sub['sites']} sites, |m| {sub['mean_moment']:g}, {sub['method']})")
+        for peak in sub['peaks']:
+            lines.append(f"  k = {format_k(peak['k']):24s} amplitude {peak['amplitude']:8.4f}  weight {peak['weight']:.4f}")
+    return '\n'.join(lines)
+
+
+def register_analysis_callbacks(app):
+    """Analysis of the current moment configuration."""
+
+    @app.callback(
+        Output('propagation-output', 'children'),
+        Input('propagation-button', 'n_clicks'),
+        State('structure-store', 'data'),
+        State('moments-store', 'data'),
+        prevent_initial_call=True
+    )
+    def find_propagation_vectors(n_clicks, structure_dict, moments_data):
+        if not structure_dict:
+            return no_update
+        structure = SimpleStructure.from_dict(structure_dict)
+        cartesian, _ = store_to_arrays(moments_data, len(structure))
+        try:
+            return format_propagation(propagation_vectors(structure, cartesian))
+        except ValueError as e:
+            return f'Error: {e}'
+
+
+    # one action for the whole cell; the change goes into the undo history like any other edit
+    @app.callback(
+        Output('moments-store', 'data', allow_duplicate=True),
+        Output('symmetrize-status', 'children'),
+        Input('symmetrize-button', 'n_clicks'),
+        State('symmetry-ops-textarea', 'value'),
+        State('symmetrize-translations-check', 'value'),
+        State('structure-store', 'data'),
+        State('moments-store', 'data'),
+        State('magnetism-type', 'value'),
+        prevent_initial_call=True
+    )
+    def symmetrize_current_moments(n_clicks, ops_text, translations_check, structure_dict,
+                                   moments_data, mag_type):
+        if not structure_dict:
+            return no_update, no_update
+        structure = SimpleStructure.from_dict(structure_dict)
+        cartesian, _ = store_to_arrays(moments_data, len(structure))
+        try:
+            operations = parse_operations(ops_text)
+            translations = 'translations' in (translations_check or [])
+            if not operations and not translations:
+                return no_update, 'Give symmetry operations or use the supercell translations.'
+            symmetrized, report = symmetrize_moments(structure, cartesian, operations, translations,
+                                                     collinear=mag_type == 'collinear')
+        except ValueError as e:
+            return no_update, f'Error: {e}'
+
+        print(f"Symmetrized {len(structure)} moments over {report['operations']} operations "
+              f"x {report['translations']} translations")
+        status = (f"{report['operations']} operations x {report['translations']} translations; "
+                  f"residual rms {report['residual_rms']:.4f}, max {report['residual_max']:.4f}")
+        if report['worst_site'] is not None:
+            status += f" (site {report['worst_site']})"
+        return arrays_to_store(symmetrized, cartesian_to_spherical_array(symmetrized)), status
@@ -1,8 +1,23 @@
 from dash import Input, Output, State, no_update
 from dash import dcc, html
 #import pprint
-from ..utils.string_utils import parse_selection_string
-from ..utils.coordinate_transform import cartesian_to_spherical, rotate_vector, spherical_to_cartesian
+import numpy as np
+from ..input_parsers.parser_wraper import SimpleStructure
+from ..utils.selection import select_mask, index_mask
+from ..utils.moment_array import store_to_arrays, arrays_to_store
+from ..utils.moment_array import convert_moments
+from ..utils.format_magmom_vasp import parse_saxis
+from ..utils.coordinate_transform import cartesian_to_spherical_array, rotate_vectors, spherical_to_cartesian
+
+
+def selection_to_mask(text_selection, clicked_atoms, structure_dict, natoms):
+    """
+    Boolean mask of the atoms to modify. The text expression has priority,
+    clicked atoms are the fallback. Raises ValueError for invalid expressions.
+    """
+    if text_selection:
+        return select_mask(text_selection, SimpleStructure.from_dict(structure_dict))
+    return index_mask(clicked_atoms, natoms)
 
 
 def register_control_callbacks(app):
@@ -71,29 +86,22 @@ def register_control_callbacks(app):
         State('moment-phi-in', 'value'),
         State('moments-store', 'data'),
         State('natoms-store', 'data'), # Total number of atoms
+        State('structure-store', 'data'), # coordinates/species for the selection language
         prevent_initial_call=True
     )
     def set_or_update_moment(n_clicks, mag_type, clicked_atoms, text_selection,
-                             mag, theta, phi, current_moments, natoms):
-        if mag is None or natoms is None:
+                             mag, theta, phi, current_moments, natoms, structure_dict):
+        if mag is None or not natoms or not structure_dict:
             return no_update, no_update, no_update
 
-        atoms_to_modify = []
-        # Prioritize text input for selection
-        if text_selection:
-            try:
-                atoms_to_modify = parse_selection_string(text_selection, natoms)
-                atoms_to_modify = [atom-1 for atom in atoms_to_modify]
-
-            except (ValueError, TypeError) as e:
-                print(f"Error parsing selection string: {e}")
-                return no_update, no_update, no_update # Stop if parsing fails
+        # Prioritize text input for selection, fallback to click selection
+        try:
+            mask = selection_to_mask(text_selection, clicked_atoms, structure_dict, natoms)
+        except (ValueError, TypeError) as e:
+            print(f"Error parsing selection string: {e}")
+            return no_update, no_update, no_update # Stop if parsing fails
 
-        # Fallback to click selection if text box is empty
-        elif clicked_atoms:
-            atoms_to_modify = clicked_atoms
-
-        if not atoms_to_modify:
+        if not mask.any():
             return no_update, no_update, no_update # do nothing
 
         # apply specified moments to the selected sites
@@ -106,14 +114,66 @@ def register_control_callbacks(app):
             moment_sph = [mag, theta, phi]
             moment_vec = spherical_to_cartesian(mag, theta, phi)
 
-        for atom_idx in atoms_to_modify:
-            current_moments['cartesian'][str(atom_idx)] = moment_vec
-            current_moments['spherical'][str(atom_idx)] = moment_sph
+        cart, sph = store_to_arrays(current_moments, natoms)
+        cart[mask] = moment_vec
+        sph[mask] = moment_sph
+        current_moments = arrays_to_store(cart, sph)
 
         # Return updated moments, and clear both click and text selections
         return current_moments, [], ''
 
 
+    # the mode the moments were last written in: every writer of the
+    # moments-store writes in the mode selected at that time
+    @app.callback(
+        Output('moments-mode-store', 'data'),
+        Input('moments-store', 'data'),
+        State('magnetism-type', 'value'),
+        prevent_initial_call=True
+    )
+    def record_moments_mode(current_moments, mag_type):
+        return mag_type
+
+
+    # the whole store to the selected mode in one step: collinear moments go
+    # along SAXIS, non-collinear ones are projected on it
+    @app.callback(
+        Output('moments-store', 'data', allow_duplicate=True),
+        Output('saxis-status', 'children'),
+        Input('convert-moments-button', 'n_clicks'),
+        State('magnetism-type', 'value'),
+        State('moments-mode-store', 'data'),
+        State('moments-store', 'data'),
+        State('natoms-store', 'data'),
+        State('saxis-input', 'value'),
+        prevent_initial_call=True
+    )
+    def convert_moments_to_mode(n_clicks, mag_type, source_mode, current_moments, natoms, saxis_text):
+        if not natoms:
+            return no_update, no_update
+        # converting again would project [m, 0, 0] on SAXIS (or read x of [0, 0, m]) and lose the moments
+        if (source_mode or 'collinear') == mag_type:
+            return no_update, f'Moments are already {mag_type}'
+        try:
+            saxis = parse_saxis(saxis_text)
+        except ValueError as e:
+            return no_update, str(e)
+
+        cart, _ = store_to_arrays(current_moments, natoms)
+        cart = convert_moments(cart, source_mode or 'collinear', mag_type, saxis)
+        if mag_type == 'collinear':
+            # same spherical form as moments set in collinear mode
+            sph = np.zeros_like(cart)
+            sph[:, 0] = np.abs(cart[:, 0])
+            sph[:, 1] = np.where(cart[:, 0] < 0, 180.0, 0.0)
+            sph[np.isnan(cart[:, 0])] = np.nan
+        else:
+            sph = cartesian_to_spherical_array(cart)
+            sph[np.isnan(cart[:, 0])] = np.nan
+        assigned = int((~np.isnan(cart[:, 0])).sum())
+        return arrays_to_store(cart, sph), f'{assigned} moments converted to {mag_type}'
+
+
     # rotate moments, similar to set moments
     @app.callback(
         Output('moments-store', 'data', allow_duplicate=True),
@@ -124,37 +184,29 @@ def register_control_callbacks(app):
         State('natoms-store', 'data'),
         State('rotation-theta-input', 'value'),
         State('rotation-phi-input', 'value'),
+        State('structure-store', 'data'),
         prevent_initial_call=True
     )
     def rotate_selected_moments(n_clicks, current_moments, clicked_atoms, 
-                                text_selection, natoms, theta, phi):
-        if not current_moments or (theta is None or phi is None):
+                                text_selection, natoms, theta, phi, structure_dict):
+        if not current_moments or (theta is None or phi is None) or not structure_dict:
             return no_update
 
         # Determine which atoms are selected (priority to text input)
-        atoms_to_modify = []
-        if text_selection:
-            try:
-                atoms_to_modify = parse_selection_string(text_selection, natoms)
-                atoms_to_modify = [atom-1 for atom in atoms_to_modify]
-            except (ValueError, TypeError):
-                return no_update
-        elif clicked_atoms:
-            atoms_to_modify = clicked_atoms
-
-        if not atoms_to_modify:
+        try:
+            mask = selection_to_mask(text_selection, clicked_atoms, structure_dict, natoms)
+        except (ValueError, TypeError):
+            return no_update
+
+        if not mask.any():
             return no_update # No atoms selected to rotate
 
-        # Loop through selected atoms and apply rotation
-        for atom_idx in atoms_to_modify:
-            idx_str = str(atom_idx)
-            # Get the current moment, default to [0,0,0] if not set
-            current_vec = current_moments['cartesian'].get(idx_str, [0.0, 0.0, 0.0])
-            # Rotated moment
-            new_vec = rotate_vector(current_vec, theta, phi)
-            # Update the dictionary
-            current_moments['cartesian'][idx_str] = new_vec
-            current_moments['spherical'][idx_str] = cartesian_to_spherical(new_vec)
+        # Rotate all selected moments at once, unset moments count as [0,0,0]
+        cart, sph = store_to_arrays(current_moments, natoms)
+        selected = np.nan_to_num(cart[mask])
+        cart[mask] = rotate_vectors(selected, theta, phi)
+        sph[mask] = cartesian_to_spherical_array(cart[mask])
+        current_moments = arrays_to_store(cart, sph)
 
         return current_moments
 
@@ -1,15 +1,88 @@
 import numpy as np
-from dash import Input, Output, State, no_update
+from dash import Input, Output, State, no_update, ctx
 from dash import dcc, html
-from ..input_parsers.parser_wraper import input_parser
+from ..input_parsers.parser_vasp_output import read_vasp_magnetization
+from ..input_parsers.parser_omx_output import read_openmx_moments
+from ..input_creators.modify_openmx_moments import modify_openmx_spins, omx_input_coords
+from ..input_creators.omx_to_vasp import vasp_inputs, vasp_bundle
+from ..input_parsers.parser_wraper import parse_structure
+from ..utils.moment_array import arrays_to_store, moments_to_array
+from ..utils.upload_utils import decode_upload
+from ..utils.coordinate_transform import cartesian_to_spherical_array
 from ..utils.coordinate_transform import cartesian_to_spherical, spherical_to_cartesian
 from ..utils.format_magmom_vasp import parse_magmom_string, generate_magmom_string
+from ..utils.format_magmom_vasp import read_incar_tags, parse_saxis
 from ..input_creators.omx_parameter_setup import omx_default_input_str
+from ..jobs.manager import heavy_callback
+from ..session.structures import parse_uploads, load_structure, moment_stash
+from ..session.bundles import configuration, save_bundle_spec
+from ..config import load_config
 
 
-def register_file_io_callbacks(app):
-    """Registers all callbacks for the Dash app."""
+def register_file_io_callbacks(app, job_manager=None, config=None):
+    """
+    Registers all callbacks for the Dash app. Parsing uploads and poscar2openmx
+    run as background jobs when a job_manager is given. Uploads larger than
+    config['max_upload_bytes'] are refused before they are decoded.
+    """
+    if config is None:
+        config = load_config()
+    max_heavy_jobs = config['max_heavy_jobs']
+    max_upload_bytes = config['max_upload_bytes']
+    structure_dir = config['structure_cache_dir']
 
+    # a batch of files is parsed in parallel into the structure shelf; only
+    # the picker items (key, name, number of atoms) come back to the browser
+    @heavy_callback(
+        app, job_manager,
+        Output('structure-picker', 'options'),
+        Output('structure-picker', 'value'),
+        Output('structure-picker-status', 'children'),
+        Input('upload-input', 'contents'),
+        State('upload-input', 'filename'),
+        State('structure-picker', 'options'),
+        progress=[Output('upload-progress', 'value'), Output('upload-progress', 'max'),
+                  Output('upload-progress-label', 'children')],
+        cancel=[Input('cancel-upload-button', 'n_clicks')],
+        running=[(Output('upload-progress-container', 'style'),
+                  {'display': 'flex', 'alignItems': 'center', 'gap': '10px'}, {'display': 'none'})],
+        max_inline=max_heavy_jobs,
+        prevent_initial_call=True
+    )
+    def upload_and_store_structure(set_progress, contents, filenames, options):
+        if not contents:
+            return no_update, no_update, no_update
+        if isinstance(contents, str): # single-file upload
+            contents, filenames = [contents], [filenames]
+        filenames = filenames or [f'file {i + 1}' for i in range(len(contents))]
+
+        def on_done(done, total):
+            set_progress((done, total, f'Parsed {done} / {total} files'))
+
+        set_progress((0, len(contents), 'Parsing files'))
+        # processes only inside a job: forking the threaded web worker is not safe
+        items = parse_uploads(structure_dir, filenames, contents, max_upload_bytes,
+                              keep=config['structure_cache_keep'], workers=config['parse_workers'],
+                              processes=job_manager is not None, on_done=on_done)
+
+        failed = [item['name'] for item in items if 'error' in item]
+        parsed = [item for item in items if 'error' not in item]
+        status = f"Could not read: {', '.join(failed)}" if failed else ''
+        if not parsed:
+            return no_update, no_update, status
+
+        # new files are added to the picker, a file uploaded again keeps its place
+        options = list(options or [])
+        known = {option['value'] for option in options}
+        for item in parsed:
+            if item['key'] not in known:
+                known.add(item['key'])
+                options.append({'label': f"{item['name']} ({item['natoms']} atoms)", 'value': item['key']})
+        return options, parsed[0]['key'], status
+
+
+    # Show a structure of the picker; the moments of the one shown before are
+    # kept server-side, a new upload starts from the moments in the file
     @app.callback(
         Output('structure-store', 'data'),
         Output('species-checklist', 'options'),
@@ -20,41 +93,40 @@ def register_file_io_callbacks(app):
         Output('magnetism-type','value'),
         Output('input-str','data'), # input poscar or *.dat as a string object
         Output('is-omx','data'),
-        Input('upload-input', 'contents'),
+        Output('active-structure-store', 'data'),
+        Output('structure-picker-status', 'children', allow_duplicate=True),
+        Input('structure-picker', 'value'),
+        Input('structure-picker', 'options'),
+        State('active-structure-store', 'data'),
+        State('session-id', 'data'),
+        State('moments-store', 'data'),
+        State('natoms-store', 'data'),
+        State('magnetism-type', 'value'),
         prevent_initial_call=True
     )
-    def upload_and_store_structure(contents):
-
-        if contents:
-            crystal_data = input_parser(contents)
-
-            structure    = crystal_data['structure']
-            magmom       = crystal_data['moments']
-            n_valence    = crystal_data['valence']
-            data         = crystal_data['parameter_data']
-            file_content = crystal_data['file_str']
+    def select_structure(key, picker_options, active_key, session_id, moments_data, natoms, mag_type):
+        uploaded = 'structure-picker.options' in ctx.triggered_prop_ids
+        if not key or (key == active_key and not uploaded):
+            return (no_update,) * 11
 
-            if '<Atoms.SpeciesAndCoordinates' in file_content:
-                print("It's an OpenMX input add option to keep parameters")
-                is_omx = True
-            else:
-                is_omx = False
+        entry = load_structure(structure_dir, key)
+        if entry is None:
+            return (no_update,) * 10 + ('This structure was evicted from the server, upload it again.',)
 
-            moments_data = {'cartesian':{},'spherical':{}}
-            # populate the moment dict with existing magmom
-            if magmom is not None:
-                moments_data['cartesian'] = {str(i): spin for i, spin in enumerate(magmom)}
-                moments_data['spherical'] = {str(i): cartesian_to_spherical(spin) for i, spin in enumerate(magmom)}
-
-            if structure:
-                species = sorted(list(structure.symbol_set))
-                options = [{'label': s, 'value': s} for s in species]
-                natoms = len(structure)
-                mag_type = 'noncollinear' if data and data.get('spin_pol', '').lower() == 'nc' else 'collinear'
-
-                return structure.as_dict(), options, species, moments_data, [], natoms, mag_type, file_content, is_omx
+        if active_key and active_key != key and natoms:
+            moment_stash.put(session_id, active_key, moments_data, natoms, mag_type)
+        stashed = None if uploaded else moment_stash.pop(session_id, key)
+        if stashed is not None:
+            moments_data, mag_type = stashed
+        else:
+            moments_data, mag_type = entry['moments'], entry['mag_type']
 
-        return no_update, no_update, no_update, no_update, no_update, no_update, no_update, no_update, no_update
+        if entry['is_omx']:
+            print("It's an OpenMX input add option to keep parameters")
+        species = sorted(set(entry['structure']['species']))
+        options = [{'label': s, 'value': s} for s in species]
+        return (entry['structure'], options, species, moments_data, [], entry['natoms'], mag_type,
+                entry['file_str'], entry['is_omx'], key, no_update)
 
 
     # If omx format detected, display the option for keeping original parameters
@@ -73,6 +145,21 @@ def register_file_io_callbacks(app):
                                 style={'marginLeft': '10px'}),
                     dcc.Download(id="download-openmx-input2")
                 ], style={'marginTop': '10px'}),
+                # POSCAR, INCAR and KPOINTS with the current moments
+                html.Div([
+                    html.Button('VASP (POSCAR, INCAR, KPOINTS)',
+                                id='generate-vasp-bundle-button', n_clicks=0,
+                                style={'marginLeft': '10px'}),
+                    dcc.Download(id="download-vasp-bundle")
+                ], style={'marginTop': '10px'}),
+                # restart from the spins a finished run converged to
+                html.Div([
+                    dcc.Upload(id='upload-openmx-out', max_size=max_upload_bytes,
+                               children=html.Button('Restart from OpenMX output (*.out)',
+                                                    style={'marginLeft': '10px'})),
+                    dcc.Download(id='download-openmx-restart'),
+                    html.Span(id='openmx-restart-status', style={'marginLeft': '10px', 'fontSize': 'small'}),
+                ], style={'marginTop': '10px', 'display': 'flex', 'alignItems': 'center'}),
             ])
 
 
@@ -82,57 +169,159 @@ def register_file_io_callbacks(app):
         State('natoms-store', 'data'),
         State('moments-store', 'data'), 
         State('magnetism-type', 'value'),
+        State('saxis-input', 'value'),
         prevent_initial_call=True
     )
-    def generate_and_display_magmom(n_clicks, natoms, moments_data, mag_type):
+    def generate_and_display_magmom(n_clicks, natoms, moments_data, mag_type, saxis_text):
         is_collinear = mag_type == 'collinear'
-        return generate_magmom_string(natoms, moments_data['cartesian'], is_collinear)
+        try:
+            saxis = None if is_collinear else parse_saxis(saxis_text)
+        except ValueError as e:
+            return f'Error: {e}'
+        return generate_magmom_string(natoms, moments_data['cartesian'], is_collinear, saxis)
+
+
+    # Bundle of the structure shown (or of every uploaded one, with the moments
+    # set on each): the spec is saved under its hash and the link points to
+    # the route that streams the zip
+    @app.callback(
+        Output('bundle-link', 'href'),
+        Output('bundle-link', 'children'),
+        Output('bundle-link', 'style'),
+        Input('prepare-bundle-button', 'n_clicks'),
+        State('bundle-all-check', 'value'),
+        State('structure-store', 'data'),
+        State('moments-store', 'data'),
+        State('magnetism-type', 'value'),
+        State('input-str', 'data'),
+        State('active-structure-store', 'data'),
+        State('structure-picker', 'options'),
+        State('session-id', 'data'),
+        prevent_initial_call=True
+    )
+    def prepare_bundle(n_clicks, bundle_all, structure, moments, mag_type, input_str, active_key,
+                       picker_options, session_id):
+        if not n_clicks or not structure:
+            return no_update, no_update, no_update
+        natoms = len(structure['species'])
+        moment_array = np.nan_to_num(moments_to_array(moments['cartesian'], natoms))
+        if active_key:
+            configurations = [configuration(moment_array, mag_type, key=active_key)]
+        else:
+            configurations = [configuration(moment_array, mag_type, structure=structure,
+                                            file_str=input_str if isinstance(input_str, str) else None)]
+
+        if 'all' in (bundle_all or []):
+            for option in picker_options or []:
+                key = option['value']
+                if key == active_key:
+                    continue
+                # edited moments of a structure not shown, else the ones of its file
+                stashed = moment_stash.get(session_id, key)
+                if stashed is None:
+                    configurations.append(configuration(None, None, key=key))
+                else:
+                    state, stashed_type = stashed
+                    configurations.append(configuration(np.nan_to_num(state[:, :3]), stashed_type, key=key))
+
+        key = save_bundle_spec(config['bundle_cache_dir'], configurations, config['bundle_cache_keep'])
+        href = app.get_relative_path(f'/download/bundle/{key}.zip')
+        label = f'Download moments_bundle.zip ({len(configurations)} structure{"s" if len(configurations) > 1 else ""})'
+        return href, label, {'display': 'inline'}
 
 
     # Reading magmom strings
     @app.callback(
         Output('moments-store', 'data', allow_duplicate=True),
         Output('magnetism-type', 'value', allow_duplicate=True),
+        Output('saxis-input', 'value', allow_duplicate=True),
         Input('update-from-magmom-button', 'n_clicks'),
         State('magmom-input-textarea', 'value'),
         State('natoms-store', 'data'),
+        State('saxis-input', 'value'),
         prevent_initial_call=True
     )
-    def update_moments_from_string(n_clicks, magmom_str, natoms):
+    def update_moments_from_string(n_clicks, magmom_str, natoms, saxis_text):
         if not magmom_str or natoms == 0:
-            return no_update
+            return no_update, no_update, no_update
         try:
-            # Parse the string and update the moments-store
+            # Parse the string and update the moments-store; a SAXIS line in
+            # the pasted text replaces the SAXIS field
+            tags = read_incar_tags(magmom_str)
+            saxis = parse_saxis(tags.get('SAXIS', saxis_text))
             new_moments = {'cartesian':{}, 'spherical':{}}
-            moments_in, mag_type = parse_magmom_string(magmom_str, natoms)
+            moments_in, mag_type = parse_magmom_string(magmom_str, natoms, saxis)
             print(f'MAGMOM string is {mag_type}')
 
             new_moments['cartesian'] = moments_in
             new_moments['spherical'] = {str(i): cartesian_to_spherical(moments_in[i]) for i in moments_in}
-            return new_moments, mag_type
+            saxis_value = ' '.join(f'{x:g}' for x in saxis) if 'SAXIS' in tags else no_update
+            return new_moments, mag_type, saxis_value
         except ValueError as e:
             # If parsing fails, print an error to the console and do nothing
             print(f"Error parsing MAGMOM string: {e}")
-            return no_update, no_update
+            return no_update, no_update, no_update
+
+
+    # Converged moments from VASP output (OUTCAR, vasprun.xml, OSZICAR)
+    @app.callback(
+        Output('moments-store', 'data', allow_duplicate=True),
+        Output('magnetism-type', 'value', allow_duplicate=True),
+        Output('magnetization-import-status', 'children'),
+        Input('upload-magnetization', 'contents'),
+        State('natoms-store', 'data'),
+        prevent_initial_call=True
+    )
+    def import_converged_moments(contents, natoms):
+        if not contents:
+            return no_update, no_update, no_update
+        if not natoms:
+            return no_update, no_update, 'Load the structure first.'
+        try:
+            result = read_vasp_magnetization(decode_upload(contents, max_upload_bytes), natoms)
+        except ValueError as e:
+            print(f"Error reading magnetization: {e}")
+            return no_update, no_update, str(e)
+
+        total = result['total']
+        total_str = f'{total:.3f}' if result['mag_type'] == 'collinear' else ' '.join(f'{x:.3f}' for x in total)
+        if result['moments'] is None:
+            # OSZICAR only has the total moment
+            return no_update, no_update, f"{result['format']}: total moment {total_str}, no per-atom moments"
+
+        cartesian = result['moments']
+        new_moments = arrays_to_store(cartesian, cartesian_to_spherical_array(cartesian))
+        print(f"Imported {result['mag_type']} moments of {natoms} atoms from {result['format']}")
+        return new_moments, result['mag_type'], f"{result['format']}: {natoms} moments, total {total_str}"
 
 
     # --- OpneMX Input file Generation ---
     # Option 1 generate omx input using poscar2openmx library
-    @app.callback(
+    @heavy_callback(
+        app, job_manager,
         Output("download-openmx-input", "data"),
         Input('generate-openmx-button', 'n_clicks'),
         State('structure-store','data'),
         State('magnetism-type', 'value'),
         State('moments-store', 'data'),
+        progress=[Output('openmx-progress', 'value'), Output('openmx-progress', 'max'),
+                  Output('openmx-progress-label', 'children')],
+        cancel=[Input('cancel-openmx-button', 'n_clicks')],
+        running=[(Output('generate-openmx-button', 'disabled'), True, False),
+                 (Output('openmx-progress-container', 'style'),
+                  {'display': 'flex', 'alignItems': 'center', 'gap': '10px'}, {'display': 'none'})],
+        max_inline=max_heavy_jobs,
         prevent_initial_call=True
     )
-    def generate_openmx_input(n_clicks, structure, moment_type, moments):
+    def generate_openmx_input(set_progress, n_clicks, structure, moment_type, moments):
 
         if n_clicks is None or n_clicks == 0:
-            return dash.no_update
+            return no_update
 
         # omx_default_input_str calls poscar2openmx if the lib is detected
+        set_progress((10, 100, 'Running poscar2openmx'))
         omx_input_str = omx_default_input_str(structure, moment_type, moments)
+        set_progress((90, 100, 'Preparing download'))
         filename = f"input_omx_str.dat"
 
         # Use dcc.send_string to serve the content directly to the browser
@@ -154,37 +343,15 @@ def register_file_io_callbacks(app):
         prevent_initial_call=True
     )
     def modify_omx_input_moments(n_clicks, structure, moment_type, moments, openmx_input_content):
-        from ..input_creators.modify_openmx_moments import modify_openmx_spins
-        import re
 
         if n_clicks is None or n_clicks == 0:
             return dash.no_update
 
-        # initiatalize a full natoms-by-3 moment array as a place holder
+        # full natoms-by-3 moment array, zero for the unassigned sites
         natoms = len(structure['frac_coords'])
-        moment_array = np.zeros((natoms,3))
-
-        # populate moment array with assigned spin moments
-        new_moment_dict = moments['cartesian']
-        for k in new_moment_dict.keys():
-            moment_array[int(k),:] = new_moment_dict[k]
-
-        # Identify whether frac or cart coordinates
-        pattern = r"^(?!#)\s*Atoms\.SpeciesAndCoordinates\.Unit\s+(\S+)"
-        match = re.search(pattern, openmx_input_content, re.MULTILINE)
-        if match:
-            result = match.group(1)
-            print(f"The extracted unit is: **{result}**")
-            if result.lower()=='frac':
-                print('input is in frac')
-                coords = structure['frac_coords']
-            elif result.lower()=='ang':
-                print('in put is in ang')
-                coords = structure['cart_coords']
-            else:
-                raise CustomError("Atoms.SpeciesAndCoordinates.Unit should be either frac or Ang")
-        else:
-            print("can't find coordinate system type: choose frac or cart")
+        moment_array = np.nan_to_num(moments_to_array(moments['cartesian'], natoms))
+
+        coords = omx_input_coords(openmx_input_content, structure)
 
         is_noncollinear = True if moment_type.lower() =='noncollinear' else False
         # modity the moments in the original *.dat input
@@ -199,3 +366,63 @@ def register_file_io_callbacks(app):
            filename=filename,
            type="text/plain" # Explicitly define the MIME type for text files
         )
+
+
+    # OpenMX *.dat -> zip of VASP inputs, with the moments set in the app
+    @app.callback(
+        Output('download-vasp-bundle', 'data'),
+        Input('generate-vasp-bundle-button', 'n_clicks'),
+        State('structure-store', 'data'),
+        State('magnetism-type', 'value'),
+        State('moments-store', 'data'),
+        State('input-str', 'data'),
+        prevent_initial_call=True
+    )
+    def download_vasp_bundle(n_clicks, structure, moment_type, moments, openmx_input_content):
+        if not n_clicks or not structure or not openmx_input_content:
+            return no_update
+        crystal_data = parse_structure(openmx_input_content.encode('utf-8'))
+        if crystal_data is None or len(crystal_data['structure']) != len(structure['species']):
+            return no_update
+
+        natoms = len(structure['species'])
+        moment_array = np.nan_to_num(moments_to_array(moments['cartesian'], natoms))
+        try:
+            files = vasp_inputs(crystal_data, moment_array, moment_type.lower())
+        except ValueError as e:
+            print(f"Error converting to VASP: {e}")
+            return no_update
+        name = crystal_data['parameter_data']['system_name']
+        return dcc.send_bytes(vasp_bundle(files), filename=f"{name}_vasp.zip")
+
+
+    # One step restart: converged spins of an OpenMX *.out -> moments and a modified *.dat
+    @app.callback(
+        Output('moments-store', 'data', allow_duplicate=True),
+        Output('magnetism-type', 'value', allow_duplicate=True),
+        Output('download-openmx-restart', 'data'),
+        Output('openmx-restart-status', 'children'),
+        Input('upload-openmx-out', 'contents'),
+        State('structure-store', 'data'),
+        State('input-str', 'data'),
+        prevent_initial_call=True
+    )
+    def restart_from_openmx_output(contents, structure, openmx_input_content):
+        if not contents or not structure:
+            return no_update, no_update, no_update, no_update
+        natoms = len(structure['species'])
+        try:
+            result = read_openmx_moments(decode_upload(contents, max_upload_bytes), natoms)
+            moments = result['moments']
+            is_noncollinear = result['mag_type'] == 'noncollinear'
+            coords = omx_input_coords(openmx_input_content, structure)
+            modified_content = modify_openmx_spins(openmx_input_content, moments, is_noncollinear, coords)
+        except ValueError as e:
+            print(f"Error reading OpenMX output: {e}")
+            return no_update, no_update, no_update, str(e)
+
+        new_moments = arrays_to_store(moments, cartesian_to_spherical_array(moments))
+        status = f"Restart input with {natoms} converged moments (total {result['total']:.3f} muB)"
+        return (new_moments, result['mag_type'],
+                dcc.send_string(modified_content, filename="input_omx_restart.dat", type="text/plain"),
+                status)
@@ -0,0 +1,159 @@
+import uuid
+from dash import Input, Output, State, no_update, ctx
+from dash import dcc
+from ..session.history import histories
+from ..session.project import save_session, load_session
+from ..utils.moment_array import store_to_state, state_to_store
+from ..utils.upload_utils import decode_upload
+from ..config import load_config
+
+# view controls saved with a session: settings key -> component id
+SESSION_VIEW_SETTINGS = {
+    'visible_species': 'species-checklist',
+    'view_options': 'view-options-checklist',
+    'radii_scale': 'radii-scale',
+    'arrow_scale': 'arrow-scale',
+    'center_vector': 'center-vector-check',
+    'vector_color': 'color-dropdown',
+    'show_table': 'show-table-check',
+    'saxis': 'saxis-input',
+}
+
+
+def register_session_callbacks(app, config=None):
+    """
+    Session id, the server-side undo/redo history of the moments-store, and
+    saving/loading the whole edit as a session file.
+    """
+    if config is None:
+        config = load_config()
+    max_upload_bytes = config['max_upload_bytes']
+
+    # every browser tab gets its own id, used as key for server-side state
+    @app.callback(
+        Output('session-id', 'data'),
+        Input('session-id', 'data'),
+    )
+    def assign_session_id(session_id):
+        if session_id:
+            return no_update
+        return uuid.uuid4().hex
+
+
+    # Record every change of the moments (Set/Rotate/Reset/MAGMOM/upload) as a delta
+    @app.callback(
+        Output('undo-button', 'disabled'),
+        Output('redo-button', 'disabled'),
+        Output('history-status', 'children'),
+        Input('moments-store', 'data'),
+        Input('structure-store', 'data'),
+        State('session-id', 'data'),
+        prevent_initial_call=True
+    )
+    def record_moment_history(moments_data, structure_dict, session_id):
+        if not session_id or not structure_dict:
+            return True, True, ''
+
+        natoms = len(structure_dict['species'])
+        state = store_to_state(moments_data, natoms)
+
+        with histories.lock:
+            history = histories.get(session_id)
+            # a new structure starts a new history
+            if (history is None or 'structure-store.data' in ctx.triggered_prop_ids
+                    or history.state.shape[0] != natoms):
+                history = histories.reset(session_id, state)
+            else:
+                # no-op when the change came from undo/redo itself
+                history.record(state)
+
+            status = f"step {history.step - history.base_step}/{history.last_step - history.base_step}"
+            return not history.can_undo(), not history.can_redo(), status
+
+
+    @app.callback(
+        Output('moments-store', 'data', allow_duplicate=True),
+        Input('undo-button', 'n_clicks'),
+        Input('redo-button', 'n_clicks'),
+        State('session-id', 'data'),
+        prevent_initial_call=True
+    )
+    def undo_redo_moments(undo_clicks, redo_clicks, session_id):
+        with histories.lock:
+            history = histories.get(session_id)
+            if history is None:
+                return no_update
+
+            if ctx.triggered_id == 'undo-button':
+                state = history.undo()
+            else:
+                state = history.redo()
+
+        if state is None:
+            return no_update
+        return state_to_store(state)
+
+
+    @app.callback(
+        Output('download-session', 'data'),
+        Input('save-session-button', 'n_clicks'),
+        State('structure-store', 'data'),
+        State('moments-store', 'data'),
+        State('magnetism-type', 'value'),
+        State('selected-atoms-store', 'data'),
+        State('input-str', 'data'),
+        State('camera-store', 'data'),
+        *[State(component, 'value') for component in SESSION_VIEW_SETTINGS.values()],
+        prevent_initial_call=True
+    )
+    def save_session_file(n_clicks, structure, moments_data, mag_type, selected, input_str, camera, *view_values):
+        if not n_clicks or not structure:
+            return no_update
+        state = store_to_state(moments_data, len(structure['species']))
+        settings = dict(zip(SESSION_VIEW_SETTINGS, view_values))
+        data = save_session(structure, state, mag_type, selected, input_str if isinstance(input_str, str) else None,
+                            camera, settings)
+        return dcc.send_bytes(data, filename='moment_session.npz')
+
+
+    # a session file replaces the edit: structure, moments, selection, camera and view
+    @app.callback(
+        Output('structure-store', 'data', allow_duplicate=True),
+        Output('species-checklist', 'options', allow_duplicate=True),
+        Output('moments-store', 'data', allow_duplicate=True),
+        Output('selected-atoms-store', 'data', allow_duplicate=True),
+        Output('natoms-store', 'data', allow_duplicate=True),
+        Output('magnetism-type', 'value', allow_duplicate=True),
+        Output('input-str', 'data', allow_duplicate=True),
+        Output('is-omx', 'data', allow_duplicate=True),
+        Output('camera-store', 'data', allow_duplicate=True),
+        Output('active-structure-store', 'data', allow_duplicate=True),
+        Output('structure-picker', 'value', allow_duplicate=True),
+        Output('session-status', 'children'),
+        *[Output(component, 'value', allow_duplicate=True) for component in SESSION_VIEW_SETTINGS.values()],
+        Input('upload-session', 'contents'),
+        State('upload-session', 'filename'),
+        prevent_initial_call=True
+    )
+    def load_session_file(contents, filename):
+        n_outputs = 12 + len(SESSION_VIEW_SETTINGS)
+        if not contents:
+            return (no_update,) * n_outputs
+        try:
+            session = load_session(decode_upload(contents, max_upload_bytes))
+        except ValueError as e:
+            print(f"Error loading session: {e}")
+            return (no_update,) * 11 + (f'{filename}: {e}',) + (no_update,) * len(SESSION_VIEW_SETTINGS)
+
+        structure = session['structure']
+        species = sorted(set(structure['species']))
+        input_text = session['input_text']
+        settings = session['settings']
+        view_values = [settings.get(key, no_update) for key in SESSION_VIEW_SETTINGS]
+        if settings.get('visible_species') is None:
+            view_values[0] = species
+        status = f"{filename}: {len(structure['species'])} atoms"
+        return (structure, [{'label': s, 'value': s} for s in species], state_to_store(session['moments']),
+                session['selected'], len(structure['species']), session['mag_type'],
+                input_text or 0, bool(input_text) and '<Atoms.SpeciesAndCoordinates' in input_text,
+                session['camera'], None, None, status, *view_values)
@@ -0,0 +1,167 @@
+from dash import Input, Output, State, no_update, ctx, Patch
+from ..input_parsers.parser_wraper import SimpleStructure
+from ..input_parsers.parser_trajectory import XDATCAR_FRAME_KEY
+from ..session.trajectory import build_trajectory_cache, open_trajectory
+from ..session.structures import moment_stash
+from ..view.figure_components import patch_frame
+from ..utils.moment_array import arrays_to_store
+from ..utils.coordinate_transform import cartesian_to_spherical_array
+from ..utils.upload_utils import decode_upload
+from ..jobs.manager import heavy_callback
+
+# bytes of an upload searched for the first XDATCAR frame line
+XDATCAR_SNIFF_BYTES = 1 << 16
+
+
+def register_trajectory_callbacks(app, job_manager, config):
+    """
+    Trajectory playback: an uploaded XDATCAR (+ moments per step) goes to the
+    memory-mapped frame cache, the slider moves the atoms and arrows of the
+    current figure with a Patch, 'Use frame' makes a frame the edited structure.
+    """
+    cache_dir = config['trajectory_cache_dir']
+
+    @heavy_callback(
+        app, job_manager,
+        Output('trajectory-store', 'data'),
+        Output('trajectory-status', 'children'),
+        Input('upload-trajectory', 'contents'),
+        State('upload-trajectory', 'filename'),
+        progress=[Output('trajectory-progress', 'value'), Output('trajectory-progress', 'max'),
+                  Output('trajectory-progress-label', 'children')],
+        cancel=[Input('cancel-trajectory-button', 'n_clicks')],
+        running=[(Output('trajectory-progress-container', 'style'),
+                  {'display': 'flex', 'alignItems': 'center', 'gap': '10px'}, {'display': 'none'})],
+        max_inline=config['max_heavy_jobs'],
+        prevent_initial_call=True
+    )
+    def upload_trajectory(set_progress, contents, filenames):
+        if not contents:
+            return no_update, no_update
+
+        try:
+            files = {name: decode_upload(c, config['max_upload_bytes']) for name, c in zip(filenames, contents)}
+        except ValueError as e:
+            return no_update, str(e)
+        xdatcars = [name for name, f in files.items() if XDATCAR_FRAME_KEY in f.getbuffer()[:XDATCAR_SNIFF_BYTES].tobytes()]
+        others = [name for name in files if name not in xdatcars]
+        if len(xdatcars) != 1 or len(others) > 1:
+            return no_update, 'Drop one XDATCAR and at most one OUTCAR or moments .npy file.'
+
+        def on_progress(done, total, label):
+            set_progress((done, total, f'{label}: {done} / {total}'))
+
+        xdatcar_name = xdatcars[0]
+        moments_name = others[0] if others else None
+        try:
+            key = build_trajectory_cache(cache_dir, files[xdatcar_name], files.get(moments_name),
+                                         keep=config['trajectory_cache_keep'], on_progress=on_progress)
+        except ValueError as e:
+            print(f"Error reading trajectory: {e}")
+            return no_update, str(e)
+        meta = open_trajectory(cache_dir, key).meta
+
+        status = f"{xdatcar_name}: {meta['nframes']} frames of {meta['natoms']} atoms"
+        if moments_name:
+            status += f", {meta['mag_type']} moments from {moments_name}"
+        print(status)
+        return {'key': key, 'nframes': meta['nframes'], 'natoms': meta['natoms'],
+                'mag_type': meta['mag_type']}, status
+
+
+    # a new trajectory shows its first frame; 'Use frame' takes the slider's frame
+    @app.callback(
+        Output('structure-store', 'data', allow_duplicate=True),
+        Output('species-checklist', 'options', allow_duplicate=True),
+        Output('species-checklist', 'value', allow_duplicate=True),
+        Output('moments-store', 'data', allow_duplicate=True),
+        Output('selected-atoms-store', 'data', allow_duplicate=True),
+        Output('natoms-store', 'data', allow_duplicate=True),
+        Output('magnetism-type', 'value', allow_duplicate=True),
+        Output('is-omx', 'data', allow_duplicate=True),
+        Output('trajectory-slider', 'max'),
+        Output('trajectory-slider', 'value'),
+        Output('trajectory-slider', 'disabled'),
+        Output('use-trajectory-frame-button', 'disabled'),
+        Output('active-structure-store', 'data', allow_duplicate=True),
+        Output('structure-picker', 'value', allow_duplicate=True),
+        Input('trajectory-store', 'data'),
+        Input('use-trajectory-frame-button', 'n_clicks'),
+        State('trajectory-slider', 'value'),
+        State('active-structure-store', 'data'),
+        State('session-id', 'data'),
+        State('moments-store', 'data'),
+        State('natoms-store', 'data'),
+        State('magnetism-type', 'value'),
+        prevent_initial_call=True
+    )
+    def load_trajectory_frame(trajectory, n_clicks, frame, active_key, session_id, current_moments,
+                              natoms, current_mag_type):
+        if not trajectory:
+            return (no_update,) * 14
+        try:
+            frames = open_trajectory(cache_dir, trajectory['key'])
+        except (OSError, ValueError) as e:
+            print(f"Trajectory not available: {e}")
+            return (no_update,) * 14
+
+        # the uploaded structure being edited keeps its moments for the picker
+        if active_key and natoms:
+            moment_stash.put(session_id, active_key, current_moments, natoms, current_mag_type)
+
+        new_trajectory = ctx.triggered_id == 'trajectory-store'
+        frame = 0 if new_trajectory else (frame or 0)
+        lattice, positions, moments = frames.frame(frame)
+        structure = SimpleStructure(lattice, frames.species, positions, coords_are_cartesian=True)
+        species = sorted(structure.symbol_set)
+        options = [{'label': s, 'value': s} for s in species]
+
+        if moments is not None:
+            moments_data = arrays_to_store(moments, cartesian_to_spherical_array(moments))
+            mag_type = trajectory['mag_type']
+        elif new_trajectory:
+            moments_data, mag_type = {'cartesian': {}, 'spherical': {}}, no_update
+        else:
+            moments_data, mag_type = no_update, no_update
+
+        selected = [] if new_trajectory else no_update
+        slider_max = max(frames.nframes - 1, 0) if new_trajectory else no_update
+        slider_value = 0 if new_trajectory else no_update
+        return (structure.as_dict(), options, species, moments_data, selected, len(structure), mag_type,
+                False, slider_max, slider_value, False, False, None, None)
+
+
+    # scrubbing: only the coordinates of the atom, cell and arrow traces are sent
+    @app.callback(
+        Output('structure-view', 'figure', allow_duplicate=True),
+        Output('trajectory-frame-label', 'children'),
+        Output('figure-trace-store', 'data', allow_duplicate=True), # frame shown, for restyling its arrows
+        Input('trajectory-slider', 'value'),
+        State('trajectory-store', 'data'),
+        State('figure-trace-store', 'data'),
+        State('selected-atoms-store', 'data'),
+        State('arrow-scale', 'value'),
+        State('center-vector-check', 'value'),
+        prevent_initial_call=True
+    )
+    def show_trajectory_frame(frame, trajectory, figure_traces, selected_atoms, arrow_scale, center_vec_check):
+        if not trajectory or not figure_traces or frame is None:
+            return no_update, no_update, no_update
+        try:
+            frames = open_trajectory(cache_dir, trajectory['key'])
+        except (OSError, ValueError) as e:
+            print(f"Trajectory not available: {e}")
+            return no_update, no_update, no_update
+
+        # the figure must show this trajectory's atoms (not a structure uploaded since)
+        traces = figure_traces['traces']
+        if figure_traces['natoms'] != frames.meta['natoms'] or not set(traces['species']) <= set(frames.species):
+            return no_update, 'Frame preview needs the trajectory structure (Use frame)', no_update
+
+        lattice, positions, moments = frames.frame(frame)
+        patch = patch_frame(Patch(), traces, frames.species, lattice, positions, moments,
+                            arrow_scale=arrow_scale or 0, center_arrow='center' in (center_vec_check or []),
+                            highlighted_atoms=selected_atoms)
+        shown = Patch()
+        shown['frame'] = frame
+        return patch, f'Frame {frame + 1} / {frames.nframes}', shown
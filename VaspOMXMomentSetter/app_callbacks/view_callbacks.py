@@ -1,21 +1,62 @@
+import json
 import numpy as np
 import plotly.graph_objects as go
-from dash import Input, Output, State, no_update
+from dash import Input, Output, State, no_update, Patch
 from dash import dcc, html # Local import to keep layout dependencies minimal
 from dash import dash_table # Local import to keep layout dependencies minimal
 import time
 #import pprint
 from ..input_parsers.parser_wraper import SimpleStructure
-from ..view.figure_components import structure_to_fig
+from ..view.figure_components import structure_to_fig, figure_trace_map, encode_figure, patch_arrows, species_radius
+from ..session.trajectory import open_trajectory
+from ..config import load_config
+from ..utils.plotly_obj import rgb_string
 from ..utils.string_utils import parse_selection_string
 
-
-def register_view_callbacks(app):
+# Map color names to RGB [0-1] values
+VECTOR_COLORS = {
+    'red': [1, 0, 0],
+    'green': [0, 1, 0],
+    'blue': [0, 0, 1],
+    'gray': [0.5, 0.5, 0.5],
+    'black': [0, 0, 0]
+}
+
+# Radii scale and arrow color only change marker sizes and two color
+# attributes: the browser restyles a copy of its figure, nothing is sent.
+RESTYLE_MARKERS_JS = """
+function(radiiScale, vectorColor, figure, figureTraces) {
+    const noUpdate = window.dash_clientside.no_update;
+    const scale = Number(radiiScale);
+    if (!figure || !figure.data || !figureTraces || radiiScale === null || !isFinite(scale)) {
+        return noUpdate;
+    }
+    const colors = %s;
+    const data = figure.data.slice();
+    for (const [n, radius] of Object.entries(figureTraces.radii || {})) {
+        data[n] = {...data[n], marker: {...data[n].marker, size: 2 * radius * scale}};
+    }
+    const arrows = figureTraces.traces.arrows;
+    const color = colors[(vectorColor || '').toLowerCase()];
+    if (arrows && color) {
+        data[arrows[0]] = {...data[arrows[0]], line: {...data[arrows[0]].line, color: color}};
+        data[arrows[1]] = {...data[arrows[1]], colorscale: [[0, color], [1, color]]};
+    }
+    return {...figure, data: data};
+}
+""" % json.dumps({name: rgb_string(rgb) for name, rgb in VECTOR_COLORS.items()})
+
+
+def register_view_callbacks(app, config=None):
     """Registers all callbacks for the Dash app."""
+    if config is None:
+        config = load_config()
+    trajectory_cache_dir = config['trajectory_cache_dir']
 
     # MAIN VIEW
     @app.callback(
         Output('structure-view', 'figure'),
+        Output('figure-trace-store', 'data'), # trace numbers, for patching frames in place
         # inputs
         Input('structure-store', 'data'),
         Input('magnetism-type', 'value'),
@@ -23,10 +64,11 @@ def register_view_callbacks(app):
         Input('moments-store', 'data'), # for displaying moments
         Input('selected-atoms-store', 'data'), # currently the yellow marker
         Input('view-options-checklist', 'value'),
-        Input('radii-scale', 'value'), # scale atom radii
-        Input('arrow-scale', 'value'), # scale vector size
-        Input('center-vector-check', 'value'), # center the vector, or attached to the site
-        Input('color-dropdown', 'value'), # vector color
+        # radii, arrow scale/centering and color restyle the figure in place (below)
+        State('radii-scale', 'value'), # scale atom radii
+        State('arrow-scale', 'value'), # scale vector size
+        State('center-vector-check', 'value'), # center the vector, or attached to the site
+        State('color-dropdown', 'value'), # vector color
         State('camera-store', 'data'), # to make sure update doesn't change camera,
         prevent_initial_call=True 
     )
@@ -35,19 +77,9 @@ def register_view_callbacks(app):
 
         # update fig
         if not structure_dict:
-            # Also return default values for columns and data
-            return go.Figure(), [], []
-
-        # Map color names to RGB [0-1] values
-        color_map = {
-            'red': [1, 0, 0],
-            'green': [0, 1, 0],
-            'blue': [0, 0, 1],
-            'gray': [0.5, 0.5, 0.5],
-            'black': [0, 0, 0]
-        }
+            return go.Figure(), None
 
-        vector_rgb = color_map[color_dropdown.lower()]
+        vector_rgb = VECTOR_COLORS[color_dropdown.lower()]
 
         structure = SimpleStructure.from_dict(structure_dict)
         moments_cart = moments_data['cartesian']
@@ -61,7 +93,60 @@ def register_view_callbacks(app):
 
         fig.update_layout(uirevision="keep-camera")
 
-        return fig
+        bond_pairs = [trace.name for trace in fig.data if trace.legendgroup == 'bonds']
+        trace_map = figure_trace_map(structure.symbol_set, visible_species or [],
+                                     selected_atoms, with_arrows=bool(moments_cart), bond_pairs=bond_pairs)
+        radii = {n: species_radius(species) for species, n in trace_map['species'].items()}
+        return encode_figure(fig), {'natoms': len(structure), 'traces': trace_map, 'radii': radii}
+
+
+    app.clientside_callback(
+        RESTYLE_MARKERS_JS,
+        Output('structure-view', 'figure', allow_duplicate=True),
+        Input('radii-scale', 'value'),
+        Input('color-dropdown', 'value'),
+        State('structure-view', 'figure'),
+        State('figure-trace-store', 'data'),
+        prevent_initial_call=True
+    )
+
+
+    # arrow scale and centering: only the coordinates of the two arrow traces are sent
+    @app.callback(
+        Output('structure-view', 'figure', allow_duplicate=True),
+        Input('arrow-scale', 'value'),
+        Input('center-vector-check', 'value'),
+        State('structure-store', 'data'),
+        State('moments-store', 'data'),
+        State('figure-trace-store', 'data'),
+        State('trajectory-store', 'data'),
+        prevent_initial_call=True
+    )
+    def restyle_arrows(arrow_scale, center_vec_check, structure_dict, moments_data, figure_traces, trajectory):
+        if arrow_scale is None or not structure_dict or not figure_traces:
+            return no_update
+        if 'arrows' not in figure_traces['traces']:
+            return no_update
+        center_arrow = 'center' in (center_vec_check or [])
+
+        # a trajectory frame shown with its own moments: redraw its arrows, not the structure's
+        if figure_traces.get('frame') is not None and trajectory:
+            try:
+                _, positions, moments = open_trajectory(trajectory_cache_dir, trajectory['key']).frame(
+                    figure_traces['frame'])
+            except (OSError, ValueError) as e:
+                print(f"Trajectory not available: {e}")
+                moments = None
+            if moments is not None:
+                return patch_arrows(Patch(), figure_traces['traces'], positions, moments, arrow_scale, center_arrow)
+
+        moments_cart = (moments_data or {}).get('cartesian')
+        if not moments_cart:
+            return no_update
+        sites = np.array([int(k) for k in moments_cart], dtype=int)
+        positions = np.asarray(structure_dict['cart_coords'], dtype=float)[sites]
+        return patch_arrows(Patch(), figure_traces['traces'], positions, list(moments_cart.values()),
+                            arrow_scale, center_arrow)
 
 
     @app.callback(
@@ -1,12 +1,46 @@
 from .app_callbacks.view_callbacks import register_view_callbacks
 from .app_callbacks.control_callbacks import register_control_callbacks
 from .app_callbacks.file_io_callbacks import register_file_io_callbacks
+from .app_callbacks.session_callbacks import register_session_callbacks
+from .app_callbacks.trajectory_callbacks import register_trajectory_callbacks
+from .app_callbacks.analysis_callbacks import register_analysis_callbacks
+from .config import load_config
+from .jobs.manager import create_job_manager
 
-def register_callbacks(app):
+def register_callbacks(app, config=None):
     """
     Registers all callbacks for the Dash app by calling
     the registration functions from specialized modules.
     """
-    register_view_callbacks(app)
+    if config is None:
+        config = load_config()
+
+    # wrap every callback only when instrumentation is switched on,
+    # otherwise the callbacks are registered untouched
+    wrappers = []
+    if config['metrics_enabled']:
+        from .instrumentation.metrics import register_metrics_route
+        from .instrumentation.wrapper import instrument_callback
+        wrappers.append(instrument_callback)
+        register_metrics_route(app.server)
+    if config['profile_callbacks'] or config['profile_query_flag']:
+        from .instrumentation.profiling import make_profiling_wrapper
+        wrappers.append(make_profiling_wrapper(config))
+
+    from .session.bundles import register_bundle_route
+    from .api.routes import register_api_routes
+    register_bundle_route(app.server, config)
+    register_api_routes(app.server, config)
+
+    if wrappers:
+        from .instrumentation.wrapper import InstrumentedApp
+        app = InstrumentedApp(app, wrappers)
+
+    register_view_callbacks(app, config)
     register_control_callbacks(app)
-    register_file_io_callbacks(app)
+    # slow callbacks become background jobs when dash[diskcache] is available
+    job_manager = create_job_manager(config)
+    register_file_io_callbacks(app, job_manager, config)
+    register_trajectory_callbacks(app, job_manager, config)
+    register_session_callbacks(app, config)
+    register_analysis_callbacks(app)
@@ -0,0 +1,73 @@
+import os
+import tempfile
+
+# Runtime settings of the app. Every key can be overridden with an environment
+# variable MOMENT_SETTER_<KEY> (e.g. MOMENT_SETTER_METRICS_ENABLED=1).
+DEFAULT_CONFIG = {
+    # per-callback timing/payload histograms and the /metrics route
+    'metrics_enabled': False,
+    # callbacks run under cProfile + tracemalloc: '' (none), 'all' or 'name1,name2'
+    'profile_callbacks': '',
+    # also profile when the page is opened with ?profile=1 or ?profile=name1,name2
+    'profile_query_flag': False,
+    # where .prof and allocation reports go, and how many of each are kept
+    'profile_dir': os.path.join(tempfile.gettempdir(), 'moment_setter_profiles'),
+    'profile_keep': 50,
+    # run file parsing and poscar2openmx as background jobs (needs dash[diskcache]);
+    # off: they run inside the request as before
+    'background_callbacks': True,
+    # disk cache shared by the job processes (and by gunicorn workers on one host)
+    'job_cache_dir': os.path.join(tempfile.gettempdir(), 'moment_setter_jobs'),
+    # heavy jobs computing at the same time, further ones wait in a queue
+    'max_heavy_jobs': 2,
+    # seconds a job record is kept without being touched
+    'job_record_expire': 3600,
+    # largest file accepted by the uploads, in bytes (dcc.Upload max_size, checked
+    # again on the server before decoding); -1: no limit
+    'max_upload_bytes': 100 * 1024**2,
+    # files of a multi-file upload parsed at the same time (processes inside a
+    # background job, threads otherwise)
+    'parse_workers': 4,
+    # parsed uploads shown by the structure picker, and how many are kept
+    'structure_cache_dir': os.path.join(tempfile.gettempdir(), 'moment_setter_structures'),
+    'structure_cache_keep': 256,
+    # memory-mapped frame cache of uploaded trajectories, and how many are kept
+    'trajectory_cache_dir': os.path.join(tempfile.gettempdir(), 'moment_setter_trajectories'),
+    'trajectory_cache_keep': 8,
+    # download bundles (zip) cached under a hash of their content, and how many are kept
+    'bundle_cache_dir': os.path.join(tempfile.gettempdir(), 'moment_setter_bundles'),
+    'bundle_cache_keep': 32,
+    # requests accepted in one batch by the JSON API (/api/v1/...)
+    'api_max_batch': 64,
+    # create_app runs the first-request code paths once (page, layout, a figure of
+    # each example) before serving; in the gunicorn master with preload_app
+    'warm_up': False,
+}
+
+ENV_PREFIX = 'MOMENT_SETTER_'
+
+
+def _from_env(raw, default):
+    """Converts an environment string to the type of the default value."""
+    if isinstance(default, bool):
+        return raw.strip().lower() in ('1', 'true', 'yes', 'on')
+    if isinstance(default, int):
+        return int(raw)
+    if isinstance(default, float):
+        return float(raw)
+    return raw
+
+
+def load_config(overrides=None):
+    """
+    Returns the app configuration: defaults, then environment variables,
+    then explicit overrides (dict) in increasing priority.
+    """
+    config = dict(DEFAULT_CONFIG)
+    for key, default in DEFAULT_CONFIG.items():
+        raw = os.environ.get(ENV_PREFIX + key.upper())
+        if raw is not None:
+            config[key] = _from_env(raw, default)
+    if overrides:
+        config.update(overrides)
+    return config
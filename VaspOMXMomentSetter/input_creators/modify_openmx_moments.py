@@ -1,169 +1,190 @@
-import math
+import re
 import numpy as np
-from ..utils.string_utils import find_start_by_char_transition
-from ..utils.coordinate_transform import cartesian_to_spherical
+from ..input_parsers.omx_document import OpenMXDocument
+from ..utils.string_utils import format_fixed_columns
+from ..utils.coordinate_transform import cartesian_to_spherical_array
+
+OMX_ATOMS_BLOCK = 'Atoms.SpeciesAndCoordinates'
+
+# Lines of the atom block. An atom line gives the index, species and coordinates
+# as written (kept verbatim), up and down electrons, the four angles of a
+# non-collinear line, the flags and a comment; any other line (blank, comment)
+# only the last group.
+_BLOCK_LINE = re.compile(
+    r'^(?:([ \t]*(?:[^\s#]+[ \t]+){2}([^\s#]+)[ \t]+([^\s#]+)[ \t]+([^\s#]+))'  # prefix, x, y, z
+    r'[ \t]+([^\s#]+)[ \t]+([^\s#]+)'                                            # s_up, s_dn
+    r'((?:[ \t]+[^\s#]+){4}(?![^\s#]))?'                                           # angles
+    r'[ \t]*([^#\n]*?)[ \t]*(#.*)?'                                                # flags, comment
+    r'|(.*))$', re.MULTILINE)
+
+# spin columns written per atom: (separator, width, decimals)
+COLLINEAR_COLUMNS = [('  ', 5, 2), (' ', 5, 2)]
+NONCOLLINEAR_COLUMNS = [('  ', 5, 2), ('  ', 5, 2), (' ', 7, 2), (' ', 7, 2), (' ', 7, 2), (' ', 7, 2)]
+# constraint and orbital moment enhancing flags of a non-collinear line
+NONCOLLINEAR_DEFAULT_FLAGS = '1 on'
+
+# atoms of the input matched per step when looking up the nearest coordinates
+_MATCH_CHUNK = 512
+
+
+def match_atoms(coord_orig, coord_new, decimals=6):
+    """
+    Index into coord_orig of the atom nearest to every row of coord_new.
+    Coordinates equal to `decimals` places are matched through a dict, the
+    others by a chunked nearest-distance search.
+    """
+    coord_orig = np.asarray(coord_orig, dtype=float).reshape(-1, 3)
+    coord_new = np.asarray(coord_new, dtype=float).reshape(-1, 3)
+    # reversed: for repeated coordinates the first atom wins, like argmin
+    lookup = dict(zip(map(tuple, np.round(coord_orig, decimals)[::-1].tolist()),
+                      range(len(coord_orig) - 1, -1, -1)))
+    index = np.fromiter((lookup.get(row, -1) for row in map(tuple, np.round(coord_new, decimals).tolist())),
+                        dtype=np.int64, count=len(coord_new))
+
+    missing = np.flatnonzero(index < 0)
+    for start in range(0, len(missing), _MATCH_CHUNK):
+        rows = missing[start:start + _MATCH_CHUNK]
+        dist2 = ((coord_new[rows, None, :] - coord_orig[None, :, :])**2).sum(axis=2)
+        index[rows] = dist2.argmin(axis=1)
+    return index
+
+
+def _atoms_number(doc):
+    value = doc.keyword('Atoms.Number')
+    if not value:
+        raise ValueError("Could not find 'Atoms.Number' in the OpenMX input.")
+    try:
+        return int(value.split()[0].replace('-', ''))
+    except ValueError:
+        raise ValueError(f"Could not read 'Atoms.Number {value}'.")
+
+
+def omx_input_coords(openmx_input_content, structure):
+    """
+    Coordinates of the stored structure in the unit of the OpenMX input (frac or Ang),
+    the ones modify_openmx_spins matches atoms with. None if the unit is not given.
+    """
+    # Identify whether frac or cart coordinates
+    pattern = r"^(?!#)\s*Atoms\.SpeciesAndCoordinates\.Unit\s+(\S+)"
+    match = re.search(pattern, openmx_input_content, re.MULTILINE)
+    if not match:
+        print("can't find coordinate system type: choose frac or cart")
+        return None
+    result = match.group(1)
+    print(f"The extracted unit is: **{result}**")
+    if result.lower()=='frac':
+        print('input is in frac')
+        return structure['frac_coords']
+    if result.lower()=='ang':
+        print('in put is in ang')
+        return structure['cart_coords']
+    raise ValueError("Atoms.SpeciesAndCoordinates.Unit should be either frac or Ang")
+
+
+def format_atom_lines(prefixes, s_up, s_dn, is_noncollinear, theta=None, phi=None,
+                      orbital_theta=None, orbital_phi=None, flags=None, comments=None):
+    """
+    Atom lines (without newline) of <Atoms.SpeciesAndCoordinates from per-atom
+    arrays, formatted column-wise. prefixes are the 'index species x y z' parts
+    of the lines; flags (collinear: e.g. 'on', non-collinear: e.g. '1 on') and comments are
+    strings per atom, '' or None for none. The orbital angles default to the
+    spin angles (initial guess).
+    """
+    natoms = len(prefixes)
+    if is_noncollinear:
+        orbital_theta = theta if orbital_theta is None else orbital_theta
+        orbital_phi = phi if orbital_phi is None else orbital_phi
+        columns = np.column_stack([s_up, s_dn, theta, phi, orbital_theta, orbital_phi])
+        numbers = format_fixed_columns(columns, NONCOLLINEAR_COLUMNS)
+        flags = flags if flags is not None else [NONCOLLINEAR_DEFAULT_FLAGS] * natoms
+        suffixes = [f'  {flag}' for flag in flags]
+    else:
+        numbers = format_fixed_columns(np.column_stack([s_up, s_dn]), COLLINEAR_COLUMNS)
+        suffixes = [f'   {flag}' if flag else '' for flag in flags] if flags is not None else [''] * natoms
+    if comments is not None:
+        suffixes = [f'{suffix}  {comment}' if comment else suffix for suffix, comment in zip(suffixes, comments)]
+    return [f'{prefix}{number}{suffix}' for prefix, number, suffix in zip(prefixes, numbers, suffixes)]
+
+
+def set_atom_spins(doc, new_spin_moments, is_noncollinear, coord_orig=None):
+    """
+    Edits the spin fields of <Atoms.SpeciesAndCoordinates and scf.SpinPolarization
+    of an OpenMXDocument; arguments as for modify_openmx_spins. Only the atom
+    block and the value of scf.SpinPolarization are rewritten.
+    """
+    new_spin_moments = np.asarray(new_spin_moments, dtype=float).reshape(-1, 3)
+    N_atoms_in_file = _atoms_number(doc)
+    if N_atoms_in_file != len(new_spin_moments):
+        raise ValueError(f"Number of spin moments provided ({len(new_spin_moments)}) must match "
+                         f"Atoms.Number in file ({N_atoms_in_file}).")
+
+    print(f"Applying new {N_atoms_in_file} spin moments to {len(new_spin_moments)} atoms...")
+
+    block = doc.block(OMX_ATOMS_BLOCK)
+    if block is None:
+        raise ValueError(f'No <{OMX_ATOMS_BLOCK} ... {OMX_ATOMS_BLOCK}> block in the OpenMX input.')
+    block_lines = block.splitlines()
+    # one tuple of groups per line, found in a single pass over the block
+    parsed = _BLOCK_LINE.findall('\n'.join(block_lines))
+    atom_lines = [i for i, groups in enumerate(parsed) if groups[0]]
+    for i, groups in enumerate(parsed):
+        other = groups[-1].strip()
+        if other and not other.startswith('#'):
+            raise ValueError(f'Unreadable line in <{OMX_ATOMS_BLOCK}: {block_lines[i]!r}')
+
+    fields = [parsed[i] for i in atom_lines]
+    prefixes, x, y, z, up, dn, angles, flags, comments, _other = zip(*fields) if fields else ([],) * 10
+    n_valence = np.array(up, dtype=float) + np.array(dn, dtype=float)
+
+    # reorder the moments
+    if coord_orig is not None:
+        coord_new = np.column_stack([np.array(x, dtype=float), np.array(y, dtype=float),
+                                     np.array(z, dtype=float)])
+        moments = new_spin_moments[match_atoms(coord_orig, coord_new)]
+    else:
+        moments = new_spin_moments[:len(atom_lines)]
+
+    if is_noncollinear:
+        mag, theta, phi = cartesian_to_spherical_array(moments).T
+        # keep the flags of a non-collinear line
+        flags = [flag if angle and flag else NONCOLLINEAR_DEFAULT_FLAGS for angle, flag in zip(angles, flags)]
+    else:
+        mag, theta, phi = moments[:, 0], None, None
+        # keep the flag of a collinear line (e.g. orbital polarization 'on')
+        flags = ['' if angle else flag for angle, flag in zip(angles, flags)]
+
+    s_up = 0.5 * (n_valence + mag)
+    s_dn = s_up - mag
+    atom_text = format_atom_lines(prefixes, s_up, s_dn, is_noncollinear, theta, phi,
+                                  flags=flags, comments=comments)
+
+    # blank and comment lines of the block stay where they were
+    new_lines = list(block_lines)
+    for i, text in zip(atom_lines, atom_text):
+        new_lines[i] = text
+    doc.set_block(OMX_ATOMS_BLOCK, ''.join(line + '\n' for line in new_lines))
+    doc.set_spin_polarization('nc' if is_noncollinear else 'on')
+    return doc
 
 
 def modify_openmx_spins(input_file_content, new_spin_moments, is_noncollinear, coord_orig=None):
     """
     Modifies the Spin moment initialization fields in the OpenMX input file content.
+    The atom block is parsed once and written again from arrays; index, species,
+    coordinates and comments of every atom line are kept as they were, and so is
+    everything outside the atom block but the value of scf.SpinPolarization.
 
     Args:
         input_file_content (str): The entire content of the OpenMX input file.
-        new_spin_moments (list of lists or np.ndarray): An N-by-3 array of (Mx, My, Mz) 
+        new_spin_moments (list of lists or np.ndarray): An N-by-3 array of (Mx, My, Mz)
                                                        for N atoms.
+        is_noncollinear (bool): write spin angles (nc) or up/down electrons only (on).
+        coord_orig (N-by-3, optional): coordinates the moments belong to, in the unit
+                                       of the file; every atom line takes the moment
+                                       of the nearest one.
 
     Returns:
         str: The modified content of the input file.
     """
-    lines = input_file_content.splitlines('\n')
-    modified_lines = []
-    in_coords_block = False
-    atom_count = 0
-    start_tag = '<Atoms.SpeciesAndCoordinates'
-    end_tag = 'Atoms.SpeciesAndCoordinates>'
-
-    # Ensure the spin array has the correct number of atoms
-    lines_check = input_file_content.splitlines()
-    try:
-        # This line attempts to find the Atoms.Number entry and extract the count
-        atom_number_line = next(line for line in lines_check if line.strip().startswith('Atoms.Number'))
-        N_atoms_in_file = int(atom_number_line.split()[-1].replace('-', ''))
-    except (StopIteration, ValueError, IndexError):
-        print(f"Warning: Could not reliably parse 'Atoms.Number'. Assuming N={N_atoms_in_file}.")
-
-    if N_atoms_in_file != len(new_spin_moments):
-        raise ValueError(f"Number of spin moments provided ({len(new_spin_moments)}) must match "
-                         f"Atoms.Number in file ({N_atoms_in_file}).")
-
-    print(f"Applying new {N_atoms_in_file} spin moments to {len(new_spin_moments)} atoms...")
-
-    for line in lines:
-        stripped_line = line.strip()
-
-        if stripped_line.startswith(start_tag):
-            in_coords_block = True
-            modified_lines.append(line)
-            continue
-
-        if stripped_line.startswith(end_tag):
-            in_coords_block = False
-            modified_lines.append(line)
-            continue
-
-        if in_coords_block and stripped_line:
-            line = line.rstrip('\n').split('#')[0] # remove comments
-            parts = line.split()
-            nparts = len(parts)
-
-            # parts[5] and parts[6] are spin up and down elect
-            n_valence = float(parts[5])+float(parts[6])
-
-            # reorder the moments
-            if coord_orig is not None:
-                coord_new = [float(part) for part in parts[2:5]]
-                # This uses broadcasting to subtract the target from every row
-                differences = np.array(coord_orig) - np.array(coord_new)
-                # Square the differences and sum them along each row (axis=1)
-                dist2 = np.sum(differences**2, axis=1)
-                # Find the index of the smallest distance
-                closest_index = np.argmin(dist2)
-                Mx, My, Mz = new_spin_moments[closest_index]
-            else:
-                # 1. Get the new Cartesian moments for the current atom
-                Mx, My, Mz = new_spin_moments[atom_count]
-
-            # 2. Convert to spherical coordinates
-            if is_noncollinear:
-                [mag, Theta, Phi] = cartesian_to_spherical([Mx,My,Mz])
-            else:
-                mag = Mx 
-
-            s_up = 0.5*(n_valence + mag)
-            s_dn = 0.5*(n_valence + mag) - mag
-
-            # Find where coord_z ends or where s_up begins
-            start_index = find_start_by_char_transition(line, 6) 
-            #start_index=52
-            prefix = line[:start_index]
-
-            if is_noncollinear:
-                # constrain and orbital moment enhancing flag
-                start_flag = find_start_by_char_transition(line, 12) 
-                if nparts >10: # keep the original flag
-                    additiona_flag = line[start_flag:].rstrip('\n')
-                else: # collinear add flag
-                    additiona_flag = '1 on'
-
-                new_spin_block_aligned = (
-                    f"  {s_up:5.2f}  {s_dn:5.2f}" # 
-                    f" {Theta:7.2f} {Phi:7.2f}" # Spin angles
-                    f" {Theta:7.2f} {Phi:7.2f}" # Orbital angles (initial guess same as spin)
-                    f"  {additiona_flag}"
-                )
-            else: # collinear 
-                new_spin_block_aligned = (
-                    f"  {s_up:5.2f} {s_dn:5.2f}" # 
-                )
-
-            # Reconstruct the full line
-            new_line = prefix + new_spin_block_aligned + '\n'
-            atom_count += 1
-            modified_lines.append(new_line)
-
-        else: # everything other than coorindates
-            # Append lines outside the block
-            if 'scf.SpinPolarization' in line:
-                if is_noncollinear:
-                    line = 'scf.SpinPolarization       nc  # On|Off|NC\n'
-                else:
-                    line = 'scf.SpinPolarization       on  # On|Off|NC\n'
-
-            modified_lines.append(line)
-
-    return "".join(modified_lines)
-
-
-#@ 1. New Spin Moments Array (N-by-3 array, N=20 in this example)
-#new_moments = np.array([
-#    [1.0, 1.0, 1.0],  # V 1: +X direction
-#    [0.0, 1.0, 0.0],  # V 2: +Y direction
-#    [-1.0, 0.0, 0.0], # V 3: -X direction
-#    [0.0, -1.0, 0.0], # V 4: -Y direction
-#    [0.0, 0.0, 1.0],  # V 5: +Z direction
-#    [0.0, 0.0, -1.0], # V 6: -Z direction
-#    [0.5, 0.5, 0.0],  # V 7: XY plane
-#    [0.0, 0.0, 0.0],  # V 8: Zero moment
-#    [0.0, 0.0, 0.0],  # O 9: Zero moment
-#    [0.0, 0.0, 0.0],   # O 10: Zero moment
-#    [1.0, 0.0, 0.0],  # V 1: +X direction
-#    [0.0, 1.0, 0.0],  # V 2: +Y direction
-#    [-1.0, 0.0, 0.0], # V 3: -X direction
-#    [0.0, -1.0, 0.0], # V 4: -Y direction
-#    [0.0, 0.0, 1.0],  # V 5: +Z direction
-#    [0.0, 0.0, -1.0], # V 6: -Z direction
-#    [0.5, 0.5, 0.0],  # V 7: XY plane
-#    [0.0, 0.0, 0.0],  # V 8: Zero moment
-#    [0.0, 0.0, 0.0],  # O 9: Zero moment
-#    [0.0, 0.0, 0.0]   # O 10: Zero moment
-#])
-#
-#input_omx = 'input_omx.dat'
-#with open(input_omx, 'r') as f:
-#    openmx_input_content = f.readlines()
-#
-## 3. Modify the file content
-#modified_content = modify_openmx_spins(openmx_input_content, new_moments, is_noncollinear=False)
-#
-## 4. Save the modified content to a new file (optional, but useful for testing)
-#output_filepath = "openmx_input_nc.dat"
-#try:
-#    with open(output_filepath, "w") as f:
-#        f.write(modified_content)
-#    print(f"\nSuccessfully generated and saved modified file to '{output_filepath}'.")
-#except Exception as e:
-#    print(f"\nCould not write file: {e}")
-#
-#print("\n--- Modified OpenMX Content ---")
-##print(modified_content)
-#
+    doc = OpenMXDocument(input_file_content)
+    return set_atom_spins(doc, new_spin_moments, is_noncollinear, coord_orig).to_string()
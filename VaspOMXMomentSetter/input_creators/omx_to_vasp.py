@@ -0,0 +1,214 @@
+"""
+OpenMX *.dat -> VASP POSCAR, INCAR and KPOINTS.
+
+Structure, initial spins, spin polarization, spin-orbit coupling, XC functional,
+SCF criterion, Hubbard U/J and the k-grid of the OpenMX input are carried
+over; basis, cutoff and mixing settings have no VASP counterpart and are left
+to the VASP defaults. One file from the app (download bundle), or whole
+directories in parallel:
+
+    python -m VaspOMXMomentSetter.input_creators.omx_to_vasp inputs/ vasp/ --workers 4
+
+writes vasp/<name>/POSCAR, INCAR, KPOINTS for every inputs/<name>.dat.
+"""
+import concurrent.futures
+import io
+import os
+import zipfile
+from itertools import groupby
+import numpy as np
+from ..input_parsers.parser_wraper import parse_structure
+from ..input_parsers.parser_omx import map_xc_functional
+from ..input_parsers.omx_document import OpenMXDocument
+from ..utils.format_magmom_vasp import format_magmom_vasp
+
+HARTREE_TO_EV = 27.211386245988
+
+
+def species_elements(file_content):
+    """
+    Element of every OpenMX species, from the pseudopotential column of
+    <Definition.of.Atomic.Species (e.g. 'Fe1 Fe6.0-s2p2d1 Fe_PBE19' -> 'Fe').
+    """
+    body = OpenMXDocument(file_content).block('Definition.of.Atomic.Species') or ''
+    elements = {}
+    for line in body.splitlines():
+        parts = line.split('#')[0].split()
+        if len(parts) >= 3:
+            elements[parts[0]] = parts[2].split('_')[0]
+    return elements
+
+
+def species_groups(species):
+    """
+    Stable order putting equal species next to each other (in order of first
+    appearance) and the (species, count) runs of that order, as POSCAR needs them.
+    """
+    first = {}
+    for s in species:
+        first.setdefault(s, len(first))
+    order = np.argsort([first[s] for s in species], kind='stable')
+    ordered = [species[i] for i in order]
+    return order, [(s, len(list(run))) for s, run in groupby(ordered)]
+
+
+def poscar_string(comment, lattice, labels, counts, frac_coords):
+    lines = [comment, '1.0']
+    lines += ['  ' + ' '.join(f'{x:21.16f}' for x in row) for row in lattice]
+    lines += ['  ' + ' '.join(labels), '  ' + ' '.join(str(n) for n in counts), 'Direct']
+    out = io.StringIO()
+    np.savetxt(out, frac_coords, fmt='%20.16f')
+    return '\n'.join(lines) + '\n' + out.getvalue()
+
+
+def kpoints_string(kgrid):
+    return ('Converted from scf.Kgrid\n0\nMonkhorst-Pack\n'
+            f"  {' '.join(str(k) for k in kgrid)}\n  0 0 0\n")
+
+
+def magnetic_tags(moments, mag_type):
+    """ISPIN or LNONCOLLINEAR and MAGMOM of natoms-by-3 moments (collinear: first column)."""
+    if mag_type == 'noncollinear':
+        return {'LNONCOLLINEAR': '.TRUE.', 'MAGMOM': format_magmom_vasp(np.asarray(moments).ravel(), True)}
+    if mag_type == 'collinear':
+        return {'ISPIN': 2, 'MAGMOM': format_magmom_vasp(np.asarray(moments)[:, 0], False)}
+    return {'ISPIN': 1}
+
+
+def incar_string(data, groups, moments, mag_type):
+    """
+    data: parse_openmx_dat dictionary; groups: (species, count) in POSCAR order;
+    moments: natoms-by-3 in that order (collinear moment in the first column);
+    mag_type: 'collinear', 'noncollinear' or None (not spin polarized).
+    """
+    tags = {'SYSTEM': data.get('system_name', 'system_name')}
+    tags.update(map_xc_functional(data.get('xc_type', 'GGA-PBE')))
+    # scf.criterion is in Hartree
+    tags['EDIFF'] = f"{data.get('scf_criterion', 1.0e-7) * HARTREE_TO_EV:.1E}"
+
+    tags.update(magnetic_tags(moments, mag_type))
+    if data.get('spinorbit') == 'on':
+        tags['LSORBIT'] = '.TRUE.'
+
+    ldau = [data['species_map'].get(s, {}).get('ldau') for s, _ in groups]
+    if any(ldau):
+        tags['LDAU'] = '.TRUE.'
+        tags['LDAUTYPE'] = 2
+        tags['LDAUL'] = ' '.join(str(u['L']) if u else '-1' for u in ldau)
+        tags['LDAUU'] = ' '.join(f"{u['U']:.2f}" if u else '0.00' for u in ldau)
+        tags['LDAUJ'] = ' '.join(f"{u['J']:.2f}" if u else '0.00' for u in ldau)
+        tags['LMAXMIX'] = 6 if any(u and u['L'] == 3 for u in ldau) else 4
+
+    return ''.join(f'{tag} = {value}\n' for tag, value in tags.items())
+
+
+def vasp_inputs(crystal_data, moments=None, mag_type=None):
+    """
+    {'POSCAR': text, 'INCAR': text, 'KPOINTS': text} of a parsed OpenMX input
+    (parse_structure result). moments (natoms-by-3, atom order of the parsed
+    structure) and mag_type replace the initial spins of the file when given;
+    KPOINTS is left out when the file has no scf.Kgrid.
+    """
+    data = crystal_data['parameter_data']
+    if data is None:
+        raise ValueError('Not an OpenMX input.')
+    structure = crystal_data['structure']
+    natoms = len(structure)
+
+    if moments is None:
+        # initial spins of the file: None where a line has none
+        moments = [m if m is not None else [0.0, 0.0, 0.0] for m in crystal_data['moments']]
+        mag_type = {'on': 'collinear', 'nc': 'noncollinear'}.get(data['spin_pol'])
+    moments = np.asarray(moments, dtype=float).reshape(natoms, 3)
+
+    order, groups = species_groups(structure.species)
+    elements = species_elements(crystal_data['file_str'])
+    labels = [elements.get(s, s) for s, _ in groups]
+
+    files = {
+        'POSCAR': poscar_string(f"{data['system_name']} (from OpenMX, species {' '.join(s for s, _ in groups)})",
+                                structure.lattice.matrix, labels, [n for _, n in groups],
+                                structure.frac_coords[order]),
+        'INCAR': incar_string(data, groups, moments[order], mag_type),
+    }
+    if data.get('kgrid'):
+        files['KPOINTS'] = kpoints_string(data['kgrid'])
+    return files
+
+
+def vasp_bundle(files):
+    """Zip archive (bytes) of a vasp_inputs dictionary."""
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, text in files.items():
+            archive.writestr(name, text)
+    return out.getvalue()
+
+
+def convert_file(path, output_dir):
+    """Writes output_dir/POSCAR, INCAR, KPOINTS for one OpenMX input. Returns the file names."""
+    crystal_data = parse_structure(path)
+    if crystal_data is None or crystal_data['input_type'] != 'omx':
+        raise ValueError(f'{path} could not be read as an OpenMX input')
+    files = vasp_inputs(crystal_data)
+    os.makedirs(output_dir, exist_ok=True)
+    for name, text in files.items():
+        with open(os.path.join(output_dir, name), 'w') as f:
+            f.write(text)
+    return list(files)
+
+
+def _convert_one(path, output_dir):
+    try:
+        return path, convert_file(path, output_dir), None
+    except (OSError, ValueError) as e:
+        return path, None, str(e)
+
+
+def convert_directory(input_dir, output_dir, workers=4, suffix='.dat', on_done=None):
+    """
+    Converts every *suffix file of input_dir into output_dir/<name>/ with a pool
+    of `workers` processes. Returns (path, files, error) per input, in name
+    order; on_done(done, total) after each file.
+    """
+    paths = sorted(os.path.join(input_dir, name) for name in os.listdir(input_dir) if name.endswith(suffix))
+    total = len(paths)
+    jobs = [(path, os.path.join(output_dir, os.path.basename(path)[:-len(suffix)])) for path in paths]
+    if total <= 1 or workers <= 1:
+        results = []
+        for done, job in enumerate(jobs, start=1):
+            results.append(_convert_one(*job))
+            if on_done is not None:
+                on_done(done, total)
+        return results
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, total)) as pool:
+        futures = {pool.submit(_convert_one, *job): i for i, job in enumerate(jobs)}
+        results = [None] * total
+        for done, future in enumerate(concurrent.futures.as_completed(futures), start=1):
+            results[futures[future]] = future.result()
+            if on_done is not None:
+                on_done(done, total)
+    return results
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input_dir', help='directory of OpenMX inputs')
+    parser.add_argument('output_dir', help='one sub-directory of VASP inputs is written per file')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='parallel conversions')
+    parser.add_argument('--suffix', default='.dat', help='extension of the OpenMX inputs')
+    args = parser.parse_args(argv)
+
+    results = convert_directory(args.input_dir, args.output_dir, args.workers, args.suffix,
+                                on_done=lambda done, total: print(f'{done} / {total}', end='\r'))
+    failed = [(path, error) for path, _, error in results if error]
+    print(f'{len(results) - len(failed)} of {len(results)} inputs converted into {args.output_dir}')
+    for path, error in failed:
+        print(f'  {path}: {error}')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,212 @@
+"""
+OpenMX input as a document for round-trip editing.
+
+The text is indexed once: the value span of every top-level keyword and the
+body span (the lines between the tags) of every <Block ... Block>, by
+lower-case name. Edits are recorded as (start, end) -> new text over the
+original offsets and applied only when the document is written, so
+comments, spacing and keywords this module does not know stay as they were,
+and the cost of an edit is the size of the edit, not of the file.
+
+    doc = OpenMXDocument(text)
+    doc.set_keyword('scf.SpinPolarization', 'nc')   # value replaced, comment kept
+    doc.set_kgrid([6, 6, 4])
+    doc.set_hubbard_u({'Ho': {'1f': 6.0}})
+    new_text = doc.to_string()
+"""
+import re
+
+# width of the keyword column of a line added by set_keyword
+KEYWORD_COLUMN = 27
+
+# the next line that opens a block or gives a keyword; an atom line or a
+# comment does not match. Groups: block name | keyword, value
+_ENTRY = re.compile(
+    r'^[ \t]*(?:<([^\s#<>]+)[^\n]*'
+    r'|([A-Za-z][^\s#<>]*)(?:[ \t]+([^#\r\n]*?))?[ \t]*(?:#[^\n]*)?\r?)$', re.MULTILINE)
+# orbital / value pairs of a Hubbard.U(J).values line
+_ORBITAL_VALUE = re.compile(r'([^\s#]+)[ \t]+([^\s#]+)')
+
+
+def _find_end_tag(text, block, pos):
+    """Offset of the line closing a block ('Block>' at the start of a line), -1 if none."""
+    tag = block + '>'
+    found = text.find(tag, pos)
+    while found >= 0:
+        line_start = text.rfind('\n', 0, found) + 1
+        if not text[line_start:found].strip(' \t'):
+            return line_start
+        found = text.find(tag, found + 1)
+    # closing tag written in another letter case
+    close = re.compile(r'^[ \t]*' + re.escape(tag), re.MULTILINE | re.IGNORECASE).search(text, pos)
+    return -1 if close is None else close.start()
+
+
+def _line_end(text, pos):
+    """Offset just after the newline ending the line at pos."""
+    newline = text.find('\n', pos)
+    return len(text) if newline < 0 else newline + 1
+
+
+class OpenMXDocument:
+    """
+    Offset index and pending edits of an OpenMX input. keywords maps a lower-case
+    keyword to (name, value_start, value_end), blocks a lower-case block name to
+    (name, body_start, body_end); for a repeated keyword or block the first one
+    counts. Raises ValueError for a block that is not closed.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.keywords = {}
+        self.blocks = {}
+        self._edits = {}     # start -> (end, new text)
+        self._appended = {}  # (kind, lower-case name) -> (name, value) added at the end of the file
+        self._index()
+
+    def _index(self):
+        text = self.text
+        pos = 0
+        while True:
+            match = _ENTRY.search(text, pos)
+            if match is None:
+                break
+            block, keyword = match.group(1), match.group(2)
+            if block is not None:
+                # jump over the body to the closing tag
+                body_start = _line_end(text, match.end())
+                body_end = _find_end_tag(text, block, body_start)
+                if body_end < 0:
+                    raise ValueError(f'Block <{block} is not closed ({block}> not found).')
+                self.blocks.setdefault(block.lower(), (block, body_start, body_end))
+                pos = _line_end(text, body_end)
+            else:
+                start, end = match.span(3) if match.group(3) is not None else (match.end(2), match.end(2))
+                self.keywords.setdefault(keyword.lower(), (keyword, start, end))
+                pos = _line_end(text, match.end())
+            if pos >= len(text):
+                break
+
+    # --- edits ---
+    def replace(self, start, end, new_text):
+        """Replaces text[start:end] of the original text on output."""
+        if start in self._edits and self._edits[start][0] == end:
+            self._edits[start] = (end, new_text)
+            return
+        for other_start, (other_end, _) in self._edits.items():
+            if max(start, other_start) < min(end, other_end) or start == other_start:
+                raise ValueError(f'Edit of {start}:{end} overlaps the edit of {other_start}:{other_end}.')
+        self._edits[start] = (end, new_text)
+
+    def _current(self, start, end):
+        edit = self._edits.get(start)
+        if edit is not None and edit[0] == end:
+            return edit[1]
+        return self.text[start:end]
+
+    def keyword(self, name, default=None):
+        """Value of a keyword as written (edits included), default when absent."""
+        entry = self.keywords.get(name.lower())
+        if entry is None:
+            added = self._appended.get(('keyword', name.lower()))
+            return default if added is None else added[1]
+        return self._current(entry[1], entry[2])
+
+    def set_keyword(self, name, value):
+        """Sets the value of a keyword; a missing keyword is added at the end of the file."""
+        value = str(value)
+        entry = self.keywords.get(name.lower())
+        if entry is None:
+            self._appended[('keyword', name.lower())] = (name, value)
+            return
+        _, start, end = entry
+        if start == end:
+            # keyword written without a value
+            value = (' ' if self.text[start - 1] not in ' \t' else '') + value
+            value += ' ' if self.text[end:end + 1] == '#' else ''
+        self.replace(start, end, value)
+
+    def block(self, name):
+        """Body of a block (the lines between the tags, edits included), None when absent."""
+        entry = self.blocks.get(name.lower())
+        if entry is None:
+            added = self._appended.get(('block', name.lower()))
+            return None if added is None else added[1]
+        return self._current(entry[1], entry[2])
+
+    def set_block(self, name, body):
+        """Replaces the body of a block; a missing block is added at the end of the file."""
+        if body and not body.endswith('\n'):
+            body += '\n'
+        entry = self.blocks.get(name.lower())
+        if entry is None:
+            self._appended[('block', name.lower())] = (name, body)
+            return
+        self.replace(entry[1], entry[2], body)
+
+    def set_block_values(self, name, values):
+        """
+        Sets values of '<label> <key> <value> <key> <value> ...' lines of a block,
+        like Hubbard.U.values, values being {label: {key: value}}. Only the value
+        fields change. Raises ValueError for a label or key that is not in the block.
+        """
+        entry = self.blocks.get(name.lower())
+        if entry is None:
+            raise ValueError(f'No <{name} block in the OpenMX input.')
+        _, body_start, body_end = entry
+        for label, pairs in values.items():
+            line = re.compile(r'^[ \t]*' + re.escape(label) + r'[ \t]+([^#\n]*)', re.MULTILINE).search(
+                self.text, body_start, body_end)
+            if line is None:
+                raise ValueError(f'No line for {label} in <{name}.')
+            fields = {m.group(1): m.span(2) for m in _ORBITAL_VALUE.finditer(self.text, line.start(1), line.end(1))}
+            for key, value in pairs.items():
+                if key not in fields:
+                    raise ValueError(f'No {key} for {label} in <{name}.')
+                self.replace(*fields[key], f'{value:g}')
+
+    # --- edits OpenMX inputs commonly need ---
+    def set_spin_polarization(self, mode):
+        """scf.SpinPolarization: 'on', 'off' or 'nc'."""
+        self.set_keyword('scf.SpinPolarization', mode)
+
+    def set_kgrid(self, kgrid):
+        """scf.Kgrid from three integers."""
+        self.set_keyword('scf.Kgrid', ' '.join(str(int(k)) for k in kgrid))
+
+    def set_hubbard_u(self, u_values, j_values=None):
+        """
+        U (and J) in eV per species and orbital, e.g. {'Ho': {'1f': 6.0}}, in the
+        Hubbard.U.values (Hubbard.J.values) block; scf.Hubbard.U is switched on
+        when a value is not zero.
+        """
+        self.set_block_values('Hubbard.U.values', u_values)
+        if j_values:
+            self.set_block_values('Hubbard.J.values', j_values)
+        if any(v for pairs in u_values.values() for v in pairs.values()):
+            self.set_keyword('scf.Hubbard.U', 'on')
+
+    # --- output ---
+    def chunks(self):
+        """The edited document as a sequence of strings: unchanged slices and the edits."""
+        pos = 0
+        for start in sorted(self._edits):
+            end, new_text = self._edits[start]
+            yield self.text[pos:start]
+            yield new_text
+            pos = end
+        yield self.text[pos:]
+        if self._appended:
+            if self.text and not self.text.endswith('\n'):
+                yield '\n'
+            for (kind, _), (name, value) in self._appended.items():
+                if kind == 'keyword':
+                    yield f'{name:<{KEYWORD_COLUMN - 1}} {value}\n'
+                else:
+                    yield f'\n<{name}\n{value}{name}>\n'
+
+    def to_string(self):
+        return ''.join(self.chunks())
+
+    def __str__(self):
+        return self.to_string()
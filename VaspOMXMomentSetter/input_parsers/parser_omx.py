@@ -114,8 +114,8 @@ def map_xc_functional(openmx_xc):
     omx_xc = openmx_xc.lower()
     if 'pbe' in omx_xc:
         return {'GGA': 'PE'}
-    elif 'lda' in omx_xc: # Might need more specific LDA checks (e.g., 'CA-PZ')
-        return {'LDAU_LUA': '.FALSE.'} # Placeholder for LDA, VASP default is LDA if no GGA tag
+    elif 'lda' in omx_xc or 'lsda' in omx_xc: # LDA|LSDA-CA|LSDA-PW
+        return {'GGA': 'CA'} # Ceperley-Alder LDA
     #elif 'scan' in omx_xc:
     #     return {'METAGGA': 'SCAN'}
     # Add more mappings as needed
@@ -129,8 +129,11 @@ def map_orbital_to_l(orbital_char):
     return mapping.get(orbital_char.lower(), -1) # Return -1 for unknown/no U
 
 # --- Main Parsing Logic ---
-def parse_openmx_dat(file_content):
-    """Parses the OpenMX .dat file and extracts relevant information."""
+def parse_openmx_dat(file_content, lines=None):
+    """
+    Parses the OpenMX .dat file and extracts relevant information.
+    lines: the lines of file_content if already indexed (e.g. a LineIndex), else split here.
+    """
     data = {
         #'system_name': os.path.splitext(os.path.basename(filepath))[0],
         'system_name': 'system_name',
@@ -138,6 +141,7 @@ def parse_openmx_dat(file_content):
         'species_map': {}, # { 'Species': {'count': N, 'atoms': [{'pos':[], 'initial_spin':[]}, ...], 'ldau': {'L':val,'U':val,'J':val or None} }, ... }
         'kgrid': None,
         'spin_pol': 'off', # 'off', 'on', 'nc'
+        'spinorbit': 'off', # scf.SpinOrbit.Coupling 'on' or 'off'
         'energy_cutoff': None, # in eV
         'xc_type': 'GGA-PBE', # Default
         'scf_criterion': 1.0e-7, # Default
@@ -147,7 +151,8 @@ def parse_openmx_dat(file_content):
     }
     species_order_in_block = [] # Track the order species appear in Atoms.SpeciesAndNotations
 
-    lines = file_content.split('\n')
+    if lines is None:
+        lines = file_content.split('\n')
 
     i = 0
     # iterate through lines
@@ -230,6 +235,10 @@ def parse_openmx_dat(file_content):
                 else:
                     print(f"Warning: Unknown scf.SpinPolarization setting: {parts[1]}. Assuming 'off'.")
 
+        elif keyword == 'scf.spinorbit.coupling':
+            if len(parts) > 1:
+                data['spinorbit'] = parts[1].split()[0].lower()
+
         # --- Energy Cutoff ---
         elif keyword == 'scf.energycutoff': # Typically in Hartree in OpenMX
             if len(parts) > 1:
@@ -374,9 +383,9 @@ def parse_openmx_dat(file_content):
 
 # Wrapper converter 
 # call parse_openmx_dat to read in *.dat file and conver the output to standardized formmat
-def simple_openmx_dat_parser(file_content):
+def simple_openmx_dat_parser(file_content, lines=None):
 
-    data = parse_openmx_dat(file_content)
+    data = parse_openmx_dat(file_content, lines)
 
     species_names = list(data['species_map'].keys())
     species_counts = [data['species_map'][s]['count'] for s in species_names]
@@ -410,6 +419,8 @@ def simple_openmx_dat_parser(file_content):
 
     coord_type = data['coord_type']
     is_cartesian = not coord_type.lower().startswith('f')
+    if coord_type.lower() == 'au':
+        coords = coords * 0.529177210903 # Bohr to Angstrom
 
     return lattice_matrix, species, coords, is_cartesian, magmom, valences, data
 
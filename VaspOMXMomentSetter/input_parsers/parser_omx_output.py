@@ -0,0 +1,96 @@
+"""
+Reader for the converged spin moments in an OpenMX output (*.out) file.
+
+The file is searched backwards in chunks for the last Mulliken population table
+(the one of the last SCF/MD step) and only that table is parsed, so time and
+memory do not depend on the length of the run.
+
+    Total spin moment (muB)     2.297486436   [Angles (Deg)  theta  phi]
+
+                    Up spin      Down spin     Sum           Diff      [theta  phi ...]
+          1    Fe     8.6487        6.3512     14.9999       2.2974    [...]
+"""
+import re
+import numpy as np
+from ..utils.stream_utils import open_binary, rfind_in_file, read_lines_from
+from ..utils.coordinate_transform import spherical_to_cartesian
+
+MULLIKEN_HEADER = b'Up spin'
+TOTAL_SPIN_KEY = b'Total spin moment (muB)'
+
+_FLOAT = re.compile(r'[-+]?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][-+]?\d+)?')
+
+
+def _parse_total_line(line):
+    """'Total spin moment (muB) [=] m [Angles (Deg) theta phi]' -> (m, [theta, phi] or None)."""
+    rest = line.split('(muB)', 1)[1]
+    values = [float(x) for x in _FLOAT.findall(rest)]
+    if not values:
+        raise ValueError(f'Cannot read the total spin moment from: {line.strip()}')
+    return values[0], (values[1:3] if 'Angles' in rest and len(values) >= 3 else None)
+
+
+def _read_table(lines):
+    """
+    Rows of a Mulliken table, lines positioned after its header.
+    None if the file ends before the table does (output still being written).
+    """
+    species, rows = [], []
+    for line in lines:
+        parts = line.split()
+        if not parts:
+            if rows:
+                return species, rows
+            continue
+        if not parts[0].isdigit():
+            return (species, rows) if rows else None
+        if not line.endswith('\n') or len(parts) < 6:
+            return None # last line, cut off while being written
+        species.append(parts[1])
+        rows.append([float(x) for x in parts[2:]])
+    return None
+
+
+def read_openmx_moments(source, natoms=None):
+    """
+    Converged spin moments from the last Mulliken table of an OpenMX .out file.
+    Returns a dict with 'moments' (N-by-3 array in the app's convention:
+    collinear [Diff, 0, 0], non-collinear Diff along (theta, phi)), 'mag_type',
+    'species', 'total' (the reported total spin moment) and 'total_angles'
+    ([theta, phi] of the total for non-collinear runs, else None).
+    A table cut off at the end of the file is skipped for the previous one.
+    """
+    with open_binary(source) as f:
+        end = None
+        while True:
+            # the total line right above the table is the anchor: the decomposed
+            # populations further down repeat the 'Up spin' header per atom
+            pos = rfind_in_file(f, TOTAL_SPIN_KEY, end)
+            if pos < 0:
+                raise ValueError('No Mulliken population table in the OpenMX output '
+                                 '(finished and spin polarized?)')
+            lines = read_lines_from(f, pos)
+            total_line = next(lines)
+            header_line = next((line for line in lines if line.strip()), '')
+            table = _read_table(lines) if MULLIKEN_HEADER.decode() in header_line else None
+            if table is not None:
+                break
+            end = pos
+
+    total, total_angles = _parse_total_line(total_line)
+    species, rows = table
+    if natoms is not None and len(rows) != natoms:
+        raise ValueError(f'The OpenMX output has {len(rows)} atoms, the structure has {natoms}.')
+    ncols = min(len(row) for row in rows)
+    values = np.array([row[:ncols] for row in rows])
+    diff = values[:, 3]
+
+    moments = np.zeros((len(rows), 3))
+    # non-collinear tables carry the spin angles after Diff
+    noncollinear = ncols >= 6
+    if noncollinear:
+        moments[:] = np.column_stack(spherical_to_cartesian(diff, values[:, 4], values[:, 5]))
+    else:
+        moments[:, 0] = diff
+    return {'moments': moments, 'mag_type': 'noncollinear' if noncollinear else 'collinear',
+            'species': species, 'total': total, 'total_angles': total_angles}
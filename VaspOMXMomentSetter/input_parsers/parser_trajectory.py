@@ -0,0 +1,118 @@
+"""
+Readers for trajectories: positions per step from an XDATCAR, moments per step
+from an OUTCAR (every 'magnetization (x)' table) or a .npy array.
+
+Frames are produced one at a time from a file object, so a long run never has
+to be in memory as a whole; session/trajectory.py writes them to the frame cache.
+"""
+import os
+import numpy as np
+from ..utils.stream_utils import open_binary, read_lines_from, find_in_file, count_in_file
+from .parser_vasp_output import OUTCAR_MAG_HEADER, _read_outcar_components, _to_moment_array
+
+XDATCAR_FRAME_KEY = b'configuration='
+
+
+def _read_xdatcar_header(lines, first_line=None):
+    """
+    Comment, scale, lattice, element names and counts of an XDATCAR (repeated
+    before every frame when the cell changes). Returns (lattice, species).
+    """
+    if first_line is None:
+        next(lines) # comment
+    scale = float(next(lines).split()[0])
+    lattice = np.array([[float(x) for x in next(lines).split()[:3]] for _ in range(3)])
+    if scale < 0: # negative scale is the cell volume
+        scale = (-scale / abs(np.linalg.det(lattice)))**(1/3)
+    names = next(lines).split()
+    if all(name.isdigit() for name in names):
+        raise ValueError('XDATCAR without element names (VASP 4 format) is not supported')
+    counts = [int(x) for x in next(lines).split()]
+    species = []
+    for name, count in zip(names, counts):
+        species.extend([name] * count)
+    return lattice * scale, species
+
+
+def count_xdatcar_frames(source):
+    """Number of frames (configurations) in an XDATCAR, counted without parsing."""
+    with open_binary(source) as f:
+        return count_in_file(f, XDATCAR_FRAME_KEY)
+
+
+def read_xdatcar_species(source):
+    """Species list (one per atom) and first lattice of an XDATCAR."""
+    with open_binary(source) as f:
+        lattice, species = _read_xdatcar_header(read_lines_from(f, 0))
+    return species, lattice
+
+
+def iter_xdatcar_frames(source):
+    """
+    Yields (lattice, cartesian positions) per frame of an XDATCAR, constant or
+    variable cell. A frame cut off at the end of the file is not yielded.
+    """
+    with open_binary(source) as f:
+        lines = read_lines_from(f, 0)
+        lattice, species = _read_xdatcar_header(lines)
+        natoms = len(species)
+        for line in lines:
+            if not line.strip():
+                continue
+            if XDATCAR_FRAME_KEY.decode() not in line:
+                # variable cell: a new header before the frame
+                lattice, _species = _read_xdatcar_header(lines, first_line=line)
+                continue
+            rows = [row for _, row in zip(range(natoms), lines)]
+            if len(rows) < natoms or not rows[-1].endswith('\n'):
+                return
+            try:
+                frac = np.array(' '.join(rows).split(), dtype=float).reshape(natoms, -1)[:, :3]
+            except ValueError:
+                return
+            yield lattice, frac @ lattice
+
+
+def count_outcar_steps(source):
+    """Number of 'magnetization (x)' tables (ionic steps with moments) in an OUTCAR."""
+    with open_binary(source) as f:
+        return count_in_file(f, OUTCAR_MAG_HEADER)
+
+
+def iter_outcar_moments(source, natoms=None):
+    """
+    Yields (N-by-3 moments, mag_type) for every ionic step of an OUTCAR, in the
+    app's convention. Stops at a table cut off at the end of the file.
+    """
+    with open_binary(source) as f:
+        pos = find_in_file(f, OUTCAR_MAG_HEADER)
+        while pos >= 0:
+            lines = read_lines_from(f, pos)
+            next(lines) # the title line
+            try:
+                components = _read_outcar_components(lines)
+                if len(components) == 2:
+                    return
+                moments, mag_type = _to_moment_array(components, natoms)
+            except (ValueError, IndexError):
+                return
+            yield moments, mag_type
+            pos = find_in_file(f, OUTCAR_MAG_HEADER, pos + len(OUTCAR_MAG_HEADER))
+
+
+def load_moment_steps(source):
+    """
+    Moments per step from a .npy file: (steps, N) collinear or (steps, N, 3).
+    Returns (array, mag_type); a path is memory-mapped, not read.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        array = np.load(source, mmap_mode='r')
+    else:
+        with open_binary(source) as f:
+            f.seek(0)
+            array = np.load(f)
+    if array.ndim == 2:
+        return array, 'collinear'
+    if array.ndim == 3 and array.shape[2] == 3:
+        return array, 'noncollinear'
+    raise ValueError(f'Expected moments of shape (steps, atoms) or (steps, atoms, 3), got {array.shape}')
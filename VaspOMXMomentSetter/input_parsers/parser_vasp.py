@@ -1,8 +1,12 @@
 import numpy as np
 
-def simple_poscar_parser(file_content):
-    """A lightweight POSCAR parser that returns a SimpleStructure object."""
-    lines = file_content.split('\n')
+def simple_poscar_parser(file_content, lines=None):
+    """
+    A lightweight POSCAR parser that returns a SimpleStructure object.
+    lines: the lines of file_content if already indexed (e.g. a LineIndex), else split here.
+    """
+    if lines is None:
+        lines = file_content.split('\n')
 
     scaling_factor = float(lines[1])
 
@@ -19,7 +23,8 @@ def simple_poscar_parser(file_content):
     num_atoms = sum(counts)
     coord_type = lines[7].strip().lower()
 
-    coords = np.array([list(map(float, line.split())) for line in lines[8:8+num_atoms]])
+    # C parser reading line by line, no list of lists of floats for large cells
+    coords = np.loadtxt((lines[i] for i in range(8, 8+num_atoms)), usecols=(0, 1, 2), ndmin=2)
 
     is_cartesian = coord_type.startswith('c') or coord_type.startswith('k')
 
@@ -0,0 +1,188 @@
+"""
+Readers for the magnetization VASP converged to, to be used as the next starting MAGMOM.
+
+All readers stream: the files are searched backwards in chunks for the last
+block and only that block is parsed (the vasprun.xml array with an incremental
+XML parser). Time and memory depend on the size of the block, not of the file.
+
+Moments come back as an N-by-3 array in the app's convention:
+collinear [m, 0, 0] rows, non-collinear [mx, my, mz] rows.
+"""
+import numpy as np
+from ..utils.stream_utils import CHUNK_SIZE, open_binary, rfind_in_file, read_lines_from
+
+OUTCAR_MAG_HEADER = b' magnetization (x)'
+OSZICAR_MAG_KEY = b'mag='
+VASPRUN_MAG_TAG = b'<varray name="magnetization"'
+VASPRUN_VARRAY_END = b'</varray>'
+
+
+def _to_moment_array(components, natoms):
+    """[x] or [x, y, z] lists of per-atom values -> (N-by-3 array, mag_type)."""
+    n = len(components[0])
+    if natoms is not None and n != natoms:
+        raise ValueError(f'Magnetization has {n} atoms, the structure has {natoms}.')
+    moments = np.zeros((n, 3))
+    if len(components) == 1:
+        moments[:, 0] = components[0]
+        return moments, 'collinear'
+    moments[:] = np.column_stack(components)
+    return moments, 'noncollinear'
+
+
+def _read_outcar_block(lines):
+    """Per-atom 'tot' column of one magnetization table, lines positioned after its title."""
+    for line in lines:
+        if line.startswith('---'):
+            break
+    values = []
+    for line in lines:
+        if line.startswith('---'):
+            break
+        # '# of ion  s  p  d  (f)  tot': the total is always the last column
+        values.append(float(line.split()[-1]))
+    return values
+
+
+def _read_outcar_components(lines):
+    """
+    [x] or [x, y, z] per-atom lists of one step: the (x) table, lines positioned
+    after its title, plus the (y), (z) tables that follow it in non-collinear runs.
+    """
+    components = [_read_outcar_block(lines)]
+    for axis in 'yz':
+        title = None
+        for line in lines:
+            stripped = line.strip()
+            if stripped and not stripped.startswith('tot'):
+                title = stripped
+                break
+        if title != f'magnetization ({axis})':
+            break
+        components.append(_read_outcar_block(lines))
+    return components
+
+
+def read_outcar_magnetization(source, natoms=None):
+    """
+    Last 'magnetization (x)' table of an OUTCAR plus the (y), (z) tables that
+    follow it in non-collinear runs. Needs LORBIT >= 10 in the calculation.
+    Returns (N-by-3 array, mag_type).
+    """
+    with open_binary(source) as f:
+        start = rfind_in_file(f, OUTCAR_MAG_HEADER)
+        if start < 0:
+            raise ValueError('No "magnetization (x)" table in OUTCAR (was LORBIT set?)')
+        lines = read_lines_from(f, start)
+        next(lines) # the title line
+        components = _read_outcar_components(lines)
+    if len(components) == 2:
+        raise ValueError('OUTCAR ends inside the non-collinear magnetization tables')
+    return _to_moment_array(components, natoms)
+
+
+def read_oszicar_magnetization(source):
+    """
+    Total magnetization of the last ionic step in an OSZICAR: a float for
+    collinear runs, [mx, my, mz] for non-collinear ones. OSZICAR has no per-atom values.
+    """
+    with open_binary(source) as f:
+        start = rfind_in_file(f, OSZICAR_MAG_KEY)
+        if start < 0:
+            raise ValueError('No "mag=" entry in OSZICAR (was the run spin polarized?)')
+        line = next(read_lines_from(f, start + len(OSZICAR_MAG_KEY)))
+    values = [float(x) for x in line.split()]
+    return values[0] if len(values) == 1 else values
+
+
+def _parse_varray_at(f, offset, chunk_size=CHUNK_SIZE):
+    """
+    Rows of the <varray> starting at offset, fed chunk by chunk to an incremental
+    XML parser up to its closing tag. None if the file ends before it closes.
+    """
+    # only vasprun.xml needs the XML parser
+    import xml.etree.ElementTree as ET
+    parser = ET.XMLPullParser(events=('end',))
+    f.seek(offset)
+    tail = b''
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return None
+        # the closing tag may be cut by the chunk boundary
+        data = tail + chunk
+        close = data.find(VASPRUN_VARRAY_END)
+        if close >= 0:
+            parser.feed(data[:close + len(VASPRUN_VARRAY_END)])
+            break
+        keep = len(VASPRUN_VARRAY_END) - 1
+        parser.feed(data[:-keep])
+        tail = data[-keep:]
+    for _event, elem in parser.read_events():
+        if elem.tag == 'varray':
+            return [[float(x) for x in v.text.split()] for v in elem]
+    return None
+
+
+def read_vasprun_magnetization(source, natoms=None):
+    """
+    Last <varray name="magnetization"> of a vasprun.xml: found by searching
+    backwards, then only that array is parsed (incrementally). A vasprun.xml
+    cut off by a running job gives the last complete array.
+    Returns (N-by-3 array, mag_type).
+    """
+    with open_binary(source) as f:
+        end = None
+        while True:
+            start = rfind_in_file(f, VASPRUN_MAG_TAG, end)
+            if start < 0:
+                raise ValueError('No complete <varray name="magnetization"> in vasprun.xml')
+            last = _parse_varray_at(f, start)
+            if last is not None:
+                break
+            print('Last magnetization in vasprun.xml is incomplete, using the one before')
+            end = start
+    rows = np.array(last, dtype=float)
+    if rows.ndim != 2 or rows.shape[1] not in (1, 3):
+        raise ValueError(f'Expected 1 or 3 magnetization values per atom, got shape {rows.shape}')
+    return _to_moment_array([rows[:, i] for i in range(rows.shape[1])], natoms)
+
+
+def sniff_vasp_output(source):
+    """'vasprun', 'outcar' or 'oszicar' from the first bytes of a file, None if unknown."""
+    with open_binary(source) as f:
+        f.seek(0)
+        head = f.read(4096)
+        f.seek(0)
+    if head.lstrip().startswith(b'<?xml') or b'<modeling>' in head:
+        return 'vasprun'
+    if b' vasp.' in head or b'POTCAR:' in head:
+        return 'outcar'
+    if b'F=' in head or (b' dE ' in head and b'ncg' in head):
+        return 'oszicar'
+    return None
+
+
+def read_vasp_magnetization(source, natoms=None):
+    """
+    Converged magnetization from an OUTCAR, vasprun.xml or OSZICAR (detected
+    from the content). Returns a dict with 'format', 'moments' (N-by-3 array,
+    None for OSZICAR), 'mag_type' and 'total' (summed or reported total moment).
+    """
+    with open_binary(source) as f:
+        kind = sniff_vasp_output(f)
+        if kind == 'oszicar':
+            total = read_oszicar_magnetization(f)
+            return {'format': 'OSZICAR', 'moments': None, 'total': total,
+                    'mag_type': 'collinear' if np.isscalar(total) else 'noncollinear'}
+        if kind == 'outcar':
+            moments, mag_type = read_outcar_magnetization(f, natoms)
+            name = 'OUTCAR'
+        elif kind == 'vasprun':
+            moments, mag_type = read_vasprun_magnetization(f, natoms)
+            name = 'vasprun.xml'
+        else:
+            raise ValueError('Not an OUTCAR, vasprun.xml or OSZICAR file')
+    total = moments.sum(axis=0)
+    return {'format': name, 'moments': moments, 'mag_type': mag_type,
+            'total': float(total[0]) if mag_type == 'collinear' else total.tolist()}
@@ -1,31 +1,57 @@
-import base64
 import numpy as np
 from VaspOMXMomentSetter.input_parsers.parser_omx import simple_openmx_dat_parser
 from VaspOMXMomentSetter.input_parsers.parser_vasp import simple_poscar_parser
+from VaspOMXMomentSetter.utils.stream_utils import open_buffer, LineIndex
+from VaspOMXMomentSetter.utils.upload_utils import decode_upload
 #from VaspOMXMomentSetter.input_parsers.parser_class import SimpleStructure
 
-def input_parser(contents):
-    """Parses POSCAR content string into a pymatgen Structure object."""
-    _content_type, content_string = contents.split(',')
-    decoded = base64.b64decode(content_string)
+OMX_COORDS_TAG = b'<Atoms.SpeciesAndCoordinates'
+
+
+def input_parser(contents, max_size=None):
+    """
+    Parses an uploaded POSCAR or OpenMX *.dat (dcc.Upload data URL).
+    The base64 text is decoded chunk by chunk into one buffer that the parsers
+    read lines from directly. Returns None if the file can't be read or is
+    larger than max_size bytes.
+    """
+    try:
+        buffer = decode_upload(contents, max_size)
+    except ValueError as e:
+        print(f"Error parsing input file: {e}")
+        return None
+    return parse_structure(buffer)
+
+
+def parse_structure(source):
+    """
+    POSCAR or OpenMX *.dat from a path (memory-mapped), bytes or BytesIO.
+    Lines are decoded from the buffer when the parsers ask for them, so the
+    only full copy is the text kept for creating output ('file_str').
+    """
     try:
-        #structure = Structure.from_str(decoded.decode('utf-8'), fmt="poscar")
-        #return structure
-        file_content = decoded.decode('utf-8')
-        # find if the coordinates section exists
-        if '<Atoms.SpeciesAndCoordinates' in file_content:
-            print('Read from OpenMX *.dat input')
-            # data stores all omx settings
-            lattice_matrix, species, coords, is_cartesian, magmom, n_valence, data = simple_openmx_dat_parser(file_content)
-            print(f"spin polarization : {data['spin_pol']}")
-            input_type ='omx'
-        else:
-            print('Read in POSCAR (vasp)')
-            lattice_matrix, species, coords, is_cartesian = simple_poscar_parser(file_content)
-            magmom = None 
-            n_valence = None 
-            data = None
-            input_type ='poscar'
+        with open_buffer(source) as buffer:
+            lines = LineIndex(buffer)
+            try:
+                #structure = Structure.from_str(decoded.decode('utf-8'), fmt="poscar")
+                #return structure
+                file_content = str(lines.buffer, 'utf-8')
+                # find if the coordinates section exists
+                if OMX_COORDS_TAG.decode() in file_content:
+                    print('Read from OpenMX *.dat input')
+                    # data stores all omx settings
+                    lattice_matrix, species, coords, is_cartesian, magmom, n_valence, data = simple_openmx_dat_parser(file_content, lines)
+                    print(f"spin polarization : {data['spin_pol']}")
+                    input_type ='omx'
+                else:
+                    print('Read in POSCAR (vasp)')
+                    lattice_matrix, species, coords, is_cartesian = simple_poscar_parser(file_content, lines)
+                    magmom = None 
+                    n_valence = None 
+                    data = None
+                    input_type ='poscar'
+            finally:
+                lines.release()
 
         # group data
         crystal_data ={
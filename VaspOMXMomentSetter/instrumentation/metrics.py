@@ -0,0 +1,94 @@
+import bisect
+import threading
+from collections import defaultdict
+
+# Histogram upper bounds (the +Inf bucket is implicit)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BYTES_BUCKETS = (1e2, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+
+METRIC_PREFIX = 'moment_setter_callback'
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else f'{bound:g}'
+            lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum:.6g}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class CallbackMetrics:
+    """In-process metrics of all instrumented callbacks, keyed by callback name."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations = defaultdict(lambda: Histogram(DURATION_BUCKETS))
+        self.input_bytes = defaultdict(lambda: Histogram(BYTES_BUCKETS))
+        self.output_bytes = defaultdict(lambda: Histogram(BYTES_BUCKETS))
+        self.errors = defaultdict(int)
+
+    def observe(self, callback_name, duration, input_bytes, output_bytes, failed):
+        with self.lock:
+            self.durations[callback_name].observe(duration)
+            if input_bytes is not None:
+                self.input_bytes[callback_name].observe(input_bytes)
+            if output_bytes is not None:
+                self.output_bytes[callback_name].observe(output_bytes)
+            if failed:
+                self.errors[callback_name] += 1
+            else:
+                self.errors.setdefault(callback_name, 0)
+
+    def render_prometheus(self):
+        """All metrics in the Prometheus text exposition format."""
+        families = [
+            (f'{METRIC_PREFIX}_duration_seconds', 'Wall time of the callback.', self.durations),
+            (f'{METRIC_PREFIX}_input_bytes', 'Size of the callback request payload.', self.input_bytes),
+            (f'{METRIC_PREFIX}_output_bytes', 'Size of the serialized callback result.', self.output_bytes),
+        ]
+        lines = []
+        with self.lock:
+            for name, help_text, histograms in families:
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for callback_name in sorted(histograms):
+                    lines.extend(histograms[callback_name].render(name, f'callback="{callback_name}"'))
+            name = f'{METRIC_PREFIX}_errors_total'
+            lines.append(f'# HELP {name} Callbacks that raised an exception.')
+            lines.append(f'# TYPE {name} counter')
+            for callback_name in sorted(self.errors):
+                lines.append(f'{name}{{callback="{callback_name}"}} {self.errors[callback_name]}')
+        return '\n'.join(lines) + '\n'
+
+
+# one registry per server process
+callback_metrics = CallbackMetrics()
+
+
+def register_metrics_route(server, metrics=callback_metrics, path='/metrics'):
+    """Exposes the metrics on the Flask server of the Dash app."""
+    from flask import Response
+
+    def metrics_view():
+        return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+    if 'moment_setter_metrics' not in server.view_functions:
+        server.add_url_rule(path, 'moment_setter_metrics', metrics_view)
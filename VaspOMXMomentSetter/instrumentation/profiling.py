@@ -0,0 +1,135 @@
+import cProfile
+import functools
+import itertools
+import os
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+
+# number of top allocation sites written to the report
+TOP_ALLOCATIONS = 25
+
+# cProfile and tracemalloc are process-global, profile one callback at a time
+_profile_lock = threading.Lock()
+# keeps report names unique within the same second
+_report_counter = itertools.count()
+
+
+def _parse_names(value):
+    """'all', '' or a comma separated list of callback names -> set or 'all'."""
+    value = (value or '').strip()
+    if value.lower() == 'all':
+        return 'all'
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+def _selected(name, names):
+    return names == 'all' or name in names
+
+
+def _query_selection():
+    """
+    Callback names requested with ?profile=... on the page URL. Dash callbacks are
+    POSTs, the page URL (with its query) arrives as the Referer header.
+    """
+    from flask import has_request_context, request
+    if not has_request_context() or not request.referrer:
+        return set()
+    values = parse_qs(urlparse(request.referrer).query).get('profile')
+    if not values:
+        return set()
+    if values[0].strip().lower() in ('1', 'true', 'on'):
+        return 'all'
+    return _parse_names(values[0])
+
+
+def _structure_size(args, output):
+    """Number of atoms found in the callback arguments or result, None if unknown."""
+    candidates = list(args)
+    candidates.extend(output if isinstance(output, (tuple, list)) else [output])
+    for value in candidates:
+        if isinstance(value, dict) and isinstance(value.get('species'), list):
+            return len(value['species'])
+    return None
+
+
+def _rotate(profile_dir, keep):
+    """Keeps only the newest `keep` reports of each kind in profile_dir."""
+    for pattern in ('*.prof', '*.alloc.txt'):
+        files = sorted(profile_dir.glob(pattern), key=lambda p: p.stat().st_mtime)
+        for old in files[:-keep] if keep > 0 else files:
+            try:
+                old.unlink()
+            except OSError:
+                pass
+
+
+def _write_reports(profile_dir, keep, name, natoms, profiler, snapshot, peak_bytes, duration):
+    profile_dir.mkdir(parents=True, exist_ok=True)
+    size_tag = f'{natoms}atoms' if natoms is not None else 'unknown-size'
+    stem = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_report_counter)}_{name}_{size_tag}"
+
+    profiler.dump_stats(str(profile_dir / f'{stem}.prof'))
+
+    lines = [f'callback: {name}',
+             f'atoms: {natoms}',
+             f'wall time: {duration:.4f} s',
+             f'peak traced memory: {peak_bytes / 1024**2:.2f} MiB',
+             '',
+             f'top {TOP_ALLOCATIONS} allocation sites:']
+    for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]:
+        lines.append(str(stat))
+    (profile_dir / f'{stem}.alloc.txt').write_text('\n'.join(lines) + '\n')
+
+    _rotate(profile_dir, keep)
+    print(f'Profile of {name} written to {profile_dir / stem}.*')
+
+
+def make_profiling_wrapper(config):
+    """
+    Returns a wrap(func) function for InstrumentedApp. Callbacks named in
+    config['profile_callbacks'] are always profiled; with config['profile_query_flag']
+    a page opened as ?profile=1 (or ?profile=name1,name2) profiles on demand.
+    """
+    env_names = _parse_names(config['profile_callbacks'])
+    allow_query = config['profile_query_flag']
+    profile_dir = Path(config['profile_dir'])
+    keep = config['profile_keep']
+
+    def wrap(func):
+        name = func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            wanted = _selected(name, env_names) or (allow_query and _selected(name, _query_selection()))
+            if not wanted:
+                return func(*args, **kwargs)
+
+            with _profile_lock:
+                started_tracing = not tracemalloc.is_tracing()
+                if started_tracing:
+                    tracemalloc.start()
+                tracemalloc.reset_peak()
+                profiler = cProfile.Profile()
+                output = None
+                start = time.perf_counter()
+                try:
+                    output = profiler.runcall(func, *args, **kwargs)
+                    return output
+                finally:
+                    duration = time.perf_counter() - start
+                    snapshot = tracemalloc.take_snapshot()
+                    peak_bytes = tracemalloc.get_traced_memory()[1]
+                    if started_tracing:
+                        tracemalloc.stop()
+                    try:
+                        _write_reports(profile_dir, keep, name, _structure_size(args, output),
+                                       profiler, snapshot, peak_bytes, duration)
+                    except OSError as e:
+                        print(f'Could not write profile of {name}: {e}')
+
+        return wrapper
+
+    return wrap
@@ -0,0 +1,71 @@
+import functools
+import time
+from dash.exceptions import PreventUpdate
+from .metrics import callback_metrics
+
+
+def _payload_bytes(value):
+    """Size of a value serialized the way Dash sends it, None if it can't be serialized."""
+    from plotly.io.json import to_json_plotly
+    try:
+        return len(to_json_plotly(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _request_bytes():
+    """Size of the current callback request body, None outside a request."""
+    from flask import has_request_context, request
+    if has_request_context():
+        return request.content_length
+    return None
+
+
+def instrument_callback(func, metrics=callback_metrics):
+    """Wraps a callback function to record wall time, payload sizes and errors."""
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        failed = True
+        output = None
+        try:
+            output = func(*args, **kwargs)
+            failed = False
+            return output
+        except PreventUpdate:
+            # a deliberate "no change", not an error
+            failed = False
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            metrics.observe(name, duration, _request_bytes(),
+                            None if failed else _payload_bytes(output), failed)
+
+    return wrapper
+
+
+class InstrumentedApp:
+    """
+    Stand-in for the Dash app passed to the register_*_callbacks functions.
+    Every function registered through .callback() is wrapped first, all other
+    attributes are forwarded to the real app.
+    """
+
+    def __init__(self, app, wrappers):
+        self._app = app
+        self._wrappers = list(wrappers)
+
+    def callback(self, *args, **kwargs):
+        decorator = self._app.callback(*args, **kwargs)
+
+        def register(func):
+            for wrap in self._wrappers:
+                func = wrap(func)
+            return decorator(func)
+
+        return register
+
+    def __getattr__(self, name):
+        return getattr(self._app, name)
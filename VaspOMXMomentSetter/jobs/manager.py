@@ -0,0 +1,252 @@
+"""
+Background jobs for the slow callbacks (file parsing, poscar2openmx).
+
+Jobs run in subprocesses through Dash's DiskcacheManager. On top of it, JobManager
+  - runs identical in-flight jobs once: a request with the cache key of a running
+    job attaches to it instead of starting another process,
+  - only kills a job on cancel when no other request is still waiting for it,
+  - caps how many heavy jobs compute at the same time.
+All bookkeeping lives in the disk cache, so it holds across job processes and
+gunicorn workers sharing the cache directory.
+"""
+import contextlib
+import functools
+import os
+import threading
+import time
+from dash import DiskcacheManager
+
+# shared table {job token: start time} of the heavy jobs holding a slot
+HEAVY_SLOTS_KEY = 'moment-setter-heavy-jobs'
+# seconds between checks for a free heavy-job slot
+SLOT_POLL_INTERVAL = 0.2
+# a job claimed but without a process after this many seconds is considered dead
+CLAIM_TIMEOUT = 10.0
+
+# Cache operations and job forks exclude each other: a job forked while another
+# thread is inside sqlite inherits its held mutexes and hangs on its first cache access.
+_cache_lock = threading.RLock()
+
+
+def _reset_cache_lock():
+    global _cache_lock
+    _cache_lock = threading.RLock()
+
+
+os.register_at_fork(after_in_child=_reset_cache_lock)
+
+
+def _fork_safe_cache(directory):
+    """diskcache.Cache whose operations used by the manager hold _cache_lock."""
+    import diskcache
+
+    class ForkSafeCache(diskcache.Cache):
+        def get(self, *args, **kwargs):
+            with _cache_lock:
+                return super().get(*args, **kwargs)
+
+        def set(self, *args, **kwargs):
+            with _cache_lock:
+                return super().set(*args, **kwargs)
+
+        def delete(self, *args, **kwargs):
+            with _cache_lock:
+                return super().delete(*args, **kwargs)
+
+        def touch(self, *args, **kwargs):
+            with _cache_lock:
+                return super().touch(*args, **kwargs)
+
+        @contextlib.contextmanager
+        def transact(self, retry=False):
+            with _cache_lock, super().transact(retry):
+                yield
+
+    return ForkSafeCache(directory)
+
+
+class JobManager(DiskcacheManager):
+    """DiskcacheManager with in-flight deduplication and a cap on heavy jobs."""
+
+    def __init__(self, cache, max_heavy_jobs=2, record_expire=3600):
+        super().__init__(cache)
+        self.max_heavy_jobs = max_heavy_jobs
+        self.record_expire = record_expire
+
+    # job records: '<key>-job' -> {'pid', 'refs', 'claimed'}, 'job-<pid>' -> key
+    @staticmethod
+    def _record_key(key):
+        return f'{key}-job'
+
+    def _set_record(self, key, record):
+        self.handle.set(self._record_key(key), record, expire=self.record_expire)
+
+    def _drop(self, key, record):
+        self.handle.delete(self._record_key(key))
+        self.handle.delete(self._make_progress_key(key))
+        if record and record['pid'] is not None:
+            self.handle.delete(f"job-{record['pid']}")
+
+    def _alive(self, key, record):
+        """True if the recorded job is starting, running or has its result waiting."""
+        if record['pid'] is None:
+            return time.time() - record['claimed'] < CLAIM_TIMEOUT
+        return self.result_ready(key) or self.job_running(record['pid'])
+
+    def call_job_fn(self, key, job_fn, args, context):
+        while True:
+            with self.handle.transact():
+                record = self.handle.get(self._record_key(key))
+                if record is None or not self._alive(key, record):
+                    # claim the key before starting, so concurrent requests attach
+                    self._drop(key, record)
+                    self.clear_cache_entry(key)
+                    self._set_record(key, {'pid': None, 'refs': 1, 'claimed': time.time()})
+                    break
+                if record['pid'] is not None:
+                    record['refs'] += 1
+                    self._set_record(key, record)
+                    print(f'Attached to running job {record["pid"]} ({record["refs"]} requests)')
+                    return record['pid']
+            # another request is starting this job right now
+            time.sleep(0.01)
+
+        with _cache_lock:
+            pid = super().call_job_fn(key, job_fn, args, context)
+        with self.handle.transact():
+            record = self.handle.get(self._record_key(key)) or {'refs': 1}
+            record.update(pid=pid, claimed=time.time())
+            self._set_record(key, record)
+            self.handle.set(f'job-{pid}', key, expire=self.record_expire)
+        return pid
+
+    def get_progress(self, key):
+        # not deleted after reading: every request attached to the job polls it
+        return self.handle.get(self._make_progress_key(key))
+
+    def get_result(self, key, job):
+        result = self.handle.get(key, self.UNDEFINED)
+        if result is self.UNDEFINED:
+            return self.UNDEFINED
+        with self.handle.transact():
+            record = self.handle.get(self._record_key(key))
+            refs = record['refs'] - 1 if record else 0
+            if refs > 0:
+                record['refs'] = refs
+                self._set_record(key, record)
+            else:
+                # last waiting request: clean up
+                self._drop(key, record)
+                self.clear_cache_entry(key)
+        if job:
+            super().terminate_job(job)
+        return result
+
+    def terminate_job(self, job):
+        if job is None:
+            return
+        with self.handle.transact():
+            key = self.handle.get(f'job-{job}')
+            record = self.handle.get(self._record_key(key)) if key else None
+            if record and not self.result_ready(key):
+                record['refs'] -= 1
+                if record['refs'] > 0:
+                    # cancelled by one request, still wanted by another
+                    self._set_record(key, record)
+                    return
+                self._drop(key, record)
+        super().terminate_job(job)
+
+    @contextlib.contextmanager
+    def heavy_job_slot(self, on_wait=None):
+        """
+        Holds one of max_heavy_jobs slots while the block runs; waits for a free one
+        first, calling on_wait(number of running jobs) while queued. Slots of dead
+        processes (e.g. cancelled jobs) are freed on the next check.
+        """
+        pid = os.getpid()
+        token = f'{pid}:{threading.get_ident()}'
+        while True:
+            with self.handle.transact():
+                slots = self.handle.get(HEAVY_SLOTS_KEY, {})
+                slots = {t: start for t, start in slots.items() if self.job_running(t.split(':')[0])}
+                if len(slots) < self.max_heavy_jobs:
+                    slots[token] = time.time()
+                    self.handle.set(HEAVY_SLOTS_KEY, slots)
+                    break
+                self.handle.set(HEAVY_SLOTS_KEY, slots)
+            if on_wait is not None:
+                on_wait(len(slots))
+            time.sleep(SLOT_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            with self.handle.transact():
+                slots = self.handle.get(HEAVY_SLOTS_KEY, {})
+                slots.pop(token, None)
+                self.handle.set(HEAVY_SLOTS_KEY, slots)
+
+
+def create_job_manager(config):
+    """JobManager on config['job_cache_dir'], None when background jobs are off or unavailable."""
+    if not config['background_callbacks']:
+        return None
+    try:
+        import diskcache # noqa: F401
+        import multiprocess # noqa: F401 (needed by DiskcacheManager)
+        import psutil # noqa: F401
+    except ImportError as e:
+        print(f'Background callbacks disabled, {e.name} is missing (pip install "dash[diskcache]")')
+        return None
+    cache = _fork_safe_cache(config['job_cache_dir'])
+    return JobManager(cache, config['max_heavy_jobs'], config['job_record_expire'])
+
+
+def _ignore_progress(_value):
+    pass
+
+
+_inline_slots = {}
+
+
+def _inline_slot(limit):
+    """Thread semaphore capping heavy callbacks when they run inside the web worker."""
+    # apps may be created from several threads: one semaphore per limit, shared by all
+    with _cache_lock:
+        if limit not in _inline_slots:
+            _inline_slots[limit] = threading.BoundedSemaphore(limit)
+        return _inline_slots[limit]
+
+
+def heavy_callback(app, manager, *args, progress, cancel, running=None, max_inline=2, **kwargs):
+    """
+    app.callback for a slow callback written as func(set_progress, *values), where
+    set_progress((value, max, label)) updates the three `progress` outputs.
+
+    With a JobManager the callback runs as a background job with progress,
+    cancel and deduplication, holding a heavy-job slot while it computes.
+    Without one (background callbacks off) it runs in the request as before,
+    progress calls are ignored and at most max_inline run at the same time.
+    """
+    def register(func):
+        if manager is None:
+            slot = _inline_slot(max_inline)
+
+            @functools.wraps(func)
+            def run_inline(*values):
+                with slot:
+                    return func(_ignore_progress, *values)
+            return app.callback(*args, **kwargs)(run_inline)
+
+        @functools.wraps(func)
+        def run_job(set_progress, *values):
+            def queued(n_running):
+                set_progress((0, 100, f'Queued: {n_running} job(s) running'))
+            with manager.heavy_job_slot(on_wait=queued):
+                return func(set_progress, *values)
+
+        return app.callback(*args, background=True, manager=manager, progress=progress,
+                            progress_default=[0, 100, ''], cancel=cancel, running=running,
+                            interval=500, **kwargs)(run_job)
+
+    return register
@@ -1,20 +1,37 @@
-from pathlib import Path
+"""
+Element colors and radii from VESTA's elements.ini.
+
+The table is compiled once into elements.json next to it (symbol, radius and
+color columns) and read from there; the .ini is parsed again only when it is
+newer than the compiled table or the table is missing. Nothing is read at
+import time, the first call loads the table and keeps it:
+
+    python -m VaspOMXMomentSetter.load_vesta_setup     # recompile elements.json
+"""
+import functools
+import json
 import os
+from pathlib import Path
 
-def load_vesta_colors():
+ELEMENTS_INI = Path(__file__).parent / 'elements.ini'
+ELEMENTS_TABLE = Path(__file__).parent / 'elements.json'
 
-    current_dir = Path(__file__).parent
+# used when elements.ini is not found or is empty
+FALLBACK_COLORS = {
+    "V": "yellow", "O": "red", "Mn": "purple", "Se": "green",
+    "C": "gray", "H": "white", "Fe": "orange", "N": "blue",
+    "S": "lightsalmon", "Si": "steelblue"
+}
 
-    filepath = current_dir / 'elements.ini'
 
+def parse_elements_ini(filepath=ELEMENTS_INI):
     """
-    Parses VESTA's element.ini file to create a color map.
-    Returns a dictionary mapping element symbols to 'rgb(r,g,b)' strings.
+    Parses VESTA's element.ini file into {'symbols': [...], 'radii': [...],
+    'colors': ['rgb(r,g,b)', ...]}, one entry per element line.
     """
-    color_map = {}
-    radii_dict = {}
+    table = {'symbols': [], 'radii': [], 'colors': []}
     if not os.path.exists(filepath):
-        return color_map # Return empty map if file doesn't exist
+        return table
 
     with open(filepath, 'r') as f:
         for line in f:
@@ -26,15 +43,62 @@ def load_vesta_colors():
             parts = line.split()
             try:
                 symbol = parts[1]
-                radii = parts[3]
-                r, g, b = parts[5], parts[6], parts[7]
+                radius = float(parts[3])
                 # limit the maximum to 0.99 to avoid display issues in scatter3d
-                r, g, b = min(float(r), 0.99), min(float(g), 0.99), min(float(b), 0.99)
-                color_map[symbol] = f'rgb({r},{g},{b})'
-                radii_dict[symbol] = radii
+                r, g, b = (min(float(c), 0.99) for c in parts[5:8])
             except (IndexError, ValueError):
                 # Ignore malformed lines
                 continue
+            table['symbols'].append(symbol)
+            table['radii'].append(radius)
+            table['colors'].append(f'rgb({r},{g},{b})')
+    return table
+
+
+def compile_element_table(ini_path=ELEMENTS_INI, table_path=ELEMENTS_TABLE):
+    """Writes the parsed elements.ini as compact JSON. Returns the table."""
+    table = parse_elements_ini(ini_path)
+    with open(table_path, 'w') as f:
+        json.dump(table, f, separators=(',', ':'))
+    return table
+
+
+def _is_current(table_path, ini_path):
+    try:
+        return os.path.getmtime(table_path) >= os.path.getmtime(ini_path)
+    except OSError:
+        # no .ini: the compiled table is all there is
+        return os.path.exists(table_path)
 
+
+@functools.lru_cache(maxsize=None)
+def element_table():
+    """The compiled element table, read on first use."""
+    if _is_current(ELEMENTS_TABLE, ELEMENTS_INI):
+        with open(ELEMENTS_TABLE) as f:
+            return json.load(f)
+    try:
+        return compile_element_table()
+    except OSError:
+        # read-only install: parse every start
+        return parse_elements_ini()
+
+
+@functools.lru_cache(maxsize=None)
+def load_vesta_colors():
+    """
+    Color map and radii of the elements: ({symbol: 'rgb(r,g,b)'}, {symbol: radius}).
+    """
+    table = element_table()
+    color_map = dict(zip(table['symbols'], table['colors']))
+    radii_dict = dict(zip(table['symbols'], table['radii']))
+
+    if not color_map:
+        print("WARNING: 'element.ini' not found or is empty. Using fallback colors.")
+        color_map = dict(FALLBACK_COLORS)
     return color_map, radii_dict
 
+
+if __name__ == '__main__':
+    table = compile_element_table()
+    print(f"{len(table['symbols'])} elements written to {ELEMENTS_TABLE}")
@@ -0,0 +1,254 @@
+"""
+Download bundles: a zip of one or many configurations, each with
+
+    <nnn>_<name>/POSCAR         structure, species grouped
+                 INCAR          ISPIN or LNONCOLLINEAR and MAGMOM (a fragment to merge)
+                 <name>.dat     the uploaded OpenMX input with the moments written in
+    manifest.json               name, species, mag_type, files and moments per configuration
+
+A bundle is described by a small spec (shelf keys of the structures, their
+moments) saved under a hash of its content:
+
+    <cache_dir>/<key>.spec.json
+    <cache_dir>/<key>.zip         after the first complete download
+
+The zip is written straight to the response one file at a time, so a bundle of
+hundreds of configurations never sits in memory, and is kept on disk while it
+streams; the next download of the same content is the cached file.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import zipfile
+import numpy as np
+from .structures import load_structure
+from ..input_creators.modify_openmx_moments import set_atom_spins, omx_input_coords
+from ..input_creators.omx_to_vasp import magnetic_tags, poscar_string, species_elements, species_groups
+from ..input_parsers.omx_document import OpenMXDocument
+from ..utils.moment_array import moments_to_array
+
+BUNDLE_FILENAME = 'moments_bundle.zip'
+# fixed timestamp of the zip entries: the same content gives the same bytes
+ZIP_DATE = (1980, 1, 1, 0, 0, 0)
+# compressed bytes collected before they are sent
+STREAM_CHUNK = 1 << 20
+
+_KEY_PATTERN = re.compile(r'[0-9a-f]{40}')
+
+
+def bundle_key(spec):
+    return hashlib.sha1(json.dumps(spec, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+
+def _path(cache_dir, key, suffix):
+    if not isinstance(key, str) or not _KEY_PATTERN.fullmatch(key):
+        raise ValueError(f'Invalid bundle key {key!r}')
+    return os.path.join(cache_dir, key + suffix)
+
+
+def configuration(moments, mag_type, key=None, structure=None, file_str=None, name=None):
+    """
+    One configuration of a bundle spec. key: shelf key of an uploaded structure
+    (session/structures.py); a structure that is not on the shelf (a trajectory
+    frame) is given inline as its store dict and file text. moments: natoms-by-3
+    cartesian, or None for the moments of the uploaded file.
+    """
+    item = {'key': key, 'mag_type': mag_type,
+            'moments': None if moments is None else np.asarray(moments, dtype=float).tolist()}
+    if key is None:
+        item.update(structure=structure, file_str=file_str, name=name or 'structure')
+    return item
+
+
+def save_bundle_spec(cache_dir, configurations, keep=32):
+    """Saves a spec (list of configuration()) and returns its key."""
+    spec = {'version': 1, 'configurations': configurations}
+    key = bundle_key(spec)
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _path(cache_dir, key, '.spec.json')
+    if os.path.exists(path):
+        os.utime(path)
+        return key
+    fd, tmp = tempfile.mkstemp(prefix='.spec-', dir=cache_dir)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(spec, f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    _prune(cache_dir, keep)
+    return key
+
+
+def load_bundle_spec(cache_dir, key):
+    try:
+        with open(_path(cache_dir, key, '.spec.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _prune(cache_dir, keep):
+    """Removes the spec and zip of the least recently used bundles beyond `keep`."""
+    used = {}
+    for name in os.listdir(cache_dir):
+        key = name.split('.', 1)[0]
+        if _KEY_PATTERN.fullmatch(key) and name != key:
+            used[key] = max(used.get(key, 0), os.path.getmtime(os.path.join(cache_dir, name)))
+    for key in sorted(used, key=used.get, reverse=True)[keep:]:
+        for suffix in ('.spec.json', '.zip'):
+            try:
+                os.unlink(os.path.join(cache_dir, key + suffix))
+            except FileNotFoundError:
+                pass
+
+
+def missing_structures(spec, structure_dir):
+    """Shelf keys of a spec whose structure has been evicted since."""
+    return [item['key'] for item in spec['configurations']
+            if item['key'] and not os.path.exists(os.path.join(structure_dir, f"{item['key']}.json"))]
+
+
+def _resolve(item, structure_dir):
+    """(name, structure dict, file text, is_omx, moments, mag_type) of a configuration."""
+    entry = None
+    if item['key'] is None:
+        name, structure, file_str = item['name'], item['structure'], item['file_str'] or ''
+    else:
+        entry = load_structure(structure_dir, item['key'])
+        if entry is None:
+            raise ValueError(f"Structure {item['key'][:8]} is no longer on the server.")
+        name, structure, file_str = entry['name'], entry['structure'], entry['file_str']
+    natoms = len(structure['species'])
+    if item['moments'] is not None:
+        moments, mag_type = np.array(item['moments'], dtype=float).reshape(natoms, 3), item['mag_type']
+    elif entry is not None:
+        moments = np.nan_to_num(moments_to_array(entry['moments']['cartesian'], natoms))
+        mag_type = entry['mag_type']
+    else:
+        moments, mag_type = np.zeros((natoms, 3)), item['mag_type']
+    is_omx = '<Atoms.SpeciesAndCoordinates' in file_str
+    return name, structure, file_str, is_omx, moments, mag_type
+
+
+def configuration_files(name, structure, file_str, is_omx, moments, mag_type):
+    """(file name, iterable of str chunks) of one configuration."""
+    order, groups = species_groups(structure['species'])
+    elements = species_elements(file_str) if is_omx else {}
+    frac_coords = np.asarray(structure['frac_coords'], dtype=float)
+    yield 'POSCAR', [poscar_string(name, structure['lattice_matrix'], [elements.get(s, s) for s, _ in groups],
+                                   [n for _, n in groups], frac_coords[order])]
+    tags = magnetic_tags(moments[order], mag_type)
+    yield 'INCAR', [''.join(f'{tag} = {value}\n' for tag, value in tags.items())]
+    if is_omx:
+        doc = set_atom_spins(OpenMXDocument(file_str), moments, mag_type == 'noncollinear',
+                             omx_input_coords(file_str, structure))
+        yield f'{_stem(name)}.dat', doc.chunks()
+
+
+def _stem(name):
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return re.sub(r'[^\w.-]+', '_', stem) or 'structure'
+
+
+class _ChunkSink:
+    """Write-only stream collecting what ZipFile writes until it is taken."""
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks, self.size = [], 0
+        return data
+
+
+def stream_bundle(spec, structure_dir):
+    """The zip of a bundle spec as a generator of bytes, written one file at a time."""
+    sink = _ChunkSink()
+    manifest = []  # JSON text of each configuration's record
+
+    def entry(path):
+        info = zipfile.ZipInfo(path, date_time=ZIP_DATE)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        return info
+
+    # ZipFile writes data descriptors when its output can't seek
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for index, item in enumerate(spec['configurations'], start=1):
+            name, structure, file_str, is_omx, moments, mag_type = _resolve(item, structure_dir)
+            directory = f'{index:03d}_{_stem(name)}'
+            record = {'name': name, 'directory': directory, 'natoms': len(structure['species']),
+                      'species': structure['species'], 'mag_type': mag_type, 'files': []}
+            try:
+                for filename, chunks in configuration_files(name, structure, file_str, is_omx, moments, mag_type):
+                    with archive.open(entry(f'{directory}/{filename}'), 'w') as f:
+                        for chunk in chunks:
+                            f.write(chunk.encode())
+                            if sink.size >= STREAM_CHUNK:
+                                yield sink.take()
+                    record['files'].append(filename)
+            except ValueError as e:
+                print(f'Bundle: {name}: {e}')
+                record['error'] = str(e)
+            record['moments'] = moments.tolist()
+            manifest.append(json.dumps(record))
+            yield sink.take()
+        archive.writestr(entry('manifest.json'), '{"configurations": [\n' + ',\n'.join(manifest) + '\n]}\n')
+    yield sink.take()
+
+
+def _cached_stream(chunks, cache_dir, key, keep):
+    """Passes the chunks on while writing them to <key>.zip, kept only when complete."""
+    fd, tmp = tempfile.mkstemp(prefix='.zip-', dir=cache_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+        os.replace(tmp, _path(cache_dir, key, '.zip'))
+    except BaseException:
+        # client gone or a structure missing: no partial zip in the cache
+        os.unlink(tmp)
+        raise
+    _prune(cache_dir, keep)
+
+
+def register_bundle_route(server, config, path='/download/bundle/<key>.zip'):
+    """Serves bundles on the Flask server of the Dash app: cached zip, else streamed."""
+    from flask import Response, abort, send_file
+    cache_dir = config['bundle_cache_dir']
+    structure_dir = config['structure_cache_dir']
+    keep = config['bundle_cache_keep']
+
+    def bundle_view(key):
+        if not _KEY_PATTERN.fullmatch(key):
+            abort(404)
+        zip_path = _path(cache_dir, key, '.zip')
+        if os.path.exists(zip_path):
+            os.utime(zip_path)
+            return send_file(zip_path, mimetype='application/zip', as_attachment=True,
+                             download_name=BUNDLE_FILENAME)
+        spec = load_bundle_spec(cache_dir, key)
+        if spec is None:
+            abort(404)
+        if missing_structures(spec, structure_dir):
+            abort(410)
+        return Response(_cached_stream(stream_bundle(spec, structure_dir), cache_dir, key, keep),
+                        mimetype='application/zip',
+                        headers={'Content-Disposition': f'attachment; filename={BUNDLE_FILENAME}'})
+
+    if 'moment_setter_bundle' not in server.view_functions:
+        server.add_url_rule(path, 'moment_setter_bundle', bundle_view)
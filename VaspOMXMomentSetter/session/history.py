@@ -0,0 +1,154 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# Per-session memory cap for deltas + snapshots, and how often a full snapshot is taken
+HISTORY_MAX_BYTES = 32 * 1024**2
+HISTORY_SNAPSHOT_EVERY = 25
+# Number of sessions kept in memory before the least recently used one is dropped
+HISTORY_MAX_SESSIONS = 64
+
+
+def _changed_rows(old, new):
+    """Indices of rows that differ between two N-by-k arrays, NaN == NaN."""
+    same = (old == new) | (np.isnan(old) & np.isnan(new))
+    return np.flatnonzero(~same.all(axis=1))
+
+
+class MomentHistory:
+    """
+    Undo/redo stack over a moment state (N-by-6 array: cartesian + spherical,
+    NaN rows for unassigned sites).
+
+    Each step keeps only the changed row indices with their old and new values.
+    Every `snapshot_every` steps a full copy is kept as well, so seeking to an
+    arbitrary step replays at most that many deltas. When the stored bytes
+    exceed `max_bytes` the oldest deltas are folded into the base state.
+    """
+
+    def __init__(self, initial_state, max_bytes=HISTORY_MAX_BYTES, snapshot_every=HISTORY_SNAPSHOT_EVERY):
+        self.max_bytes = max_bytes
+        self.snapshot_every = snapshot_every
+        self.state = np.array(initial_state, dtype=float)
+        self.base_state = self.state.copy()
+        self.base_step = 0        # step number of base_state
+        self.deltas = []          # deltas[i] goes from step base_step+i to base_step+i+1
+        self.snapshots = {}       # step -> full state
+        self.step = 0             # current step
+        self.nbytes = 0
+
+    @property
+    def last_step(self):
+        return self.base_step + len(self.deltas)
+
+    def can_undo(self):
+        return self.step > self.base_step
+
+    def can_redo(self):
+        return self.step < self.last_step
+
+    def record(self, new_state):
+        """Records a transition from the current state to new_state. Returns False if nothing changed."""
+        new_state = np.asarray(new_state, dtype=float)
+        if new_state.shape != self.state.shape:
+            raise ValueError(f"State shape {new_state.shape} does not match history {self.state.shape}")
+        rows = _changed_rows(self.state, new_state)
+        if rows.size == 0:
+            return False
+
+        # a new edit after undo discards the redo branch
+        self._truncate(self.step)
+        delta = (rows.astype(np.int32), self.state[rows], new_state[rows])
+        self.deltas.append(delta)
+        self.nbytes += sum(a.nbytes for a in delta)
+        self.state = new_state.copy()
+        self.step += 1
+
+        if self.step % self.snapshot_every == 0:
+            self.snapshots[self.step] = self.state.copy()
+            self.nbytes += self.state.nbytes
+        self._evict()
+        return True
+
+    def undo(self):
+        """Moves one step back. Returns the new state or None."""
+        if not self.can_undo():
+            return None
+        rows, old, _new = self.deltas[self.step - 1 - self.base_step]
+        self.state[rows] = old
+        self.step -= 1
+        return self.state.copy()
+
+    def redo(self):
+        """Moves one step forward. Returns the new state or None."""
+        if not self.can_redo():
+            return None
+        rows, _old, new = self.deltas[self.step - self.base_step]
+        self.state[rows] = new
+        self.step += 1
+        return self.state.copy()
+
+    def seek(self, step):
+        """Jumps to any retained step, starting from the nearest snapshot below it."""
+        if not self.base_step <= step <= self.last_step:
+            raise ValueError(f"Step {step} is not in the history ({self.base_step}-{self.last_step})")
+        if abs(step - self.step) <= self.snapshot_every:
+            while self.step > step:
+                self.undo()
+            while self.step < step:
+                self.redo()
+            return self.state.copy()
+
+        start = max((s for s in self.snapshots if s <= step), default=self.base_step)
+        state = (self.snapshots[start] if start in self.snapshots else self.base_state).copy()
+        for rows, _old, new in self.deltas[start - self.base_step:step - self.base_step]:
+            state[rows] = new
+        self.state = state
+        self.step = step
+        return self.state.copy()
+
+    def _truncate(self, step):
+        for rows, old, new in self.deltas[step - self.base_step:]:
+            self.nbytes -= rows.nbytes + old.nbytes + new.nbytes
+        del self.deltas[step - self.base_step:]
+        for s in [s for s in self.snapshots if s > step]:
+            self.nbytes -= self.snapshots.pop(s).nbytes
+
+    def _evict(self):
+        # fold the oldest deltas into the base state, never the one just recorded
+        while self.nbytes > self.max_bytes and self.base_step < self.step - 1:
+            rows, old, new = self.deltas.pop(0)
+            self.base_state[rows] = new
+            self.base_step += 1
+            self.nbytes -= rows.nbytes + old.nbytes + new.nbytes
+            if self.base_step in self.snapshots:
+                self.nbytes -= self.snapshots.pop(self.base_step).nbytes
+
+
+class HistoryRegistry:
+    """Thread-safe map of session id -> MomentHistory with LRU eviction of whole sessions."""
+
+    def __init__(self, max_sessions=HISTORY_MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._histories = OrderedDict()
+        self.lock = threading.RLock()
+
+    def reset(self, session_id, initial_state):
+        with self.lock:
+            history = MomentHistory(initial_state)
+            self._histories[session_id] = history
+            self._histories.move_to_end(session_id)
+            while len(self._histories) > self.max_sessions:
+                self._histories.popitem(last=False)
+            return history
+
+    def get(self, session_id):
+        with self.lock:
+            history = self._histories.get(session_id)
+            if history is not None:
+                self._histories.move_to_end(session_id)
+            return history
+
+
+# one registry per server process
+histories = HistoryRegistry()
@@ -0,0 +1,113 @@
+"""
+Session files: everything needed to pick up an edit after a reload, as one
+.npz (numpy zip) written with np.savez_compressed and read with np.load.
+
+    format, version     'moment-setter-session', schema version
+    lattice             (3, 3) float64, Angstrom
+    species             (N,) str
+    frac_coords         (N, 3) float64
+    moments             (N, 6) float64, cartesian | spherical, NaN rows unassigned
+    mag_type            str
+    selected            (k,) int64, selected atom indices
+    input_text          (bytes,) uint8, the uploaded file (UTF-8), empty if none
+    camera, settings    (bytes,) uint8, small JSON: scene camera and view settings
+
+The arrays are binary, so a large session loads without parsing text. A
+file written by an older schema is brought up to the current one by the
+functions in _UPGRADES, one version at a time; a newer one is refused.
+"""
+import io
+import json
+import zipfile
+import numpy as np
+from ..input_parsers.parser_wraper import SimpleStructure
+
+SESSION_FORMAT = 'moment-setter-session'
+SESSION_VERSION = 1
+
+# version -> function taking the arrays of that version and returning those of the next one
+_UPGRADES = {}
+
+
+def _text_array(text):
+    return np.frombuffer((text or '').encode('utf-8'), dtype=np.uint8)
+
+
+def _array_text(array):
+    return array.tobytes().decode('utf-8')
+
+
+def save_session(structure, moments_state, mag_type, selected=None, input_text=None,
+                 camera=None, settings=None):
+    """
+    .npz bytes of a session. structure: structure-store dict; moments_state:
+    N-by-6 array (utils/moment_array.store_to_state); settings: view settings dict.
+    """
+    out = io.BytesIO()
+    np.savez_compressed(
+        out,
+        format=np.array(SESSION_FORMAT),
+        version=np.array(SESSION_VERSION),
+        lattice=np.asarray(structure['lattice_matrix'], dtype=float),
+        species=np.array(structure['species'], dtype=str),
+        frac_coords=np.asarray(structure['frac_coords'], dtype=float).reshape(-1, 3),
+        moments=np.asarray(moments_state, dtype=float).reshape(-1, 6),
+        mag_type=np.array(mag_type or 'collinear'),
+        selected=np.asarray(selected or [], dtype=np.int64),
+        input_text=_text_array(input_text),
+        camera=_text_array(json.dumps(camera)),
+        settings=_text_array(json.dumps(settings or {})),
+    )
+    return out.getvalue()
+
+
+def load_session(source):
+    """
+    Session of a .npz (path or file object) as a dict: structure (store dict),
+    moments (N-by-6), mag_type, selected, input_text (None if there is none),
+    camera, settings, version (of the file). Raises ValueError for other files and for
+    sessions of a version that is newer or has no upgrade.
+    """
+    # np.load takes anything that is not a zip for a .npy or a pickle
+    if not zipfile.is_zipfile(source):
+        raise ValueError('Not a session file.')
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    try:
+        with np.load(source, allow_pickle=False) as npz:
+            arrays = {name: npz[name] for name in npz.files}
+    except (OSError, ValueError) as e:
+        raise ValueError(f'Not a session file: {e}')
+    if 'format' not in arrays or str(arrays['format']) != SESSION_FORMAT:
+        raise ValueError('Not a session file.')
+
+    try:
+        file_version = version = int(arrays['version'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('Session file has no valid version.')
+    if version > SESSION_VERSION:
+        raise ValueError(f'Session file version {version} is newer than this app ({SESSION_VERSION}).')
+    while version < SESSION_VERSION:
+        if version not in _UPGRADES:
+            raise ValueError(f'Unsupported session file version {version}.')
+        arrays = _UPGRADES[version](arrays)
+        version += 1
+
+    try:
+        species = arrays['species'].tolist()
+        frac_coords = arrays['frac_coords']
+        moments = arrays['moments']
+        if len(frac_coords) != len(species) or len(moments) != len(species):
+            raise ValueError('atom counts differ')
+        structure = SimpleStructure(arrays['lattice'], species, frac_coords, coords_are_cartesian=False)
+        session = {'structure': structure.as_dict(),
+                   'moments': moments,
+                   'mag_type': str(arrays['mag_type']),
+                   'selected': arrays['selected'].tolist(),
+                   'input_text': _array_text(arrays['input_text']) or None,
+                   'camera': json.loads(_array_text(arrays['camera'])),
+                   'settings': json.loads(_array_text(arrays['settings'])),
+                   'version': file_version}
+    except (KeyError, ValueError) as e:
+        raise ValueError(f'Session file is damaged: {e}')
+    return session
@@ -0,0 +1,201 @@
+"""
+Structures of a multi-file upload.
+
+Every parsed file is saved once in a shelf directory as the JSON of the values
+the stores get when it is shown, under a hash of the file:
+
+    <cache_dir>/<key>.json    name, structure, moments, natoms, mag_type, file_str, is_omx
+
+The shelf is shared by the job processes that parse and the workers that show
+the structures, and keeps the `keep` most recently used files. A session only
+holds the list of its keys (the structure picker). The moments edited on a
+structure that is switched away from are kept per session in memory, bounded
+in bytes and sessions like the undo history.
+"""
+import concurrent.futures
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+from ..input_parsers.parser_wraper import input_parser
+from ..utils.coordinate_transform import cartesian_to_spherical_array
+from ..utils.moment_array import arrays_to_store, store_to_state, state_to_store
+
+# Per-session memory cap for the moments of inactive structures
+STASH_MAX_BYTES = 64 * 1024**2
+# Number of sessions kept in memory before the least recently used one is dropped
+STASH_MAX_SESSIONS = 64
+
+_KEY_PATTERN = re.compile(r'[0-9a-f]{40}')
+
+
+def upload_entry(name, crystal_data):
+    """Store values of a parsed upload (input_parser result), JSON serializable."""
+    structure = crystal_data['structure']
+    magmom = crystal_data['moments']
+    data = crystal_data['parameter_data']
+    file_content = crystal_data['file_str']
+
+    moments_data = {'cartesian': {}, 'spherical': {}}
+    # populate the moment dict with existing magmom
+    if magmom is not None:
+        cartesian = np.asarray(magmom, dtype=float).reshape(-1, 3)
+        moments_data = arrays_to_store(cartesian, cartesian_to_spherical_array(cartesian))
+    mag_type = 'noncollinear' if data and data.get('spin_pol', '').lower() == 'nc' else 'collinear'
+
+    return {'name': name,
+            'structure': structure.as_dict(),
+            'moments': moments_data,
+            'natoms': len(structure),
+            'mag_type': mag_type,
+            'file_str': file_content,
+            'is_omx': '<Atoms.SpeciesAndCoordinates' in file_content}
+
+
+def _path(cache_dir, key):
+    if not isinstance(key, str) or not _KEY_PATTERN.fullmatch(key):
+        raise ValueError(f'Invalid structure key {key!r}')
+    return os.path.join(cache_dir, f'{key}.json')
+
+
+def save_structure(cache_dir, key, entry, keep=256):
+    """Writes an entry to the shelf (atomically) and removes the least recently used beyond `keep`."""
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix='.save-', dir=cache_dir)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp, _path(cache_dir, key))
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    _prune(cache_dir, keep)
+
+
+def load_structure(cache_dir, key):
+    """Entry of a key, None when it was never saved or has been evicted."""
+    path = _path(cache_dir, key)
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+    except FileNotFoundError:
+        return None
+    os.utime(path) # most recently used
+    return entry
+
+
+def _prune(cache_dir, keep):
+    paths = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir)
+             if name.endswith('.json') and _KEY_PATTERN.fullmatch(name[:-5])]
+    if len(paths) <= keep:
+        return
+    paths.sort(key=os.path.getmtime, reverse=True)
+    for path in paths[keep:]:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def parse_to_shelf(cache_dir, name, contents, max_size=None, keep=256):
+    """
+    Parses one upload (dcc.Upload data URL) into the shelf. Returns the picker
+    item {'key', 'name', 'natoms'} or {'name', 'error'}. A file already on the
+    shelf is not parsed again.
+    """
+    key = hashlib.sha1(contents.encode('ascii')).hexdigest()
+    path = _path(cache_dir, key)
+    if os.path.exists(path):
+        os.utime(path)
+        with open(path) as f:
+            natoms = json.load(f)['natoms']
+        return {'key': key, 'name': name, 'natoms': natoms}
+
+    crystal_data = input_parser(contents, max_size)
+    if crystal_data is None:
+        return {'name': name, 'error': 'could not be read'}
+    entry = upload_entry(name, crystal_data)
+    save_structure(cache_dir, key, entry, keep)
+    return {'key': key, 'name': name, 'natoms': entry['natoms']}
+
+
+def parse_uploads(cache_dir, names, contents, max_size=None, keep=256, workers=4,
+                  processes=False, on_done=None):
+    """
+    Parses a batch of uploads into the shelf with a pool of `workers` threads,
+    or processes when `processes` is set (pure-Python parsing holds the GIL).
+    Returns the picker items in upload order; on_done(done, total) after each file.
+    """
+    total = len(contents)
+    if total == 1 or workers <= 1:
+        items = []
+        for done, (name, c) in enumerate(zip(names, contents), start=1):
+            items.append(parse_to_shelf(cache_dir, name, c, max_size, keep))
+            if on_done is not None:
+                on_done(done, total)
+        return items
+
+    pool_class = concurrent.futures.ProcessPoolExecutor if processes else concurrent.futures.ThreadPoolExecutor
+    with pool_class(max_workers=min(workers, total)) as pool:
+        futures = {pool.submit(parse_to_shelf, cache_dir, name, c, max_size, keep): i
+                   for i, (name, c) in enumerate(zip(names, contents))}
+        items = [None] * total
+        for done, future in enumerate(concurrent.futures.as_completed(futures), start=1):
+            items[futures[future]] = future.result()
+            if on_done is not None:
+                on_done(done, total)
+    return items
+
+
+class MomentStash:
+    """
+    Thread-safe map of session id -> {structure key: (N-by-6 moment state, mag_type)}
+    for the structures a session is not showing. Within a session the least
+    recently stashed structures are dropped beyond max_bytes; whole sessions
+    are dropped LRU beyond max_sessions.
+    """
+
+    def __init__(self, max_bytes=STASH_MAX_BYTES, max_sessions=STASH_MAX_SESSIONS):
+        self.max_bytes = max_bytes
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self.lock = threading.RLock()
+
+    def put(self, session_id, key, moments_data, natoms, mag_type):
+        state = store_to_state(moments_data, natoms)
+        with self.lock:
+            stash = self._sessions.setdefault(session_id, OrderedDict())
+            self._sessions.move_to_end(session_id)
+            stash[key] = (state, mag_type)
+            stash.move_to_end(key)
+            while sum(s.nbytes for s, _ in stash.values()) > self.max_bytes and len(stash) > 1:
+                dropped, _ = stash.popitem(last=False)
+                print(f'Edited moments of structure {dropped[:8]} dropped (session over {self.max_bytes} bytes)')
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def get(self, session_id, key):
+        """(N-by-6 moment state, mag_type) stashed for a structure, or None; it stays stashed."""
+        with self.lock:
+            stash = self._sessions.get(session_id)
+            if not stash or key not in stash:
+                return None
+            return stash[key]
+
+    def pop(self, session_id, key):
+        """(moments-store dict, mag_type) stashed for a structure, or None."""
+        with self.lock:
+            stash = self._sessions.get(session_id)
+            if not stash or key not in stash:
+                return None
+            self._sessions.move_to_end(session_id)
+            state, mag_type = stash.pop(key)
+        return state_to_store(state), mag_type
+
+
+# one stash per server process
+moment_stash = MomentStash()
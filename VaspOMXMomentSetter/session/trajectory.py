@@ -0,0 +1,217 @@
+"""
+Frame cache of trajectories: positions and moments per step in .npy files that
+are memory-mapped when read, so only the frames being shown are resident.
+
+    <cache_dir>/<key>/positions.npy   (frames, atoms, 3) float32, cartesian
+                      moments.npy     (frames, atoms, 3) float32, when given
+                      lattices.npy    (frames, 3, 3)
+                      meta.json       species, frame counts, mag_type
+
+The key is a hash of the uploaded files: a trajectory is parsed once and then
+shared by every session and gunicorn worker using the same cache directory.
+"""
+import functools
+import hashlib
+import json
+import os
+import re
+import shutil
+import struct
+import tempfile
+import numpy as np
+from ..input_parsers.parser_trajectory import (read_xdatcar_species, count_xdatcar_frames, iter_xdatcar_frames,
+                                               count_outcar_steps, iter_outcar_moments, load_moment_steps)
+from ..input_parsers.parser_vasp_output import sniff_vasp_output
+from ..utils.stream_utils import CHUNK_SIZE, open_binary, file_size
+
+FRAME_DTYPE = np.float32
+# fixed .npy header size, so it can be written after the frames are counted
+NPY_HEADER_BYTES = 128
+NPY_MAGIC = b'\x93NUMPY'
+# frames read between two progress reports
+PROGRESS_EVERY = 200
+
+_KEY_PATTERN = re.compile(r'[0-9a-f]{40}')
+
+
+def trajectory_key(*sources):
+    """Cache key of a trajectory: hash of its files (paths or bytes, None for a missing one)."""
+    digest = hashlib.sha1()
+    for source in sources:
+        if source is None:
+            digest.update(struct.pack('<Q', 0))
+            continue
+        with open_binary(source) as f:
+            digest.update(struct.pack('<Q', file_size(f)))
+            f.seek(0)
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _head(source, size):
+    with open_binary(source) as f:
+        f.seek(0)
+        return f.read(size)
+
+
+def _npy_header(shape, dtype):
+    """Version 1.0 .npy header padded to NPY_HEADER_BYTES."""
+    header = repr({'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                   'fortran_order': False, 'shape': tuple(shape)})
+    size = NPY_HEADER_BYTES - len(NPY_MAGIC) - 4
+    return NPY_MAGIC + b'\x01\x00' + struct.pack('<H', size) + (header.ljust(size - 1) + '\n').encode('latin1')
+
+
+class FrameWriter:
+    """Appends frames to a .npy file without holding them; the header is written on close."""
+
+    def __init__(self, path, frame_shape):
+        self.frame_shape = tuple(frame_shape)
+        self.count = 0
+        self.f = open(path, 'wb')
+        self.f.write(b'\0' * NPY_HEADER_BYTES)
+
+    def append(self, frame):
+        frame = np.ascontiguousarray(frame, dtype=FRAME_DTYPE)
+        if frame.shape != self.frame_shape:
+            raise ValueError(f'Frame of shape {frame.shape}, expected {self.frame_shape}')
+        self.f.write(frame.tobytes())
+        self.count += 1
+
+    def close(self):
+        self.f.seek(0)
+        self.f.write(_npy_header((self.count,) + self.frame_shape, FRAME_DTYPE))
+        self.f.close()
+        return self.count
+
+
+def _moment_steps(source, natoms):
+    """(iterator of N-by-3 moments, number of steps, mag_type) of an OUTCAR or .npy."""
+    if _head(source, len(NPY_MAGIC)) == NPY_MAGIC:
+        array, mag_type = load_moment_steps(source)
+        if array.shape[1] != natoms:
+            raise ValueError(f'The moments have {array.shape[1]} atoms, the XDATCAR has {natoms}.')
+        if mag_type == 'collinear':
+            steps = (np.column_stack([m, np.zeros((natoms, 2))]) for m in array)
+        else:
+            steps = iter(array)
+        return steps, len(array), mag_type
+    if sniff_vasp_output(source) != 'outcar':
+        raise ValueError('Moments per step must come from an OUTCAR or a .npy array')
+    steps = iter_outcar_moments(source, natoms)
+    first = next(steps, None)
+    if first is None:
+        raise ValueError('No complete "magnetization (x)" table in OUTCAR (was LORBIT set?)')
+    moments, mag_type = first
+
+    def all_steps():
+        yield moments
+        for m, _mag_type in steps:
+            yield m
+    return all_steps(), count_outcar_steps(source), mag_type
+
+
+def _report(on_progress, done, total, label):
+    if on_progress is not None and done % PROGRESS_EVERY == 0:
+        on_progress(done, total, label)
+
+
+def build_trajectory_cache(cache_dir, xdatcar, moments=None, keep=8, on_progress=None):
+    """
+    Parses an XDATCAR and optionally the moments per step (OUTCAR or .npy),
+    given as paths or bytes, into the frame cache, one frame at a time. Returns the key;
+    a trajectory already in the cache is not parsed again.
+    on_progress(done, total, label) is called every PROGRESS_EVERY frames.
+    """
+    key = trajectory_key(xdatcar, moments)
+    directory = os.path.join(cache_dir, key)
+    if os.path.exists(os.path.join(directory, 'meta.json')):
+        os.utime(directory) # most recently used
+        return key
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix='.build-', dir=cache_dir)
+    try:
+        species, _lattice = read_xdatcar_species(xdatcar)
+        natoms = len(species)
+        total = count_xdatcar_frames(xdatcar)
+        writer = FrameWriter(os.path.join(tmp, 'positions.npy'), (natoms, 3))
+        lattices = []
+        for lattice, cart in iter_xdatcar_frames(xdatcar):
+            writer.append(cart)
+            lattices.append(lattice)
+            _report(on_progress, writer.count, total, 'Reading positions')
+        nframes = writer.close()
+        if nframes == 0:
+            raise ValueError('No complete frame in the XDATCAR')
+
+        mag_type = None
+        if moments is not None:
+            steps, nsteps, mag_type = _moment_steps(moments, natoms)
+            writer = FrameWriter(os.path.join(tmp, 'moments.npy'), (natoms, 3))
+            for step in steps:
+                writer.append(step)
+                _report(on_progress, writer.count, nsteps, 'Reading moments')
+            nsteps = writer.close()
+            if nsteps != nframes:
+                print(f'Trajectory has {nframes} frames and {nsteps} moment steps, using the first {min(nframes, nsteps)}')
+            nframes = min(nframes, nsteps)
+
+        np.save(os.path.join(tmp, 'lattices.npy'), np.array(lattices[:nframes]))
+        meta = {'natoms': natoms, 'nframes': nframes, 'species': species, 'mag_type': mag_type}
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        try:
+            os.rename(tmp, directory)
+        except OSError:
+            # built at the same time by another worker
+            shutil.rmtree(tmp, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    _prune(cache_dir, keep)
+    return key
+
+
+def _prune(cache_dir, keep):
+    """Removes the least recently used trajectories beyond `keep`."""
+    entries = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir)
+               if _KEY_PATTERN.fullmatch(name)]
+    entries.sort(key=os.path.getmtime, reverse=True)
+    for directory in entries[keep:]:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+class TrajectoryFrames:
+    """Read side of a cached trajectory: frames come from memory-mapped arrays."""
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.positions = np.load(os.path.join(directory, 'positions.npy'), mmap_mode='r')
+        moments_path = os.path.join(directory, 'moments.npy')
+        self.moments = np.load(moments_path, mmap_mode='r') if os.path.exists(moments_path) else None
+        self.lattices = np.load(os.path.join(directory, 'lattices.npy'))
+
+    @property
+    def nframes(self):
+        return self.meta['nframes']
+
+    @property
+    def species(self):
+        return self.meta['species']
+
+    def frame(self, index):
+        """(lattice, N-by-3 positions, N-by-3 moments or None) of one frame, as float copies."""
+        index = min(max(int(index), 0), self.nframes - 1)
+        moments = None if self.moments is None else np.array(self.moments[index], dtype=float)
+        return self.lattices[index], np.array(self.positions[index], dtype=float), moments
+
+
+@functools.lru_cache(maxsize=16)
+def open_trajectory(cache_dir, key):
+    """Opened (memory-mapped) trajectory of a cache key, shared by the callbacks of a process."""
+    if not isinstance(key, str) or not _KEY_PATTERN.fullmatch(key):
+        raise ValueError(f'Invalid trajectory key {key!r}')
+    return TrajectoryFrames(os.path.join(cache_dir, key))
@@ -35,11 +35,42 @@ def spherical_to_cartesian(r, theta, phi):
     return [x,y,z]
 
 
-def rotate_vector(moment_vector, theta_deg, phi_deg):
+def cartesian_to_spherical_array(vectors):
     """
-    Applies a rotation to a moment vector using Euler angles.
-    Rotation is R = R_z(phi) @ R_y(theta).
+    Vectorized cartesian_to_spherical for an N-by-3 array.
+    Returns an N-by-3 array of [r, theta, phi] with angles in degrees.
     """
+    vectors = np.asarray(vectors, dtype=float).reshape(-1, 3)
+    r = np.linalg.norm(vectors, axis=1)
+    safe_r = np.where(r == 0, 1.0, r)
+    theta = np.degrees(np.arccos(np.clip(vectors[:, 2] / safe_r, -1.0, 1.0)))
+    phi = np.degrees(np.arctan2(vectors[:, 1], vectors[:, 0]))
+    sph = np.column_stack((r, theta, phi))
+    sph[r == 0] = 0.0
+    return sph
+
+
+def saxis_rotation(saxis):
+    """
+    Rotation from VASP's SAXIS frame to the cartesian frame, m_cart = R @ m_saxis.
+    alpha is the azimuth of SAXIS and beta its angle from z; SAXIS = (0, 0, 1)
+    gives the identity.
+    """
+    sx, sy, sz = np.asarray(saxis, dtype=float)
+    if sx == 0 and sy == 0 and sz == 0:
+        raise ValueError('SAXIS must not be the zero vector')
+    alpha = np.arctan2(sy, sx)
+    beta = np.arctan2(np.hypot(sx, sy), sz)
+    ca, sa, cb, sb = np.cos(alpha), np.sin(alpha), np.cos(beta), np.sin(beta)
+    return np.array([
+        [cb * ca, -sa, sb * ca],
+        [cb * sa, ca, sb * sa],
+        [-sb, 0.0, cb]
+    ])
+
+
+def rotation_matrix(theta_deg, phi_deg):
+    """Rotation matrix R = R_z(phi) @ R_y(theta)."""
     theta = np.deg2rad(theta_deg)
     phi = np.deg2rad(phi_deg)
 
@@ -57,11 +88,20 @@ def rotate_vector(moment_vector, theta_deg, phi_deg):
         [0, 0, 1]
     ])
 
-    # Combined rotation matrix
-    R = R_z @ R_y
+    return R_z @ R_y
+
 
+def rotate_vector(moment_vector, theta_deg, phi_deg):
+    """
+    Applies a rotation to a moment vector using Euler angles.
+    Rotation is R = R_z(phi) @ R_y(theta).
+    """
     # Apply rotation to the moment vector
-    new_moment = R @ np.array(moment_vector)
+    new_moment = rotation_matrix(theta_deg, phi_deg) @ np.array(moment_vector)
 
     return new_moment.tolist()
 
+
+def rotate_vectors(moment_vectors, theta_deg, phi_deg):
+    """Same rotation as rotate_vector applied to every row of an N-by-3 array."""
+    return np.asarray(moment_vectors, dtype=float) @ rotation_matrix(theta_deg, phi_deg).T
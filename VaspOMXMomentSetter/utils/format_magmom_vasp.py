@@ -1,4 +1,7 @@
+import re
 import numpy as np
+from .coordinate_transform import saxis_rotation
+from .moment_array import moments_to_array
 
 # Fromat vasp magmom string: combine zeros etc..
 def format_magmom_vasp(values, lnoncollinear=False, tolerance=1e-3):
@@ -65,16 +68,60 @@ def format_magmom_vasp(values, lnoncollinear=False, tolerance=1e-3):
 #mag_vals = np.array([1.0, 2.0, 3.0, 0.0, 0.0, 0.0, -1.572891, 0, 0, 0, 0, 0 ,0,0,0, 0, 1, 0, 3, 0, 0, 0,0,0])
 #print(f"{mag_vals} -> '{format_magmom_vasp(mag_vals)}'")
 
-def parse_magmom_string(magmom_str, natoms):
+def read_incar_tags(text):
+    """
+    {TAG: value string} of INCAR-style 'TAG = value' lines (or ';' separated
+    statements, '\\' continues a line, '#' and '!' start comments). Values
+    without a tag are taken as MAGMOM values, so a bare '2*5.0 2*-5.0' (or
+    'MAGMOM 2*5.0 2*-5.0') works.
+    """
+    text = re.sub(r'\\[ \t]*\n', ' ', text or '')
+    tags = {}
+    for statement in re.split(r'[;\n]', text):
+        statement = re.split(r'[#!]', statement, maxsplit=1)[0].strip()
+        if not statement:
+            continue
+        if '=' in statement:
+            key, value = statement.split('=', 1)
+            tags[key.strip().upper()] = value.strip()
+        else:
+            # 'MAGMOM 2*5.0' without '=' is read as before
+            statement = re.sub(r'^magmom\b', '', statement, flags=re.IGNORECASE).strip()
+            tags['MAGMOM'] = (tags.get('MAGMOM', '') + ' ' + statement).strip()
+    return tags
+
+
+def parse_saxis(text):
+    """SAXIS vector of 'sx sy sz' (or a sequence of 3 numbers). Raises ValueError."""
+    try:
+        values = [float(x) for x in (text.replace(',', ' ').split() if isinstance(text, str) else text)]
+    except (TypeError, ValueError):
+        values = []
+    if len(values) != 3 or not any(values):
+        raise ValueError(f"SAXIS must be three numbers, not all zero, got '{text}'")
+    return tuple(values)
+
+
+def is_default_saxis(saxis):
+    """True for SAXIS along +z, where the SAXIS frame is the cartesian frame."""
+    return saxis is None or np.allclose(saxis_rotation(saxis), np.eye(3))
+
+
+def parse_magmom_string(magmom_str, natoms, saxis=None):
     """
     Parses a VASP MAGMOM string into the app's moment dictionary format.
     Handles both collinear (e.g., '2*5.0 2*-5.0') and non-collinear formats.
+    Non-collinear values are in the frame of SAXIS (a SAXIS line in the
+    text wins over the argument) and are returned as cartesian moments.
     """
-    # Clean the input string
-    s = magmom_str.lower().replace('magmom', '').replace('=', '').strip()
-    
+    tags = read_incar_tags(magmom_str)
+    if not tags.get('MAGMOM'):
+        raise ValueError('No MAGMOM values found.')
+    if 'SAXIS' in tags:
+        saxis = parse_saxis(tags['SAXIS'])
+
     # Expand run-length encoding (e.g., "2*5.0")
-    parts = s.split()
+    parts = tags['MAGMOM'].split()
     expanded_values = []
     for part in parts:
         if '*' in part:
@@ -92,7 +139,10 @@ def parse_magmom_string(magmom_str, natoms):
         mag_type = 'noncollinear'
         # Non-collinear: [m1x, m1y, m1z, m2x, ...] -> { '0': [m1x,m1y,m1z], ... }
         moments_array = np.array(expanded_values).reshape((natoms, 3))
-        moments_dict = {str(i): vec.tolist() for i, vec in enumerate(moments_array)}
+        if not is_default_saxis(saxis):
+            # rows are SAXIS-frame vectors: m_cart = R m_saxis for all of them at once
+            moments_array = moments_array @ saxis_rotation(saxis).T
+        moments_dict = {str(i): vec for i, vec in enumerate(moments_array.tolist())}
     else:
         raise ValueError(f"Invalid number of moments. Expected {natoms} (collinear) "
                          f"or {3*natoms} (non-collinear), but got {len(expanded_values)}.")
@@ -100,26 +150,25 @@ def parse_magmom_string(magmom_str, natoms):
     return moments_dict, mag_type
 
 
-def generate_magmom_string(num_atoms, moments_data, collinear):
-    """Generates the VASP MAGMOM string. Convert from moments_data"""
+def generate_magmom_string(num_atoms, moments_data, collinear, saxis=None):
+    """
+    Generates the VASP MAGMOM string. Convert from moments_data. Non-collinear
+    moments are written in the frame of saxis, followed by the matching
+    SAXIS line, when saxis is not along +z.
+    """
+    moments = np.nan_to_num(moments_to_array(moments_data, num_atoms))
 
     if collinear:
-        lnoncollinear = False
-        moments = [0.0] * num_atoms
-        for idx_str, moment_vec in moments_data.items():
-            moments[int(idx_str)] = moment_vec[0]
-        moment_list = moments
-
-    else: # Non-collinear
-        lnoncollinear = True
-        moments = [[0.0, 0.0, 0.0] for _ in range(num_atoms)]
-        for idx_str, moment_vec in moments_data.items():
-            moments[int(idx_str)] = moment_vec
-        # unroll list
-        moment_list = []
-        for mom in moments:
-            moment_list.extend(mom)
-
-    mom_str = format_magmom_vasp(moment_list, lnoncollinear, tolerance=1e-3)
-
-    return "MAGMOM = " + mom_str
+        return "MAGMOM = " + format_magmom_vasp(moments[:, 0].tolist(), False, tolerance=1e-3)
+
+    # Non-collinear
+    write_saxis = not is_default_saxis(saxis)
+    if write_saxis:
+        # m_saxis = R^T m_cart, as rows
+        moments = moments @ saxis_rotation(saxis)
+    mom_str = format_magmom_vasp(moments.ravel(), True, tolerance=1e-3)
+    magmom = "MAGMOM = " + mom_str
+    if write_saxis:
+        # full precision: the moments above were rotated with exactly this axis
+        magmom += "\nSAXIS = " + ' '.join(f'{x:.15g}' for x in saxis)
+    return magmom
@@ -0,0 +1,75 @@
+import numpy as np
+
+# The moments-store keeps {'cartesian': {idx_str: [x,y,z]}, 'spherical': {idx_str: [r,theta,phi]}}
+# with only the assigned sites present. These helpers convert it to dense
+# N-by-3 arrays (NaN rows = unassigned) so edits can be done with numpy masks.
+
+def moments_to_array(moment_dict, natoms):
+    """Dense N-by-3 array from one half of the moments-store, NaN for unassigned sites."""
+    array = np.full((natoms, 3), np.nan)
+    if moment_dict:
+        idx = np.fromiter((int(k) for k in moment_dict.keys()), dtype=int, count=len(moment_dict))
+        array[idx] = np.asarray(list(moment_dict.values()), dtype=float).reshape(-1, 3)
+    return array
+
+
+def array_to_moments(array):
+    """Inverse of moments_to_array: dict with the non-NaN rows only."""
+    array = np.asarray(array, dtype=float)
+    assigned = np.flatnonzero(~np.isnan(array).any(axis=1))
+    rows = array[assigned].tolist()
+    return {str(i): row for i, row in zip(assigned.tolist(), rows)}
+
+
+def store_to_arrays(moments_data, natoms):
+    """Both halves of the moments-store as (cartesian, spherical) arrays."""
+    moments_data = moments_data or {}
+    return (moments_to_array(moments_data.get('cartesian'), natoms),
+            moments_to_array(moments_data.get('spherical'), natoms))
+
+
+def arrays_to_store(cartesian, spherical):
+    """moments-store dict from (cartesian, spherical) arrays."""
+    return {'cartesian': array_to_moments(cartesian), 'spherical': array_to_moments(spherical)}
+
+
+def store_to_state(moments_data, natoms):
+    """moments-store as a single N-by-6 array [cartesian | spherical]."""
+    return np.hstack(store_to_arrays(moments_data, natoms))
+
+
+def state_to_store(state):
+    """Inverse of store_to_state."""
+    state = np.asarray(state, dtype=float)
+    return arrays_to_store(state[:, :3], state[:, 3:])
+
+
+def collinear_to_noncollinear(cartesian, saxis=(0.0, 0.0, 1.0)):
+    """Collinear rows [m, 0, 0] of an N-by-3 array as moments m along SAXIS (VASP's convention)."""
+    axis = np.asarray(saxis, dtype=float)
+    axis = axis / np.linalg.norm(axis)
+    return np.asarray(cartesian, dtype=float)[:, :1] * axis
+
+
+def noncollinear_to_collinear(cartesian, saxis=(0.0, 0.0, 1.0)):
+    """Projections of the moments of an N-by-3 array on SAXIS, as collinear rows [m, 0, 0]."""
+    axis = np.asarray(saxis, dtype=float)
+    axis = axis / np.linalg.norm(axis)
+    cartesian = np.asarray(cartesian, dtype=float)
+    collinear = np.zeros_like(cartesian)
+    collinear[:, 0] = cartesian @ axis
+    # unassigned rows stay unassigned
+    collinear[np.isnan(collinear[:, 0])] = np.nan
+    return collinear
+
+
+def convert_moments(cartesian, source, target, saxis=(0.0, 0.0, 1.0)):
+    """
+    Moments written in mode source ('collinear' / 'noncollinear') in mode target.
+    Unchanged when the modes are the same, so converting twice is a no-op.
+    """
+    if source == target:
+        return np.asarray(cartesian, dtype=float)
+    if target == 'collinear':
+        return noncollinear_to_collinear(cartesian, saxis)
+    return collinear_to_noncollinear(cartesian, saxis)
@@ -0,0 +1,97 @@
+"""
+Periodic neighbor search with a cell list, and bonds from per-species-pair
+cutoffs.
+
+The cell is cut into bins of fractional slabs at least as thick as the
+cutoff (measured perpendicular to the faces), so all neighbors of an atom lie
+in its own bin or the adjacent ones, periodic images included. The candidate
+pairs of one bin offset are built for all atoms at once; a Python loop runs
+only over the (usually 27) offsets.
+"""
+import numpy as np
+
+# bond cutoff of a species pair: factor times the sum of their (VESTA) radii
+BOND_RADIUS_FACTOR = 0.7
+# bins per axis at most; more only adds empty bins
+MAX_BINS = 64
+
+
+def _face_widths(lattice):
+    """Distance between opposite faces of the cell, per axis."""
+    volume = abs(np.linalg.det(lattice))
+    return np.array([volume / np.linalg.norm(np.cross(lattice[(i + 1) % 3], lattice[(i + 2) % 3]))
+                     for i in range(3)])
+
+
+def neighbor_pairs(lattice, frac_coords, cutoff):
+    """
+    All pairs closer than cutoff (Å), each once: (i, j, shifts, distances) with
+    site j moved by the integer lattice shift, i.e. at (frac_j + shift) @ lattice.
+    Self pairs are kept only with a nonzero shift.
+    """
+    lattice = np.asarray(lattice, dtype=float)
+    given = np.asarray(frac_coords, dtype=float).reshape(-1, 3)
+    # searched inside the cell, shifts are returned for the positions as given
+    wrap = np.floor(given).astype(np.int64)
+    frac = given - wrap
+    natoms = len(frac)
+    empty = (np.zeros(0, dtype=np.int64),) * 2 + (np.zeros((0, 3), dtype=np.int64), np.zeros(0))
+    if natoms == 0 or cutoff <= 0:
+        return empty
+
+    widths = _face_widths(lattice)
+    nbins = np.clip(np.floor(widths / cutoff).astype(int), 1, MAX_BINS)
+    # bins thinner than the cutoff (small cells) need more than one bin each way
+    reach = np.ceil(cutoff / (widths / nbins)).astype(int)
+
+    bins = np.minimum(np.floor(frac * nbins).astype(int), nbins - 1)
+    bin_id = np.ravel_multi_index(bins.T, nbins)
+    order = np.argsort(bin_id, kind='stable')
+    counts = np.bincount(bin_id, minlength=int(np.prod(nbins)))
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    cart = frac @ lattice
+
+    found = []
+    offsets = np.stack(np.meshgrid(*[np.arange(-r, r + 1) for r in reach], indexing='ij'), axis=-1).reshape(-1, 3)
+    for offset in offsets:
+        target = bins + offset
+        shift = np.floor_divide(target, nbins)
+        target_id = np.ravel_multi_index((target - shift * nbins).T, nbins)
+        # every atom i against every atom of its target bin
+        n_candidates = counts[target_id]
+        i = np.repeat(np.arange(natoms), n_candidates)
+        if not len(i):
+            continue
+        first = np.repeat(starts[target_id] - np.cumsum(n_candidates) + n_candidates, n_candidates)
+        j = order[first + np.arange(len(i))]
+        pair_shift = shift[i]
+        delta = cart[j] + pair_shift @ lattice - cart[i]
+        distance = np.sqrt(np.einsum('ij,ij->i', delta, delta))
+        # each pair once: i < j, or a self image with a positive shift
+        positive = (pair_shift[:, 0] > 0) | ((pair_shift[:, 0] == 0) & ((pair_shift[:, 1] > 0) |
+                    ((pair_shift[:, 1] == 0) & (pair_shift[:, 2] > 0))))
+        keep = (distance < cutoff) & ((i < j) | ((i == j) & positive))
+        i, j = i[keep], j[keep]
+        found.append((i, j, pair_shift[keep] + wrap[i] - wrap[j], distance[keep]))
+
+    if not found:
+        return empty
+    return tuple(np.concatenate(parts) for parts in zip(*found))
+
+
+def bond_cutoffs(names, radii, factor=BOND_RADIUS_FACTOR):
+    """(k, k) cutoff matrix of the species names: factor * (r_a + r_b); radius 1.5 when unknown."""
+    r = np.array([float(radii.get(name, 1.5)) for name in names])
+    return factor * (r[:, None] + r[None, :])
+
+
+def find_bonds(lattice, frac_coords, species, radii, factor=BOND_RADIUS_FACTOR):
+    """
+    Bonds of a structure as (i, j, shifts) arrays, one entry per bond, with a
+    cutoff per species pair from the radii ({species: radius}).
+    """
+    names, codes = np.unique(np.asarray(species, dtype=str), return_inverse=True)
+    cutoffs = bond_cutoffs(names, radii, factor)
+    i, j, shifts, distance = neighbor_pairs(lattice, frac_coords, cutoffs.max() if len(names) else 0.0)
+    keep = distance < cutoffs[codes[i], codes[j]]
+    return i[keep], j[keep], shifts[keep]
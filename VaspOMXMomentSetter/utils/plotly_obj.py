@@ -1,5 +1,44 @@
+import base64
+import numpy as np
 import plotly.graph_objects as go
 
+# trace arrays sent as typed arrays, and their dtype
+TYPED_ARRAY_KEYS = {'x': 'f4', 'y': 'f4', 'z': 'f4', 'u': 'f4', 'v': 'f4', 'w': 'f4', 'customdata': 'i4'}
+
+
+def typed_array(values, dtype='f4'):
+    """
+    Numbers as a plotly.js typed-array spec {'dtype', 'bdata'}: the base64 of
+    the little-endian array, which plotly.js (>= 2.28) decodes as it is instead
+    of parsing one JSON number per value. None and NaN are gaps in a line.
+    """
+    array = np.ascontiguousarray(np.asarray(values, dtype=float), dtype='<' + dtype)
+    return {'dtype': dtype, 'bdata': base64.b64encode(array).decode('ascii')}
+
+
+def rgb_string(rgb):
+    """'rgb(r, g, b)' of [r, g, b] in 0-1."""
+    return f'rgb({int(rgb[0]*255)}, {int(rgb[1]*255)}, {int(rgb[2]*255)})'
+
+
+def encode_trace_arrays(trace):
+    """Replaces the numeric 1-d arrays of a trace dict (TYPED_ARRAY_KEYS) by typed arrays."""
+    for key, dtype in TYPED_ARRAY_KEYS.items():
+        value = trace.get(key)
+        if value is None or isinstance(value, (dict, str)):
+            continue
+        array = np.asarray(value)
+        if array.dtype.kind == 'O' and dtype[0] == 'f':
+            # numbers with None between line segments (cell edges)
+            try:
+                array = np.array(value, dtype=float)
+            except (TypeError, ValueError):
+                continue
+        if array.ndim == 1 and array.dtype.kind in ('iuf' if dtype[0] == 'f' else 'iu'):
+            trace[key] = typed_array(array, dtype)
+    return trace
+
+
 def plotly_add_arrows(figure, start_pos, arrow_vector, center_arrow=True, 
                       vector_color = [1,0,0],
                       label='', # label to disply
@@ -13,7 +52,7 @@ def plotly_add_arrows(figure, start_pos, arrow_vector, center_arrow=True,
 
     shift = (end_pos-start_pos)*0.5 if center_arrow else [0,0,0]
 
-    color_str = f'rgb({int(vector_color[0]*255)}, {int(vector_color[1]*255)}, {int(vector_color[2]*255)})'
+    color_str = rgb_string(vector_color)
 
     figure.add_trace(go.Scatter3d(
         x=[start_pos[0]-shift[0], end_pos[0]-shift[0]], 
@@ -50,3 +89,63 @@ def plotly_add_arrows(figure, start_pos, arrow_vector, center_arrow=True,
 # for 3d balls plotting 
 # https://stackoverflow.com/questions/70977042/how-to-plot-spheres-in-3d-with-plotly-or-another-library
 
+
+
+def arrow_geometry(start_positions, arrow_vectors, center_arrow=True,
+                   arrow_tip_ratio=0.5, arrow_starting_ratio=0.95):
+    """
+    Shafts and heads of many arrows at once, as plotly_add_arrows draws them:
+    shaft x/y/z with NaN between arrows (one line trace) and the cone
+    positions/vectors (one cone trace). Returns (line_xyz, cone_xyz, cone_uvw),
+    3-by-n arrays.
+    """
+    start = np.asarray(start_positions, dtype=float).reshape(-1, 3)
+    vec = np.asarray(arrow_vectors, dtype=float).reshape(-1, 3)
+    if center_arrow:
+        start = start - 0.5 * vec
+    end = start + vec
+
+    # start, end, gap per arrow
+    segments = np.full((len(start), 3, 3), np.nan)
+    segments[:, 0] = start
+    segments[:, 1] = end
+    line = segments.reshape(-1, 3).T
+    cone_xyz = (start + arrow_starting_ratio * vec).T
+    cone_uvw = (arrow_tip_ratio * vec).T
+    return line, cone_xyz, cone_uvw
+
+
+def plotly_arrow_traces(start_positions, arrow_vectors, center_arrow=True,
+                        vector_color=[1, 0, 0],
+                        label='',
+                        legend_name='vector',
+                        showlegend=True):
+    """
+    All arrows as one line trace plus one cone trace (instead of two traces
+    per arrow), so a figure with many moments stays small and the arrows can
+    be moved by patching two traces.
+    """
+    line, cone_xyz, cone_uvw = arrow_geometry(start_positions, arrow_vectors, center_arrow)
+    color_str = rgb_string(vector_color)
+
+    shafts = go.Scatter3d(
+        x=line[0], y=line[1], z=line[2],
+        mode='lines',
+        line=dict(width=8, color=color_str),
+        name=label,
+        legendgroup=legend_name,
+        showlegend=showlegend,
+        hoverinfo='skip'
+    )
+    # 'raw' keeps every cone sized by its own vector, like the one-cone traces
+    heads = go.Cone(
+        x=cone_xyz[0], y=cone_xyz[1], z=cone_xyz[2],
+        u=cone_uvw[0], v=cone_uvw[1], w=cone_uvw[2],
+        sizemode='raw',
+        sizeref=1.2,
+        showlegend=False,
+        showscale=False,
+        legendgroup=legend_name,
+        colorscale=[[0, color_str], [1, color_str]]
+    )
+    return shafts, heads
@@ -0,0 +1,324 @@
+"""
+Propagation vectors of a moment configuration.
+
+The loaded cell is usually a supercell of a smaller cell. Its translation
+grid (n1, n2, n3) is found from the positions and species alone: n_i is the
+largest n such that a shift by 1/n along axis i maps the structure onto
+itself. The sites are then grouped into sublattices, one per species and
+position inside the small cell (the loaded cell with axis i divided by n_i).
+
+For each sublattice g with N_g sites at r_j (in units of the small cell)
+
+    S_g(k) = 1/N_g sum_j m_j exp(-2 pi i k . r_j)
+
+is evaluated on the k-grid h / n (h = 0 .. n-1, k in reciprocal lattice units
+of the small cell) with one FFT per sublattice, or as a chunked matrix product
+on another k-grid. k and -k carry the same power for real moments and are
+reported as one vector, folded into (-1/2, 1/2]. For each vector:
+
+    weight      share of the mean squared moment carried by +-k (sums to 1 over the grid)
+    amplitude   rms moment of the +-k modulation: m for a ferro- or antiferromagnet or a
+                helix of moments m, m/sqrt(2) for a sine-modulated one
+
+Only translations along the cell axes are found: a centered small cell
+(e.g. bcc in the conventional cell) gives one sublattice per centering site.
+"""
+import math
+import numpy as np
+
+# fractional tolerance of positions compared after a shift
+POSITION_TOLERANCE = 1e-3
+# largest n_i tried for the translation grid
+MAX_GRID = 64
+# sites shifted first when trying an n_i, before all of them
+QUICK_CHECK_SITES = 64
+# k-points of a k-grid evaluated without FFT
+MAX_K_POINTS = 32768
+# phase matrix elements computed at once by the direct transform
+CHUNK_ELEMENTS = 1 << 22
+# moment magnitude below which a sublattice counts as non-magnetic
+ZERO_MOMENT = 1e-8
+# smallest weight of a reported k-vector
+MIN_WEIGHT = 1e-4
+
+
+def species_codes(species):
+    names, codes = np.unique(np.asarray(species, dtype=str), return_inverse=True)
+    return names, codes.astype(np.int64)
+
+
+def _bucket_keys(q, codes, steps):
+    return ((codes * steps + q[:, 0]) * steps + q[:, 1]) * steps + q[:, 2]
+
+
+# the bucket of a site and its 26 neighbours, own bucket first: positions within
+# tol are at most one bucket apart
+_NEIGHBOR_BUCKETS = np.stack(np.meshgrid(*[np.arange(-1, 2)] * 3, indexing='ij'), axis=-1).reshape(-1, 3)
+_NEIGHBOR_BUCKETS = _NEIGHBOR_BUCKETS[np.argsort(np.abs(_NEIGHBOR_BUCKETS).sum(axis=1), kind='stable')]
+
+
+def _buckets(frac_coords, tol):
+    steps = int(round(1 / tol))
+    return np.floor(np.mod(frac_coords, 1.0) * steps).astype(np.int64) % steps, steps
+
+
+def match_sites(frac_coords, codes, query_coords, query_codes, tol=POSITION_TOLERANCE):
+    """
+    Index of the site of the same species within tol (fractional, per axis,
+    periodic) of each query position; -1 where there is none. Positions
+    just either side of a bucket edge still match.
+    """
+    frac_coords = np.asarray(frac_coords, dtype=float).reshape(-1, 3)
+    query_coords = np.asarray(query_coords, dtype=float).reshape(-1, 3)
+    q, steps = _buckets(frac_coords, tol)
+    keys = _bucket_keys(q, codes, steps)
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+
+    query_q, _ = _buckets(query_coords, tol)
+    query_codes = np.asarray(query_codes)
+    found = np.full(len(query_coords), -1, dtype=np.int64)
+    best = np.full(len(query_coords), np.inf)
+    if not len(keys):
+        return found
+    # same bucket first; only the queries left over (near a bucket edge) look around
+    todo = np.arange(len(query_coords))
+    for n, offset in enumerate(_NEIGHBOR_BUCKETS):
+        if n == 1:
+            todo = np.flatnonzero(found < 0)
+        if not len(todo):
+            break
+        wanted = _bucket_keys((query_q[todo] + offset) % steps, query_codes[todo], steps)
+        pos = np.minimum(np.searchsorted(sorted_keys, wanted), len(keys) - 1)
+        candidate = order[pos]
+        delta = frac_coords[candidate] - query_coords[todo]
+        distance = np.abs(delta - np.rint(delta)).max(axis=1)
+        better = (sorted_keys[pos] == wanted) & (distance <= tol) & (distance < best[todo])
+        found[todo[better]] = candidate[better]
+        best[todo[better]] = distance[better]
+    return found
+
+
+def translation_orbits(frac_coords, codes, grid, tol=POSITION_TOLERANCE):
+    """
+    One label per site, equal for sites related by the translations of grid
+    (the smallest site index of the orbit). Sites are matched with match_sites
+    in the fractional coordinates of the cell, so the tolerance is the same as
+    for translation_grid. Raises ValueError if a translation has no image for a site.
+    """
+    frac_coords = np.asarray(frac_coords, dtype=float).reshape(-1, 3)
+    labels = np.arange(len(frac_coords))
+    for axis, n in enumerate(grid):
+        if n == 1:
+            continue
+        shifted = frac_coords.copy()
+        shifted[:, axis] += 1.0 / n
+        image = match_sites(frac_coords, codes, shifted, codes, tol)
+        if (image < 0).any():
+            raise ValueError(f'A shift by 1/{n} along axis {axis + 1} is not a translation of the structure')
+        # minimum over each cycle of the shift by pointer doubling: after k steps
+        # every site has seen the 2^k sites following it
+        step = image
+        for _ in range(int(np.ceil(np.log2(n)))):
+            labels = np.minimum(labels, labels[step])
+            step = step[step]
+    return labels
+
+
+def translation_grid(frac_coords, species, tol=POSITION_TOLERANCE, max_n=MAX_GRID):
+    """(n1, n2, n3): largest n_i such that a shift by 1/n_i along axis i is a translation of the structure."""
+    frac_coords = np.asarray(frac_coords, dtype=float).reshape(-1, 3)
+    _, codes = species_codes(species)
+    # every species is split evenly between the n images of a shift
+    count_gcd = math.gcd(*np.bincount(codes).tolist()) if len(codes) else 1
+
+    grid = []
+    for axis in range(3):
+        found = 1
+        for n in range(min(count_gcd, max_n), 1, -1):
+            if count_gcd % n:
+                continue
+            shifted = frac_coords.copy()
+            shifted[:, axis] += 1.0 / n
+            # a few sites reject most n cheaply
+            if ((match_sites(frac_coords, codes, shifted[:QUICK_CHECK_SITES], codes[:QUICK_CHECK_SITES], tol) >= 0).all()
+                    and (match_sites(frac_coords, codes, shifted, codes, tol) >= 0).all()):
+                found = n
+                break
+        grid.append(found)
+    return tuple(grid)
+
+
+def sublattices(frac_coords, species, grid, tol=POSITION_TOLERANCE):
+    """
+    [(label, site indices, cell indices), ...] of the sites grouped by species and
+    position inside the small cell; cell indices are the (k, 3) integer cell of
+    each site on the grid. Labels are the species with a running number (Fe1, Fe2).
+    """
+    frac_coords = np.asarray(frac_coords, dtype=float).reshape(-1, 3)
+    grid = np.asarray(grid, dtype=int)
+    names, codes = species_codes(species)
+    scaled = frac_coords * grid
+    offset = np.mod(scaled, 1.0)
+    _, first, inverse = np.unique(translation_orbits(frac_coords, codes, grid, tol), return_index=True,
+                                  return_inverse=True)
+
+    groups = []
+    numbers = {}
+    # in order of the first site of each group
+    for group in np.argsort(first):
+        indices = np.flatnonzero(inverse == group)
+        name = names[codes[indices[0]]]
+        numbers[name] = numbers.get(name, 0) + 1
+        cells = np.rint(scaled[indices] - offset[indices[0]]).astype(int) % grid
+        groups.append((f'{name}{numbers[name]}', indices, cells))
+    return groups
+
+
+def _fold(h, m):
+    """Integer grid indices folded into (-m/2, m/2]."""
+    return h - m * (h > m // 2)
+
+
+def _fft_power(moments, cells, grid):
+    """|S(k)|^2 on the k-grid h / grid of a sublattice with one site per cell."""
+    values = np.zeros(tuple(grid) + (3,), dtype=float)
+    values[tuple(cells.T)] = moments
+    transform = np.fft.fftn(values, axes=(0, 1, 2)) / len(moments)
+    return np.sum(np.abs(transform) ** 2, axis=-1)
+
+
+def _dft_power(moments, positions, k_grid):
+    """|S(k)|^2 on k_grid, positions in units of the small cell; chunked over the k-points."""
+    axes = [np.arange(m) / m for m in k_grid]
+    kpoints = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 3)
+    power = np.empty(len(kpoints))
+    chunk = max(1, CHUNK_ELEMENTS // max(len(positions), 1))
+    for start in range(0, len(kpoints), chunk):
+        phase = np.exp(-2j * np.pi * (positions @ kpoints[start:start + chunk].T))
+        transform = phase.T @ moments / len(moments)
+        power[start:start + chunk] = np.sum(np.abs(transform) ** 2, axis=-1)
+    return power.reshape(tuple(k_grid))
+
+
+def _pair_power(power):
+    """
+    (k vectors, +-k power) with one entry per +-k pair; k in (-1/2, 1/2]
+    and, of the two, the one that is larger component by component.
+    """
+    grid = np.array(power.shape)
+    h = np.stack(np.meshgrid(*[np.arange(m) for m in grid], indexing='ij'), axis=-1).reshape(-1, 3)
+    partner = (-h) % grid
+    folded = _fold(h, grid)
+    partner_folded = _fold(partner, grid)
+    span = 2 * grid + 1
+
+    def order(f):
+        return ((f[:, 0] + grid[0]) * span[1] + f[:, 1] + grid[1]) * span[2] + f[:, 2] + grid[2]
+
+    keep = order(folded) >= order(partner_folded)
+    flat = power.reshape(-1)
+    partner_flat = np.ravel_multi_index(partner.T, power.shape)
+    pair = flat + np.where(partner_flat == np.arange(len(flat)), 0.0, flat[partner_flat])
+    return folded[keep] / grid, pair[keep]
+
+
+def _peaks(kvectors, pair, mean_square, top):
+    order = np.argsort(-pair, kind='stable')[:top]
+    return [{'k': [round(float(x), 4) for x in kvectors[i]],
+             'amplitude': round(float(np.sqrt(pair[i])), 4),
+             'weight': round(float(pair[i] / mean_square), 4)} for i in order if pair[i] >= MIN_WEIGHT * mean_square]
+
+
+def propagation_vectors(structure, moments, k_grid=None, top=5, tol=POSITION_TOLERANCE):
+    """
+    Dominant propagation vectors of structure (SimpleStructure) with N-by-3
+    cartesian moments (NaN rows count as zero). k_grid defaults to the
+    translation grid, where the transform is an FFT. Returns
+
+        {'grid': [n1, n2, n3], 'k_grid': [...],
+         'sublattices': [{'label', 'sites', 'method': 'fft' | 'dft', 'mean_moment',
+                          'peaks': [{'k', 'amplitude', 'weight'}, ...]}, ...],
+         'dominant': [...]}
+
+    with the non-magnetic sublattices left out; 'dominant' combines all of them
+    weighted by their number of sites.
+    """
+    moments = np.nan_to_num(np.asarray(moments, dtype=float).reshape(-1, 3))
+    frac_coords = np.asarray(structure.frac_coords, dtype=float).reshape(-1, 3)
+    if len(moments) != len(frac_coords):
+        raise ValueError(f'{len(moments)} moments for {len(frac_coords)} sites')
+
+    grid = translation_grid(frac_coords, structure.species, tol)
+    k_grid = tuple(grid if k_grid is None else (int(m) for m in k_grid))
+    if len(k_grid) != 3 or min(k_grid) < 1:
+        raise ValueError(f'k-grid must be three positive integers, got {k_grid}')
+    use_fft = k_grid == grid
+    if not use_fft and np.prod(k_grid) > MAX_K_POINTS:
+        raise ValueError(f'k-grid has {np.prod(k_grid)} points, at most {MAX_K_POINTS}')
+
+    results, total_power, total_square, total_sites = [], 0.0, 0.0, 0
+    for label, indices, cells in sublattices(frac_coords, structure.species, grid, tol):
+        sub_moments = moments[indices]
+        square = np.sum(sub_moments ** 2, axis=1)
+        if square.max() < ZERO_MOMENT ** 2:
+            continue
+        mean_square = float(square.mean())
+        # a full grid has one site per cell; anything else takes the direct transform
+        complete = len(indices) == np.prod(grid)
+        if use_fft and complete:
+            method, power = 'fft', _fft_power(sub_moments, cells, grid)
+        else:
+            method, power = 'dft', _dft_power(sub_moments, frac_coords[indices] * grid, k_grid)
+        kvectors, pair = _pair_power(power)
+        results.append({'label': label, 'sites': len(indices), 'method': method,
+                        'mean_moment': round(float(np.sqrt(square).mean()), 4),
+                        'peaks': _peaks(kvectors, pair, mean_square, top)})
+        total_power = total_power + len(indices) * pair
+        total_square += len(indices) * mean_square
+        total_sites += len(indices)
+
+    dominant = []
+    if total_sites:
+        dominant = _peaks(kvectors, total_power / total_sites, total_square / total_sites, top)
+    return {'grid': list(grid), 'k_grid': list(k_grid), 'sublattices': results, 'dominant': dominant}
+
+
+def _noisy_chain(seed, noise, natoms=8):
+    """Fe chain along a with positions off by up to +-noise (fractional), as after a relaxation."""
+    from types import SimpleNamespace
+    rng = np.random.default_rng(seed)
+    frac = np.zeros((natoms, 3))
+    frac[:, 0] = np.arange(natoms) / natoms
+    frac += rng.uniform(-noise, noise, frac.shape)
+    lattice = SimpleNamespace(matrix=np.diag([2.5 * natoms, 5.0, 5.0]))
+    return SimpleNamespace(frac_coords=frac, species=['Fe'] * natoms, lattice=lattice)
+
+
+def _self_check(seeds=20, noises=(2e-4, 4e-4, 0.45 * POSITION_TOLERANCE)):
+    """
+    Regression check on noisy positions: an AFM chain and a helix must come out
+    as one complete sublattice with a single +-k of weight 1. Returns the failures.
+    """
+    failures = []
+    phase = np.arange(8) * np.pi / 4
+    configurations = {'afm': np.outer(np.cos(4 * phase), [0, 0, 2.0]),
+                      'helix': 2.0 * np.stack([np.cos(phase), np.sin(phase), np.zeros(8)], axis=1)}
+    for noise in noises:
+        for seed in range(seeds):
+            structure = _noisy_chain(seed, noise)
+            for name, moments in configurations.items():
+                result = propagation_vectors(structure, moments)
+                methods = [sub['method'] for sub in result['sublattices']]
+                weights = [peak['weight'] for peak in result['dominant']]
+                if methods != ['fft'] or weights != [1.0]:
+                    failures.append(f'{name}, noise {noise:g}, seed {seed}: {methods} {result["dominant"]}')
+    return failures
+
+
+if __name__ == '__main__':
+    failed = _self_check()
+    for failure in failed:
+        print(failure)
+    print(f'{len(failed)} failures')
+    raise SystemExit(1 if failed else 0)
@@ -0,0 +1,297 @@
+"""
+Selection language for picking atoms.
+
+Grammar (keywords are case-insensitive, species names are not; an axis
+keyword without a range after it is read as a species, so 'Y' is yttrium):
+
+    expr    := term (('or' | '|' | ',') term)*
+    term    := factor (('and' | '&') factor)*
+    factor  := ('not' | '!' | '~') factor | atom
+    atom    := '(' expr ')' | 'all' | 'none'
+             | INDEX | INDEX ':' INDEX          1-based, inclusive  e.g. 1, 3:6
+             | SPECIES                          e.g. Fe, V
+             | AXIS RANGE                       slab, AXIS in x y z (cart) fx fy fz (frac)
+             | ('frac' | 'cart') RANGE RANGE RANGE   box, '*' leaves an axis open
+             | 'within' NUMBER 'of' INDEX       sphere of radius NUMBER (Å) around a site
+             | 'shell' INDEX 'of' INDEX         n-th neighbour shell of a site
+    RANGE   := NUMBER? ':' NUMBER? | '*'
+
+Examples: '1, 3:6, 9'   'V and fz 0.4:0.6'   'within 3.0 of 5 and not O'
+          'frac 0:0.5 * *'   'shell 1 of 12'
+
+Expressions are compiled once into a nested tuple and cached; evaluation
+works on whole numpy arrays and returns a boolean mask over the atoms.
+"""
+import re
+from functools import lru_cache
+import numpy as np
+
+
+_TOKEN_RE = re.compile(r"""
+    \s*(?:
+        (?P<number>[-+]?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][-+]?\d+)?)
+      | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+      | (?P<op>[(),:*|&!~])
+    )""", re.VERBOSE)
+
+_AXES = {'x': ('cart', 0), 'y': ('cart', 1), 'z': ('cart', 2),
+         'fx': ('frac', 0), 'fy': ('frac', 1), 'fz': ('frac', 2)}
+
+_KEYWORDS = {'and', 'or', 'not', 'all', 'none', 'within', 'shell', 'of', 'frac', 'cart'} | set(_AXES)
+
+# tolerance (Å) used to group equal distances into one neighbour shell
+SHELL_TOLERANCE = 1e-2
+
+
+def _tokenize(selection_str):
+    tokens = []
+    names = []
+    pos = 0
+    text = selection_str.strip()
+    while pos < len(text):
+        match = _TOKEN_RE.match(text, pos)
+        if not match or match.end() == pos:
+            raise ValueError(f"Unexpected character in selection at position {pos}: '{text[pos:]}'")
+        pos = match.end()
+        name = match.group('name')
+        names.append(name)
+        if match.group('number') is not None:
+            tokens.append(('number', match.group('number')))
+        elif name is not None:
+            kind = 'keyword' if name.lower() in _KEYWORDS else 'name'
+            tokens.append((kind, name.lower() if kind == 'keyword' else name))
+        else:
+            tokens.append(('op', match.group('op')))
+
+    # an axis keyword needs a range after it; otherwise it is a species (Y is yttrium, not y)
+    for n, (kind, value) in enumerate(tokens):
+        following = tokens[n + 1] if n + 1 < len(tokens) else (None, None)
+        if (kind == 'keyword' and value in _AXES
+                and following[0] != 'number' and following not in (('op', ':'), ('op', '*'))):
+            tokens[n] = ('name', names[n])
+    return tokens
+
+
+class _Parser:
+    """Recursive-descent parser turning tokens into a nested tuple."""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self, kind=None, value=None):
+        tok = self.peek()
+        if tok[0] is None or (kind and tok[0] != kind) or (value and tok[1] != value):
+            expected = value or kind or 'token'
+            raise ValueError(f"Expected {expected} in selection, got '{tok[1]}'")
+        self.pos += 1
+        return tok
+
+    def accept(self, kind, *values):
+        tok = self.peek()
+        if tok[0] == kind and (not values or tok[1] in values):
+            self.pos += 1
+            return tok
+        return None
+
+    def parse(self):
+        if not self.tokens:
+            return ('none',)
+        node = self.expr()
+        if self.pos != len(self.tokens):
+            raise ValueError(f"Unexpected '{self.peek()[1]}' in selection")
+        return node
+
+    def expr(self):
+        nodes = [self.term()]
+        while self.accept('keyword', 'or') or self.accept('op', '|', ','):
+            # tolerate trailing/double commas as the old index parser did
+            if self.peek()[0] is None or self.peek() == ('op', ','):
+                continue
+            nodes.append(self.term())
+        return nodes[0] if len(nodes) == 1 else ('or',) + tuple(nodes)
+
+    def term(self):
+        nodes = [self.factor()]
+        while self.accept('keyword', 'and') or self.accept('op', '&'):
+            nodes.append(self.factor())
+        return nodes[0] if len(nodes) == 1 else ('and',) + tuple(nodes)
+
+    def factor(self):
+        if self.accept('keyword', 'not') or self.accept('op', '!', '~'):
+            return ('not', self.factor())
+        return self.atom()
+
+    def index(self):
+        value = self.take('number')[1]
+        if not value.isdigit():
+            raise ValueError(f"Atom index must be a positive integer, got '{value}'")
+        return int(value)
+
+    def number(self):
+        return float(self.take('number')[1])
+
+    def range_(self):
+        if self.accept('op', '*'):
+            return (None, None)
+        lo = self.number() if self.peek()[0] == 'number' else None
+        self.take('op', ':')
+        hi = self.number() if self.peek()[0] == 'number' else None
+        return (lo, hi)
+
+    def atom(self):
+        kind, value = self.peek()
+        if self.accept('op', '('):
+            node = self.expr()
+            self.take('op', ')')
+            return node
+        if kind == 'number':
+            start = self.index()
+            if self.accept('op', ':'):
+                end = self.index()
+                if start > end:
+                    raise ValueError(f"Invalid range: {start}:{end}")
+                return ('index', start, end)
+            return ('index', start, start)
+        if kind == 'name':
+            self.pos += 1
+            return ('species', value)
+        if kind == 'keyword':
+            self.pos += 1
+            if value in ('all', 'none'):
+                return (value,)
+            if value in _AXES:
+                frame, axis = _AXES[value]
+                bounds = [(None, None)] * 3
+                bounds[axis] = self.range_()
+                return ('box', frame) + tuple(bounds)
+            if value in ('frac', 'cart'):
+                return ('box', value, self.range_(), self.range_(), self.range_())
+            if value == 'within':
+                radius = self.number()
+                self.take('keyword', 'of')
+                return ('within', radius, self.index())
+            if value == 'shell':
+                order = self.index()
+                self.take('keyword', 'of')
+                return ('shell', order, self.index())
+        raise ValueError(f"Unexpected '{value}' in selection")
+
+
+@lru_cache(maxsize=256)
+def compile_selection(selection_str):
+    """
+    Compiles a selection expression into a hashable nested tuple.
+    Results are cached, so re-evaluating the same text skips parsing.
+    Raises ValueError on syntax errors.
+    """
+    return _Parser(_tokenize(selection_str or '')).parse()
+
+
+# 27 neighbouring cell translations used for minimum-image distances
+_IMAGES = np.array([[i, j, k] for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)], dtype=float)
+
+
+class _SelectionContext:
+    """Arrays of one structure plus lazily computed per-site distances."""
+
+    def __init__(self, structure):
+        self.lattice = np.asarray(structure.lattice.matrix, dtype=float)
+        self.species = np.asarray(structure.species)
+        self.frac = np.asarray(structure.frac_coords, dtype=float)
+        self.cart = np.asarray(structure.cart_coords, dtype=float)
+        self.natoms = len(self.species)
+        self._distances = {}
+
+    def site(self, index):
+        if not 1 <= index <= self.natoms:
+            raise ValueError(f"Site {index} is out of range (1-{self.natoms})")
+        return index - 1
+
+    def distances_from(self, site):
+        """Periodic (minimum-image) distances of all atoms to one site."""
+        if site not in self._distances:
+            dfrac = self.frac - self.frac[site]
+            dfrac -= np.round(dfrac)
+            # check neighbouring images as well, rounding alone is not enough for skewed cells
+            dcart = (dfrac[:, None, :] + _IMAGES[None, :, :]) @ self.lattice
+            self._distances[site] = np.sqrt(np.min(np.einsum('nij,nij->ni', dcart, dcart), axis=1))
+        return self._distances[site]
+
+
+def _evaluate(node, ctx):
+    op = node[0]
+    if op == 'all':
+        return np.ones(ctx.natoms, dtype=bool)
+    if op == 'none':
+        return np.zeros(ctx.natoms, dtype=bool)
+    if op == 'or':
+        mask = _evaluate(node[1], ctx)
+        for child in node[2:]:
+            mask |= _evaluate(child, ctx)
+        return mask
+    if op == 'and':
+        mask = _evaluate(node[1], ctx)
+        for child in node[2:]:
+            mask &= _evaluate(child, ctx)
+        return mask
+    if op == 'not':
+        return ~_evaluate(node[1], ctx)
+    if op == 'index':
+        mask = np.zeros(ctx.natoms, dtype=bool)
+        # out-of-range indices are ignored, as before
+        mask[max(node[1], 1) - 1:min(node[2], ctx.natoms)] = True
+        return mask
+    if op == 'species':
+        if node[1] not in ctx.species:
+            raise ValueError(f"Unknown species '{node[1]}' in selection")
+        return ctx.species == node[1]
+    if op == 'box':
+        coords = ctx.frac if node[1] == 'frac' else ctx.cart
+        mask = np.ones(ctx.natoms, dtype=bool)
+        for axis, (lo, hi) in enumerate(node[2:]):
+            if lo is not None:
+                mask &= coords[:, axis] >= lo
+            if hi is not None:
+                mask &= coords[:, axis] <= hi
+        return mask
+    if op == 'within':
+        return ctx.distances_from(ctx.site(node[2])) <= node[1]
+    if op == 'shell':
+        dist = ctx.distances_from(ctx.site(node[2]))
+        others = np.sort(dist[dist > SHELL_TOLERANCE])
+        if others.size == 0:
+            return np.zeros(ctx.natoms, dtype=bool)
+        # label sorted distances by shell, a new shell starts at every gap
+        shell_ids = np.concatenate(([0], np.cumsum(np.diff(others) > SHELL_TOLERANCE)))
+        in_shell = others[shell_ids == node[1] - 1]
+        if in_shell.size == 0:
+            return np.zeros(ctx.natoms, dtype=bool)
+        return ((dist > SHELL_TOLERANCE)
+                & (dist >= in_shell[0] - SHELL_TOLERANCE / 2)
+                & (dist <= in_shell[-1] + SHELL_TOLERANCE / 2))
+    raise ValueError(f"Unknown selection node '{op}'")
+
+
+def select_mask(selection_str, structure):
+    """
+    Evaluates a selection expression on a structure.
+    Args:
+        selection_str (str): Expression, see the module docstring for the grammar.
+        structure (SimpleStructure): Structure providing species, coordinates and lattice.
+    Returns:
+        np.ndarray: Boolean mask of length natoms.
+    """
+    return _evaluate(compile_selection(selection_str), _SelectionContext(structure))
+
+
+def index_mask(indices, natoms):
+    """Boolean mask from a list of 0-based atom indices (e.g. clicked atoms)."""
+    mask = np.zeros(natoms, dtype=bool)
+    if indices:
+        idx = np.asarray(indices, dtype=int)
+        mask[idx[(idx >= 0) & (idx < natoms)]] = True
+    return mask
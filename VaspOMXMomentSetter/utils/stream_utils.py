@@ -0,0 +1,157 @@
+import array
+import contextlib
+import io
+import mmap
+import os
+import numpy as np
+
+# bytes read per step when scanning a file backwards
+CHUNK_SIZE = 1 << 20
+
+
+@contextlib.contextmanager
+def open_binary(source):
+    """
+    Binary file object for a path, bytes, or an already open binary file
+    (which is left open). Lets the readers take whatever the caller has.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            yield f
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        yield io.BytesIO(source)
+    else:
+        yield source
+
+
+@contextlib.contextmanager
+def open_buffer(source):
+    """
+    Zero-copy buffer of a path (memory-mapped), bytes-like object or BytesIO
+    (its getbuffer()). Other file objects are read into memory.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield b''
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                yield mapped
+    elif isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+        yield source
+    elif isinstance(source, io.BytesIO):
+        view = source.getbuffer()
+        try:
+            yield view
+        finally:
+            view.release()
+    else:
+        source.seek(0)
+        yield source.read()
+
+
+def file_size(f):
+    f.seek(0, os.SEEK_END)
+    return f.tell()
+
+
+def rfind_in_file(f, pattern, end=None, chunk_size=CHUNK_SIZE):
+    """
+    Offset of the last occurrence of pattern (bytes) that ends before `end`,
+    -1 if there is none. Reads the file backwards chunk by chunk, so only
+    the tail up to the match is touched and memory stays at one chunk.
+    """
+    if end is None:
+        end = file_size(f)
+    overlap = len(pattern) - 1
+    pos = end
+    tail = b''
+    while pos > 0:
+        start = max(0, pos - chunk_size)
+        f.seek(start)
+        # the overlap catches a match cut by the chunk boundary
+        block = f.read(pos - start) + tail[:overlap]
+        hit = block.rfind(pattern)
+        if hit >= 0:
+            return start + hit
+        tail = block
+        pos = start
+    return -1
+
+
+def read_lines_from(f, offset):
+    """Decoded lines from offset to the end of the file, read lazily."""
+    f.seek(offset)
+    for raw in iter(f.readline, b''):
+        yield raw.decode('utf-8', errors='replace')
+
+
+def find_in_file(f, pattern, start=0, chunk_size=CHUNK_SIZE):
+    """Offset of the first occurrence of pattern at or after `start`, -1 if there is none."""
+    overlap = len(pattern) - 1
+    pos = start
+    while True:
+        f.seek(pos)
+        block = f.read(chunk_size + overlap)
+        hit = block.find(pattern)
+        if hit >= 0:
+            return pos + hit
+        if len(block) <= overlap:
+            return -1
+        pos += len(block) - overlap
+
+
+def count_in_file(f, pattern, chunk_size=CHUNK_SIZE):
+    """Number of occurrences of pattern in the file, counted chunk by chunk."""
+    overlap = len(pattern) - 1
+    count = 0
+    tail = b''
+    f.seek(0)
+    for chunk in iter(lambda: f.read(chunk_size), b''):
+        # the tail is too short to hold a match already counted
+        data = tail + chunk
+        count += data.count(pattern)
+        tail = data[len(data) - overlap:] if overlap else b''
+    return count
+
+
+class LineIndex:
+    """
+    Read-only list of the lines of a buffer (bytes, bytearray, memoryview, mmap),
+    decoded when accessed. Only the newline offsets are kept (8 bytes per line),
+    so the parsers can index lines as in text.split('\\n') without a copy of the text.
+    """
+
+    def __init__(self, data, chunk_size=16 * CHUNK_SIZE):
+        self.buffer = memoryview(data).cast('B')
+        raw = np.frombuffer(self.buffer, dtype=np.uint8)
+        # newline offsets, searched per chunk so the comparison mask stays small
+        newlines = [np.flatnonzero(raw[pos:pos + chunk_size] == 10) + pos
+                    for pos in range(0, len(raw), chunk_size)]
+        newlines = np.concatenate(newlines) if newlines else np.zeros(0, dtype=np.int64)
+        # stdlib arrays: 8 bytes per entry like numpy, but indexing gives plain ints fast
+        self.starts = array.array('q', np.concatenate([[0], newlines + 1]).astype(np.int64).tobytes())
+        self.ends = array.array('q', np.concatenate([newlines, [len(raw)]]).astype(np.int64).tobytes())
+
+    def __len__(self):
+        return len(self.starts)
+
+    def release(self):
+        """Releases the buffer (needed before a memory map it views can be closed)."""
+        self.buffer.release()
+
+    def _line(self, i):
+        return str(self.buffer[self.starts[i]:self.ends[i]], 'utf-8', 'replace')
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._line(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('line index out of range')
+        return self._line(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._line(i)
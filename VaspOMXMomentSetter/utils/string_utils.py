@@ -1,31 +1,77 @@
-def find_start_by_char_transition(line, target_token_number=6):
+import numpy as np
+
+def _fixed_point_chars(values, width, decimals, chars):
     """
-    Helper function implementing the transition-counting logic to find the
-    starting index of the Nth token (where N=6 for M_init).
+    Writes '%{width}.{decimals}f' of every value into `chars`, an (N, width)
+    array of ASCII codes. Returns a mask of the values that need more than
+    `width` characters, are not finite or sit on a rounding tie, which the
+    caller formats one by one.
     """
-    current_transition = 0
-    in_token = False
+    values = np.asarray(values, dtype=float)
+    exact = np.abs(values) * 10**decimals
+    scaled = np.rint(exact)
+    fits = np.isfinite(scaled) & (scaled < 1e15)
+    # near a tie the product can round the other way than the decimal value
+    # printf rounds: those go to the fallback as well
+    with np.errstate(invalid='ignore'):
+        fits &= np.abs(np.abs(exact - scaled) - 0.5) > 1e-9 * (1 + exact)
+    scaled = np.where(fits, scaled, 0).astype(np.int64)
+    negative = np.signbit(values)
+
+    pos = width - 1
+    for _ in range(decimals):
+        scaled, digit = np.divmod(scaled, 10)
+        chars[:, pos] = ord('0') + digit
+        pos -= 1
+    if decimals:
+        chars[:, pos] = ord('.')
+        pos -= 1
 
-    for i, char in enumerate(line):
-        is_space = char.isspace()
+    # integer part right-aligned, at least one digit, blanks in front
+    integer = scaled
+    int_digits = np.ones(len(values), dtype=np.int64)
+    max_digits = len(str(int(integer.max()))) if len(values) else 1
+    for power in range(1, max_digits):
+        int_digits += integer >= 10**power
+    length = int_digits + negative + (decimals + 1 if decimals else 0)
+    fits &= length <= width
 
-        if not is_space:
-            in_token = True
-        elif is_space and in_token:
-            # Transition: non-space to space (end of a token)
-            current_transition += 1
-            in_token = False
+    for power in range(pos + 1):
+        if power < max_digits:
+            integer, digit = np.divmod(integer, 10)
+            chars[:, pos - power] = np.where(int_digits > power, ord('0') + digit, ord(' '))
+        else:
+            chars[:, pos - power] = ord(' ')
+    rows = np.flatnonzero(negative & fits)
+    chars[rows, pos - int_digits[rows]] = ord('-')
+    return ~fits
 
-            # If we've hit the end of the (N-1)th token
-            if current_transition == target_token_number - 1:
-                # Find the first non-space character of the Nth token (M_init)
-                start_of_next_token = i 
-                return i
-                #while start_of_next_token < len(line) and line[start_of_next_token].isspace():
-                #    start_of_next_token += 1
-                #return start_of_next_token
 
-    return -1
+def format_fixed_columns(columns, formats):
+    """
+    Formats the columns of an N-by-k float array into N strings, column-wise
+    with numpy instead of one f-string per row. formats is one
+    (separator, width, decimals) per column; each row is the same as
+    ''.join(f'{sep}{value:{width}.{decimals}f}') over its values.
+    """
+    columns = np.asarray(columns, dtype=float)
+    nrows = columns.shape[0]
+    row_width = sum(len(sep) + width for sep, width, _decimals in formats)
+    block = np.empty((nrows, row_width), dtype=np.uint8)
+    overflow = np.zeros(nrows, dtype=bool)
+    pos = 0
+    for j, (sep, width, decimals) in enumerate(formats):
+        block[:, pos:pos + len(sep)] = np.frombuffer(sep.encode('ascii'), dtype=np.uint8)
+        pos += len(sep)
+        overflow |= _fixed_point_chars(columns[:, j], width, decimals, block[:, pos:pos + width])
+        pos += width
+    text = block.tobytes().decode('ascii')
+    rows = [text[i:i + row_width] for i in range(0, len(text), row_width)] if row_width else [''] * nrows
+    # values wider than their field widen it, as printf does
+    for i in np.flatnonzero(overflow).tolist():
+        rows[i] = ''.join(f'{sep}{value:{width}.{decimals}f}'
+                          for (sep, width, decimals), value in zip(formats, columns[i].tolist()))
+    return rows
 
 
 def parse_selection_string(selection_str, max_index):
@@ -33,7 +79,8 @@ def parse_selection_string(selection_str, max_index):
     if not selection_str:
         return []
 
-    indices = set()
+    # a boolean mask instead of a python set keeps large ranges O(1) per part
+    mask = np.zeros(max_index + 1, dtype=bool)
     parts = selection_str.replace(" ", "").split(',')
 
     for part in parts:
@@ -44,23 +91,10 @@ def parse_selection_string(selection_str, max_index):
             start, end = int(start), int(end)
             if start > end:
                 raise ValueError(f"Invalid range: {start}:{end}")
-            for i in range(start, end + 1):
-                if 0 <= i <= max_index:
-                    indices.add(i)
+            mask[max(start, 0):min(end, max_index) + 1] = True
         else:
             idx = int(part)
             if 0 <= idx <= max_index:
-                indices.add(idx)
-
-    return sorted(list(indices))
+                mask[idx] = True
 
-## Example string to find the start of the M_init (6th token)
-##line = '20  Se  0.57344997  0.92654997  0.20619994  7.5  5.5  90.00...'
-#line = '16	Se	0.92654997	0.57344997	0.79380000	2.5	3.5	180.0	0.0	180.0	0.0'
-#parts = line.split()
-#print(line)
-#
-#start_index = find_start_by_char_transition(line, 6) 
-#print(start_index)
-#print(line[:start_index])
-# start_index will be the exact index of '7' in '7.5'
+    return np.flatnonzero(mask).tolist()
@@ -0,0 +1,50 @@
+import binascii
+import io
+
+# base64 characters decoded per step (a multiple of 4)
+DECODE_CHUNK_CHARS = 4 << 20
+
+
+def upload_payload_start(contents):
+    """Index where the base64 payload of a dcc.Upload data URL starts."""
+    comma = contents.find(',', 0, 1024)
+    if comma < 0:
+        raise ValueError('Upload contents is not a base64 data URL')
+    return comma + 1
+
+
+def decoded_upload_size(contents, start=None):
+    """Size in bytes of the decoded upload, from the length of the base64 text."""
+    if start is None:
+        start = upload_payload_start(contents)
+    length = len(contents) - start
+    padding = 0
+    if length:
+        padding = (contents[-1] == '=') + (length > 1 and contents[-2] == '=')
+    return 3 * (length // 4) - padding
+
+
+def decode_upload(contents, max_size=None):
+    """
+    Decodes a dcc.Upload data URL into a BytesIO, chunk by chunk, without the
+    intermediate copies of contents.split(',') and b64decode. The buffer is
+    sized once, so the peak is the base64 text plus the decoded file. The same
+    object serves as a file for the streaming readers and, through getbuffer(),
+    as a zero-copy memoryview for the line parsers.
+    Raises ValueError when the file is larger than max_size bytes (None: no limit).
+    """
+    start = upload_payload_start(contents)
+    size = decoded_upload_size(contents, start)
+    if max_size is not None and max_size >= 0 and size > max_size:
+        raise ValueError(f'Uploaded file is {size / 1024**2:.1f} MB, the limit is {max_size / 1024**2:.1f} MB')
+
+    out = io.BytesIO()
+    if size:
+        # allocate the whole buffer first; the writes below overwrite it in place
+        out.seek(size - 1)
+        out.write(b'\0')
+        out.seek(0)
+    for pos in range(start, len(contents), DECODE_CHUNK_CHARS):
+        out.write(binascii.a2b_base64(contents[pos:pos + DECODE_CHUNK_CHARS]))
+    out.seek(0)
+    return out
@@ -2,22 +2,162 @@ import numpy as np
 from numpy import linalg as la
 import plotly.graph_objects as go
 #from pymatgen.core import Structure
-import pprint
 from ..load_vesta_setup import load_vesta_colors
 from ..utils.unitcell_utils import unitcell_edges
-from ..utils.plotly_obj import plotly_add_arrows
+from ..utils.plotly_obj import plotly_arrow_traces, arrow_geometry, typed_array, encode_trace_arrays
+from ..utils.neighbors import find_bonds
 
-# VESTA Color Parser
-atom_colors, atom_radii = load_vesta_colors()
+# more bonds than this are not drawn (a cutoff far too large, not a structure)
+MAX_BONDS = 200000
+
+def moment_display_vectors(moments, arrow_scale):
+    """Arrow vectors drawn for N-by-3 moments: length grows with sqrt(|m|), times the arrow scale."""
+    vec = 0.8*np.asarray(moments, dtype=float).reshape(-1, 3)
+    norm = la.norm(vec, axis=1, keepdims=True)
+    vec = np.divide(vec, np.sqrt(norm), out=np.zeros_like(vec), where=norm > 0)
+    return (1+0.1*arrow_scale)*vec
+
+
+def figure_trace_map(symbol_set, visible_species, highlighted_atoms=None, with_arrows=False, bond_pairs=()):
+    """
+    Trace numbers of the figure structure_to_fig builds: {'cell': 0,
+    'species': {species: n}, 'selected': n, 'arrows': (line n, cone n),
+    'bonds': {'A-B': n}}. Lets callbacks Patch traces in place instead of
+    rebuilding the figure.
+    """
+    trace_map = {'cell': 0, 'species': {}}
+    n = 1
+    for species in symbol_set:
+        if species in visible_species:
+            trace_map['species'][species] = n
+            n += 1
+    if highlighted_atoms:
+        trace_map['selected'] = n
+        n += 1
+    if with_arrows:
+        trace_map['arrows'] = (n, n+1)
+        n += 2
+    if bond_pairs:
+        trace_map['bonds'] = {label: n + k for k, label in enumerate(bond_pairs)}
+    return trace_map
+
+
+def bond_geometry(lattice, cart_coords, i, j, shifts):
+    """
+    NaN-separated x, y, z of bonds (i, j, lattice shifts of j): one segment
+    when both atoms are drawn at the ends, otherwise a half bond from each
+    atom to the midpoint, so no line leaves the drawn atoms for an image.
+    """
+    cart_coords = np.asarray(cart_coords, dtype=float)
+    start = cart_coords[i]
+    end = cart_coords[j] + shifts @ np.asarray(lattice, dtype=float)
+    across = np.any(shifts != 0, axis=1)
+    middle = 0.5 * (start[across] + end[across])
+    starts = np.concatenate([start, cart_coords[j[across]]])
+    ends = np.concatenate([np.where(across[:, None], 0.5 * (start + end), end),
+                           cart_coords[j[across]] + (start[across] - middle)])
+    segments = np.stack([starts, ends, np.full_like(starts, np.nan)], axis=1).reshape(-1, 3)
+    return segments[:, 0], segments[:, 1], segments[:, 2]
+
+
+def species_bonds(lattice, species, cart_coords, visible_species):
+    """
+    {'A-B': (x, y, z)} of the bonds between atoms of the visible species, one
+    entry per species pair, with cutoffs from the VESTA radii.
+    """
+    _, radii = load_vesta_colors()
+    species = np.asarray(species)
+    lattice = np.asarray(lattice, dtype=float)
+    shown = np.flatnonzero(np.isin(species, list(visible_species)))
+    if not len(shown):
+        return {}
+    positions = np.asarray(cart_coords, dtype=float)[shown]
+    i, j, shifts = find_bonds(lattice, positions @ np.linalg.inv(lattice), species[shown], radii)
+    if len(i) > MAX_BONDS:
+        print(f'{len(i)} bonds found, more than {MAX_BONDS}: bonds are not drawn')
+        return {}
+
+    names, codes = np.unique(species[shown], return_inverse=True)
+    low, high = np.minimum(codes[i], codes[j]), np.maximum(codes[i], codes[j])
+    pair = low * len(names) + high
+    bonds = {}
+    for key in np.unique(pair):
+        mine = pair == key
+        label = f'{names[key // len(names)]}-{names[key % len(names)]}'
+        bonds[label] = bond_geometry(lattice, positions, i[mine], j[mine], shifts[mine])
+    return bonds
+
+
+def bond_traces(bonds):
+    """One None-separated line trace per species pair of species_bonds."""
+    return [go.Scatter3d(x=x, y=y, z=z, mode='lines', name=label,
+                         line=dict(color='rgb(150, 150, 150)', width=4),
+                         legendgroup='bonds', hoverinfo='skip')
+            for label, (x, y, z) in bonds.items()]
+
+
+def patch_frame(patch, trace_map, species, lattice, cart_coords, moments=None,
+                arrow_scale=4.0, center_arrow=True, highlighted_atoms=None):
+    """
+    Moves the atoms, cell and arrows of a structure_to_fig figure to new
+    positions/moments by writing only their coordinates into a dash Patch.
+    Coordinates are sent as float32 typed arrays to keep the update small.
+    """
+    species = np.asarray(species)
+    cart_coords = np.asarray(cart_coords)
+
+    def xyz(pos):
+        return dict(x=typed_array(pos[:, 0]), y=typed_array(pos[:, 1]), z=typed_array(pos[:, 2]))
+
+    cell_x, cell_y, cell_z = unitcell_edges(np.asarray(lattice))
+    patch['data'][trace_map['cell']].update(x=typed_array(cell_x), y=typed_array(cell_y), z=typed_array(cell_z))
+
+    for name, n in trace_map['species'].items():
+        patch['data'][n].update(xyz(cart_coords[species == name]))
+
+    if 'selected' in trace_map and highlighted_atoms:
+        patch['data'][trace_map['selected']].update(xyz(cart_coords[highlighted_atoms]))
+
+    if 'arrows' in trace_map and moments is not None:
+        patch_arrows(patch, trace_map, cart_coords, moments, arrow_scale, center_arrow)
+
+    if 'bonds' in trace_map:
+        # pairs without bonds in this frame are emptied; new pairs wait for a rebuild
+        bonds = species_bonds(lattice, species, cart_coords, trace_map['species'])
+        for label, n in trace_map['bonds'].items():
+            x, y, z = bonds.get(label, ([], [], []))
+            patch['data'][n].update(x=typed_array(x), y=typed_array(y), z=typed_array(z))
+    return patch
+
+
+def patch_arrows(patch, trace_map, positions, moments, arrow_scale=4.0, center_arrow=True):
+    """Writes the shafts and cones of N-by-3 moments at N positions into the arrow traces of a Patch."""
+    vectors = moment_display_vectors(moments, arrow_scale)
+    shown = np.abs(vectors).sum(axis=1) > 1e-6
+    line, cone_xyz, cone_uvw = arrow_geometry(np.asarray(positions)[shown], vectors[shown], center_arrow)
+    shafts, heads = trace_map['arrows']
+    patch['data'][shafts].update(x=typed_array(line[0]), y=typed_array(line[1]), z=typed_array(line[2]))
+    patch['data'][heads].update(x=typed_array(cone_xyz[0]), y=typed_array(cone_xyz[1]), z=typed_array(cone_xyz[2]),
+                                u=typed_array(cone_uvw[0]), v=typed_array(cone_uvw[1]), w=typed_array(cone_uvw[2]))
+    return patch
+
+
+def species_radius(species):
+    """VESTA radius of a species (1.5 when unknown); markers are 2*radius*radii_scale wide."""
+    return float(load_vesta_colors()[1].get(species, 1.5))
+
+
+def encode_figure(fig):
+    """
+    Figure dict of a go.Figure with its coordinate, vector and index arrays as
+    base64 typed arrays (utils/plotly_obj.typed_array): several times smaller
+    than JSON number lists and decoded by plotly.js without parsing them.
+    """
+    fig_dict = fig.to_plotly_json()
+    for trace in fig_dict['data']:
+        encode_trace_arrays(trace)
+    return fig_dict
 
-# Fallback for common elements if element.ini is not found or is empty
-if not atom_colors:
-    print("WARNING: 'element.ini' not found or is empty. Using fallback colors.")
-    atom_colors = {
-        "V": "yellow", "O": "red", "Mn": "purple", "Se": "green",
-        "C": "gray", "H": "white", "Fe": "orange", "N": "blue",
-        "S": "lightsalmon", "Si": "steelblue"
-    }
 
 # plot structures
 def structure_to_fig(structure, visible_species, radii_scale,
@@ -25,6 +165,8 @@ def structure_to_fig(structure, visible_species, radii_scale,
                      highlighted_atoms=None, moments_data=None, view_options=None):
     if highlighted_atoms is None: highlighted_atoms = []
     if view_options is None: view_options = [] # Default to empty list
+    # VESTA colors and radii, loaded on the first figure
+    atom_colors, _ = load_vesta_colors()
     fig = go.Figure()
 
     # plot Unitcell boundaries
@@ -42,27 +184,24 @@ def structure_to_fig(structure, visible_species, radii_scale,
     # --------------------------------------
     # Add atoms as scatter points
     # loop over species
+    species_array = np.array(structure.species)
+    show_indices = 'show_indices' in view_options
+    mode = 'markers+text' if show_indices else 'markers'
     for species in structure.symbol_set:
-        #print(structure.sites)
         if species in visible_species:
             # group all the sites of this element/species
-            indices = [i for i, site in enumerate(structure.sites) if site.species_string == species]
-            #[print(f"{site._label}") for i, site in enumerate(structure.sites) if site.species_string == species]
+            indices = np.flatnonzero(species_array == species)
             positions = structure.cart_coords[indices] # simple np.ndarray
-            colors = [atom_colors.get(species, 'blue')] * len(indices) # Default to blue if not in dict
-            radii = float(atom_radii.get(species, 1.5))
-
-            # --- DETERMINE THE MODE BASED ON THE CHECKBOX ---
-            show_indices = 'show_indices' in view_options
-            mode = 'markers+text' if show_indices else 'markers'
+            radii = species_radius(species)
 
             fig.add_trace(go.Scatter3d(
                 x=positions[:, 0], y=positions[:, 1], z=positions[:, 2],
-                mode=mode, # Use the mode determined above
-                text=[f"#{i+1}" for i in indices], # Always provide the text
+                mode=mode, # markers, with the indices as text when checked
+                text=np.char.add('#', (indices + 1).astype(str)), # Always provide the text (hover)
                 textposition='top center', # Position the text above the marker
                 textfont=dict(size=18, color='grey'),
-                marker=dict(size=2*radii*radii_scale, color=colors),
+                # one color per species: a scalar, not a list per atom
+                marker=dict(size=2*radii*radii_scale, color=atom_colors.get(species, 'blue')),
                 name=species,
                 customdata=indices,
                 hovertext=[], # [f"{species} #{i}" for i in indices],
@@ -83,25 +222,22 @@ def structure_to_fig(structure, visible_species, radii_scale,
             customdata=highlighted_atoms
         ))
 
-    # Add magnetic moment arrows
+    # Add magnetic moment arrows, all in one line trace and one cone trace
     if moments_data:
-        first_moment = True  # Flag to track the first trace
-        for site_index, moment in moments_data.items():
-            if sum(abs(m) for m in moment) > 1e-6:
-                #mom_vec = np.sqrt(0.8*np.array(moment))
-                mom_vec = 0.8*np.array(moment)
-                # scale moments
-                mom_vec = mom_vec/np.sqrt(la.norm(mom_vec))
-
-                # maybe write a class object for this to interact with plotly?
-                start_pos = structure.cart_coords[int(site_index)]
-                fig = plotly_add_arrows(fig, start_pos, (1+0.1*arrow_scale)*mom_vec,
-                                        center_arrow=center_arrow,
-                                        vector_color=vector_rgb,
-                                        label=f"moment",
-                                        legend_name="moment_group",
-                                        showlegend=first_moment)
-                first_moment = False # switch off, 
+        sites = np.array([int(k) for k in moments_data.keys()], dtype=int)
+        vectors = moment_display_vectors(list(moments_data.values()), arrow_scale)
+        shown = np.abs(vectors).sum(axis=1) > 1e-6
+        fig.add_traces(plotly_arrow_traces(structure.cart_coords[sites[shown]], vectors[shown],
+                                           center_arrow=center_arrow,
+                                           vector_color=vector_rgb,
+                                           label="moment",
+                                           legend_name="moment_group",
+                                           showlegend=bool(shown.any())))
+
+    # bonds, one line trace per species pair, after everything else
+    if 'show_bonds' in view_options:
+        fig.add_traces(bond_traces(species_bonds(lattice, structure.species, structure.cart_coords,
+                                                 visible_species)))
 
     # Update layout and scene
     ax_style = dict(showbackground = False,
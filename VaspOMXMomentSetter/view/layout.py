@@ -1,8 +1,16 @@
-from dash import dcc, html, dash_table
+from dash import dcc, html
 import importlib
+from ..config import load_config
 
-def create_layout():
+# seconds of no typing before a number field (radii, arrow scale) sends its value
+INPUT_DEBOUNCE = 0.5
+
+def create_layout(config=None):
     """Creates the layout for the Dash app."""
+    if config is None:
+        config = load_config()
+    # larger files are rejected by the browser before being sent
+    max_upload = config['max_upload_bytes']
 
     # check if library exist
     libp2o_exists = importlib.util.find_spec('poscar2openmx') is not None
@@ -15,6 +23,7 @@ def create_layout():
         dcc.Store(id='structure-store'),
         dcc.Store(id='moments-store', data={}),
         dcc.Store(id='moments-sph-store', data={}),
+        dcc.Store(id='moments-mode-store', data='collinear'), # mode the moments-store was last written in
         dcc.Store(id='valence-store', data={}),
         dcc.Store(id='selected-atoms-store', data=[]),
         # camera
@@ -26,6 +35,10 @@ def create_layout():
         dcc.Store(id='input-str', data=0),
         dcc.Store(id='is-omx', data=0),
         dcc.Store(id='poscar2omx-exists', data=0),
+        dcc.Store(id='session-id'), # key for server-side state (undo history)
+        dcc.Store(id='active-structure-store'), # picker key of the structure being edited
+        dcc.Store(id='trajectory-store'), # key of the uploaded trajectory in the frame cache
+        dcc.Store(id='figure-trace-store'), # trace numbers of the current figure
 
         # Header
         #html.Div(className='row', style={'display': 'flex'}, children=[
@@ -43,8 +56,8 @@ def create_layout():
                 html.Div(style={'display': 'flex', 'alignItems': 'center', 'gap': '30px', 'marginBottom': '0px'}, children=[
 
                     # Item 1: Upload Box 
-                    dcc.Upload(id='upload-input',
-                        children=html.Div(['Drag & Drop or ', 'Select POSCAR']),
+                    dcc.Upload(id='upload-input', max_size=max_upload, multiple=True,
+                        children=html.Div(['Drag & Drop or ', 'Select POSCAR / OpenMX files']),
                         style={
                             'height': '50px', 'lineHeight': '50px', 'borderWidth': '1px',
                             'borderStyle': 'dashed', 'borderRadius': '5px', 'textAlign': 'center',
@@ -67,12 +80,35 @@ def create_layout():
                         html.Label("View Options:", style={'fontWeight': 'bold'}),
                         dcc.Checklist(
                             id='view-options-checklist',
-                            options=[{'label': 'Show Atom Indices', 'value': 'show_indices'}],
+                            options=[{'label': 'Show Atom Indices', 'value': 'show_indices'},
+                                     {'label': 'Show Bonds', 'value': 'show_bonds'}],
                             value=[],
                             inline=True
                         )
                     ], className='flex-item', style={'flex': '30%'}),
                 ]),
+                # switch between the structures of the uploads
+                html.Div(style={'display': 'flex', 'alignItems': 'center', 'gap': '10px', 'marginTop': '5px'}, children=[
+                    html.Label("Structure:", style={'fontWeight': 'bold'}),
+                    dcc.Dropdown(id='structure-picker', options=[], clearable=False,
+                                 placeholder='Upload one or more files', style={'width': '350px'}),
+                    html.Span(id='structure-picker-status', style={'fontSize': 'small'}),
+                ]),
+                # the whole edit (structure, moments, selection, view) as one .npz file
+                html.Div(style={'display': 'flex', 'alignItems': 'center', 'gap': '10px', 'marginTop': '5px'}, children=[
+                    html.Label("Session:", style={'fontWeight': 'bold'}),
+                    html.Button('Save session', id='save-session-button', n_clicks=0),
+                    dcc.Download(id='download-session'),
+                    dcc.Upload(id='upload-session', max_size=max_upload,
+                               children=html.Button('Load session (.npz)')),
+                    html.Span(id='session-status', style={'fontSize': 'small'}),
+                ]),
+                # progress of a background upload parse, shown while it runs
+                html.Div(id='upload-progress-container', style={'display': 'none'}, children=[
+                    html.Progress(id='upload-progress', value='0', max='100'),
+                    html.Span(id='upload-progress-label'),
+                    html.Button('Cancel', id='cancel-upload-button', n_clicks=0),
+                ]),
 
                 # --- Set view angles ---
                 html.Div(style={'display': 'flex', 'marginBottom': '5px'}, children=[
@@ -92,7 +128,29 @@ def create_layout():
                 ]),
                 # ---
 
-            dcc.Graph(id='structure-view', style={'height': '85vh'}, config={'scrollZoom': True}), ]),
+            dcc.Graph(id='structure-view', style={'height': '85vh'}, config={'scrollZoom': True}),
+
+                # --- Trajectory playback ---
+                html.Div(style={'display': 'flex', 'alignItems': 'center', 'gap': '10px'}, children=[
+                    dcc.Upload(id='upload-trajectory', max_size=max_upload, multiple=True,
+                        children=html.Div(['Trajectory: XDATCAR (+ OUTCAR or moments .npy)']),
+                        style={'borderWidth': '1px', 'borderStyle': 'dashed', 'borderRadius': '5px',
+                               'textAlign': 'center', 'padding': '5px', 'flex': '25%'},
+                    ),
+                    html.Div(dcc.Slider(id='trajectory-slider', min=0, max=0, step=1, value=0,
+                                        marks=None, updatemode='drag', disabled=True,
+                                        tooltip={'placement': 'bottom'}),
+                             style={'flex': '55%'}),
+                    html.Span(id='trajectory-frame-label'),
+                    html.Button('Use frame', id='use-trajectory-frame-button', n_clicks=0, disabled=True),
+                ]),
+                html.Div(id='trajectory-progress-container', style={'display': 'none'}, children=[
+                    html.Progress(id='trajectory-progress', value='0', max='100'),
+                    html.Span(id='trajectory-progress-label'),
+                    html.Button('Cancel', id='cancel-trajectory-button', n_clicks=0),
+                ]),
+                html.Div(id='trajectory-status', style={'fontSize': 'small'}),
+            ]),
 
             # Right Column: Control Panel
             html.Div(style={'flex': '30%', 'padding': '0px'}, children=[
@@ -106,14 +164,14 @@ def create_layout():
                                      {'label': 'Non-collinear', 'value': 'noncollinear'}],
                             value='collinear', labelStyle={'display': 'inline-block', 'marginRight': '20px'}),
                         html.Label("radii scale"), 
-                        dcc.Input(id='radii-scale', type='number', value=4.0, style={'width': '30px'}),
+                        dcc.Input(id='radii-scale', type='number', value=4.0, debounce=INPUT_DEBOUNCE, style={'width': '30px'}),
                     ]),
 
                 html.Div(style={'flex': '30%', 'padding': '0px'}, children=[
                         html.Div(style={'display': 'flex', 'alignItems': 'center', 'gap': '5px'}, children=[
                             html.B("Vector:"),
                             html.Label("Scale"),
-                            dcc.Input(id='arrow-scale', type='number', value=4.0, style={'width': '25px'}),
+                            dcc.Input(id='arrow-scale', type='number', value=4.0, debounce=INPUT_DEBOUNCE, style={'width': '25px'}),
                             # <color 
                             html.Label("Color"),
                             dcc.Dropdown(
@@ -140,6 +198,14 @@ def create_layout():
                     ]),
 
                 html.Hr(),
+                # frame of non-collinear MAGMOM strings (import and export), and the
+                # axis collinear moments are put along when switching modes
+                html.Div(style={'display': 'flex', 'alignItems': 'center', 'gap': '5px'}, children=[
+                    html.B("SAXIS"),
+                    dcc.Input(id='saxis-input', type='text', value='0 0 1', debounce=True, style={'width': '70px'}),
+                    html.Button('Convert moments to mode', id='convert-moments-button', n_clicks=0),
+                ]),
+                html.Div(id='saxis-status', style={'fontSize': 'small'}),
                 html.Label("Update from MAGMOM String", style={'fontWeight': 'bold'}),
                 # update moment using MAGMOM string
                 dcc.Textarea(
@@ -148,6 +214,26 @@ def create_layout():
                     style={'width': '100%', 'height': 32}
                 ),
                 html.Button('Update from MAGMOM', id='update-from-magmom-button', n_clicks=0, style={'marginTop': '0px'}),
+                # converged moments of a finished calculation as the new starting moments
+                dcc.Upload(id='upload-magnetization', max_size=max_upload,
+                    children=html.Div(['Import converged moments (OUTCAR / vasprun.xml / OSZICAR)']),
+                    style={'borderWidth': '1px', 'borderStyle': 'dashed', 'borderRadius': '5px',
+                           'textAlign': 'center', 'padding': '5px', 'marginTop': '5px'},
+                ),
+                html.Div(id='magnetization-import-status', style={'fontSize': 'small'}),
+                # average the moments over symmetry-equivalent sites
+                dcc.Textarea(
+                    id='symmetry-ops-textarea',
+                    placeholder="Symmetry operations, one per line...\ne.g., -y,x,z or x+1/2,y,z,-1 (with time reversal)",
+                    style={'width': '100%', 'height': 32, 'marginTop': '5px'}
+                ),
+                html.Div(style={'display': 'flex', 'alignItems': 'center', 'gap': '10px'}, children=[
+                    html.Button('Symmetrize', id='symmetrize-button', n_clicks=0),
+                    dcc.Checklist(id='symmetrize-translations-check',
+                                  options=[{'label': 'Supercell translations', 'value': 'translations'}],
+                                  value=['translations'], inline=True),
+                ]),
+                html.Div(id='symmetrize-status', style={'fontSize': 'small'}),
                 html.Hr(),
 
                 html.Div(
@@ -176,7 +262,7 @@ def create_layout():
                         # input numbers as a text string and the parse it
                         id='text-selection-input',
                         type='text',
-                        placeholder='e.g., 0, 5:10, 12',
+                        placeholder='e.g., 1, 5:10, 12 or V and fz 0.4:0.6',
                         style={'width': '60%'}
                     )
                 ]),
@@ -185,7 +271,10 @@ def create_layout():
                 html.Div(style={'maxHeight': '50px', 'overflowY': 'auto', 'padding': '5px'},id='moment-input-container'), 
                 html.Div([
                     html.Button('Set Moments', id='update-moment-button', n_clicks=0),
-                    html.Button('Reset All Moments', id='reset-moments-button', n_clicks=0, style={'marginLeft': '5px'})
+                    html.Button('Reset All Moments', id='reset-moments-button', n_clicks=0, style={'marginLeft': '5px'}),
+                    html.Button('Undo', id='undo-button', n_clicks=0, disabled=True, style={'marginLeft': '5px'}),
+                    html.Button('Redo', id='redo-button', n_clicks=0, disabled=True, style={'marginLeft': '5px'}),
+                    html.Span(id='history-status', style={'marginLeft': '5px', 'color': 'grey'}),
                 ], style={'marginTop': '0px'}),
 
                 # Panel for Rotating moments
@@ -223,10 +312,22 @@ def create_layout():
                 html.Div(id='moment-table-container', style={'flex': '65%'}),
                 #--------------------------------------
                 html.Hr(),
+                html.Button('Find propagation vectors', id='propagation-button', n_clicks=0),
+                html.Pre(id='propagation-output', style={'fontSize': 'small', 'maxHeight': '150px', 'overflowY': 'auto'}),
+                #--------------------------------------
+                html.Hr(),
                 html.Button('Generate VASP MAGMOM', id='generate-magmom-button', n_clicks=0, style={'marginTop': '10px'}),
                 dcc.Textarea(id='magmom-output', readOnly=True,
                              placeholder="Your MAGMOM string will appear here...",
                              style={'width': '100%', 'height': 40, 'marginTop': '5px', 'fontFamily': 'monospace'}),
+                # zip of POSCAR, INCAR fragment, modified OpenMX input and moments, streamed by the server
+                html.Div(style={'display': 'flex', 'alignItems': 'center', 'gap': '10px', 'marginTop': '5px'}, children=[
+                    html.Button('Prepare download bundle', id='prepare-bundle-button', n_clicks=0),
+                    dcc.Checklist(id='bundle-all-check',
+                                  options=[{'label': 'All uploaded structures', 'value': 'all'}],
+                                  value=[], inline=True),
+                    html.A(id='bundle-link', download='moments_bundle.zip', style={'display': 'none'}),
+                ]),
                 #---------------------------------------------------------
                 html.Div(
                     style={'display': 'flex', 'alignItems': 'center', 'width': '100%'},
@@ -242,6 +343,11 @@ def create_layout():
                                                 n_clicks=0, style={'marginLeft': '0px'}),
                                     dcc.Download(id="download-openmx-input")
                                 ], style={'marginTop': '10px'}),
+                                html.Div(id='openmx-progress-container', style={'display': 'none'}, children=[
+                                    html.Progress(id='openmx-progress', value='0', max='100'),
+                                    html.Span(id='openmx-progress-label'),
+                                    html.Button('Cancel', id='cancel-openmx-button', n_clicks=0),
+                                ]),
                             ]),
                         # child 2: openmx *.dat file detected, decide whether to reuse the parameters or default
                         html.Div(id='keep-omx-parameter-container',style={'flex': '45%'}), 
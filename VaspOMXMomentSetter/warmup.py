@@ -0,0 +1,53 @@
+"""
+Read-only data loaded before the server forks its workers, and a warm-up run
+of the first-request code paths.
+
+With gunicorn's preload_app the app is created once in the master process;
+what is loaded there (element table, parsed example structures, imported
+modules, Dash's route and callback setup) is shared copy-on-write by every
+worker forked from it instead of being built again in each one.
+"""
+import time
+from .load_vesta_setup import load_vesta_colors
+from .input_parsers.parser_wraper import parse_structure
+from .utils.format_magmom_vasp import generate_magmom_string
+
+# parsed example inputs, {file name: parse_structure result}; never modified after preload
+_examples = {}
+
+
+def preload_shared_data(example_paths=()):
+    """Loads the element table and parses the example inputs. Returns the examples."""
+    load_vesta_colors()
+    for path in example_paths:
+        crystal_data = parse_structure(str(path))
+        if crystal_data is not None:
+            _examples[getattr(path, 'name', str(path))] = crystal_data
+    return _examples
+
+
+def warm_up(app):
+    """
+    Runs what the first page load and the first upload of a worker would do
+    otherwise: the index page, layout and callback list requests (Dash sets up
+    its routes on the first one), then drawing, JSON encoding and the MAGMOM
+    string of every example. Returns the seconds it took.
+    """
+    from plotly.io.json import to_json_plotly
+    from .view.figure_components import structure_to_fig, encode_figure
+
+    start = time.perf_counter()
+    client = app.server.test_client()
+    for path in ('/', '/_dash-layout', '/_dash-dependencies'):
+        response = client.get(path)
+        if response.status_code != 200:
+            print(f'Warm-up: GET {path} returned {response.status_code}')
+
+    for name, crystal_data in _examples.items():
+        structure = crystal_data['structure']
+        moments = {str(i): [float(x) for x in m] for i, m in enumerate(crystal_data['moments']) if m is not None}
+        fig = structure_to_fig(structure, list(structure.symbol_set), 4.0, 4.0, True, [1, 0, 0],
+                               [0], moments, [])
+        to_json_plotly(encode_figure(fig))
+        generate_magmom_string(len(structure), moments, False)
+    return time.perf_counter() - start
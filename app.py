@@ -1,14 +1,38 @@
+from pathlib import Path
 import dash
 from VaspOMXMomentSetter.view.layout import create_layout
 from VaspOMXMomentSetter.callbacks import register_callbacks
+from VaspOMXMomentSetter.config import load_config
+from VaspOMXMomentSetter.warmup import preload_shared_data, warm_up
 
-# Initialize the Dash app
-app = dash.Dash(__name__, suppress_callback_exceptions=True)
-app.title = "MAGMOM manipulator"
-server = app.server
+APP_TITLE = "MAGMOM manipulator"
+# inputs parsed at start and drawn by the warm-up
+EXAMPLE_INPUTS = [Path(__file__).parent / 'examples' / 'openmx' / 'input_V2Se2O_col.dat',
+                  Path(__file__).parent / 'examples' / 'openmx' / 'input_HoAgGe_noncol.dat']
+
+
+def create_app(config=None):
+    """
+    Builds the Dash app: shared read-only data, layout and callbacks, and the
+    warm-up when config['warm_up'] is set. gunicorn.conf.py serves the `server`
+    of the module-level app below, created once in the master (preload_app).
+    """
+    if config is None:
+        config = load_config()
+    preload_shared_data([path for path in EXAMPLE_INPUTS if path.exists()])
+
+    app = dash.Dash(__name__, suppress_callback_exceptions=True)
+    app.title = APP_TITLE
+    app.layout = create_layout(config)
+    register_callbacks(app, config)
 
-app.layout = create_layout()
-register_callbacks(app)
+    if config['warm_up']:
+        print(f'Warm-up done in {warm_up(app):.2f} s')
+    return app
+
+
+app = create_app()
+server = app.server
 
 if __name__ == '__main__':
     app.run(debug=False)
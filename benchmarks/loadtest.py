@@ -0,0 +1,264 @@
+"""
+Concurrent-session load test of the Dash app.
+
+Every simulated session loads the layout and callback graph like a browser
+does, then replays: upload -> select -> set moments -> rotate -> generate
+MAGMOM -> download OpenMX, following the callback chain each step triggers.
+Latency is recorded per callback request; for background callbacks it spans
+from the first request until the polled result arrives.
+
+    python -m benchmarks.loadtest --sessions 8 --iterations 5 --natoms 500
+    python -m benchmarks.loadtest --url http://127.0.0.1:8000 --sessions 32   # e.g. a gunicorn server
+
+Without --url a threaded development server is started in-process.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+import numpy as np
+from .synthetic import synthetic_openmx, as_upload_contents
+
+# how deep a chain of callbacks triggering callbacks is followed
+MAX_CHAIN_DEPTH = 10
+
+
+def _http(url, payload=None, timeout=300):
+    data = None if payload is None else json.dumps(payload).encode('utf-8')
+    req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        body = resp.read()
+        return resp.status, (json.loads(body) if body else None)
+
+
+def _walk_components(node, found):
+    """Collects {id: props} of all components with an id in a layout tree."""
+    if isinstance(node, list):
+        for child in node:
+            _walk_components(child, found)
+    elif isinstance(node, dict) and 'props' in node and 'type' in node:
+        props = node['props']
+        if isinstance(props.get('id'), str):
+            found[props['id']] = props
+        for value in props.values():
+            if isinstance(value, (dict, list)):
+                _walk_components(value, found)
+
+
+def _split_outputs(output):
+    """Callback output key -> list of (id, property) with the allow_duplicate hash kept."""
+    parts = output[2:-2].split('...') if output.startswith('..') else [output]
+    return [tuple(part.rsplit('.', 1)) for part in parts]
+
+
+class Session:
+    """One simulated browser tab: component props plus the server callback graph."""
+
+    def __init__(self, base_url, callbacks, layout, stats):
+        self.url = base_url.rstrip('/') + '/_dash-update-component'
+        self.callbacks = callbacks
+        self.stats = stats
+        self.values = {}
+        self.components = set()
+        self._add_components(layout)
+
+    def _add_components(self, tree):
+        found = {}
+        _walk_components(tree, found)
+        for comp_id, props in found.items():
+            self.components.add(comp_id)
+            for prop, value in props.items():
+                self.values[f'{comp_id}.{prop}'] = value
+        return set(found)
+
+    def _ready(self, cb):
+        return all(i['id'] in self.components for i in cb['inputs'])
+
+    def _request(self, cb, trigger):
+        def spec(items):
+            return [{'id': i['id'], 'property': i['property'],
+                     'value': self.values.get(f"{i['id']}.{i['property']}")} for i in items]
+        outputs = [{'id': cid, 'property': prop} for cid, prop in _split_outputs(cb['output'])]
+        payload = {'output': cb['output'],
+                   'outputs': outputs if cb['output'].startswith('..') else outputs[0],
+                   'inputs': spec(cb['inputs']), 'state': spec(cb['state']),
+                   'changedPropIds': [trigger]}
+        label = f"{trigger} -> {outputs[0]['id']}.{outputs[0]['property'].split('@')[0]}"
+        start = time.perf_counter()
+        try:
+            status, body = _http(self.url, payload)
+            if status != 204 and body and 'cacheKey' in body:
+                status, body = self._poll(cb, payload, body)
+            ok = True
+        except (urllib.error.URLError, OSError) as e:
+            status, body, ok = getattr(e, 'code', None), None, False
+        self.stats.record(label, time.perf_counter() - start, ok)
+        if not ok or status == 204 or not body:
+            return {}
+        return body.get('response', {})
+
+    def _poll(self, cb, payload, job):
+        """Background callback: re-sends the request with the job key until the result is there."""
+        interval = cb.get('background', {}).get('interval', 1000) / 1000
+        query = urllib.parse.urlencode({'cacheKey': job['cacheKey'], 'job': job['job']})
+        while True:
+            time.sleep(interval)
+            status, body = _http(f'{self.url}?{query}', payload)
+            if status == 204 or not body or 'response' in body:
+                return status, body
+
+    def fire(self, changed, depth=0, initial=False):
+        """Runs every callback triggered by the changed 'id.prop' keys, then what they trigger."""
+        if depth > MAX_CHAIN_DEPTH or not (changed or initial):
+            return
+        next_changed = set()
+        new_ids = set()
+        for cb in self.callbacks:
+            triggers = [f"{i['id']}.{i['property']}" for i in cb['inputs']]
+            hit = [t for t in triggers if t in changed]
+            if initial:
+                hit = triggers[:1] if not cb.get('prevent_initial_call') and self._ready(cb) else []
+            if not hit or not self._ready(cb):
+                continue
+            response = self._request(cb, hit[0])
+            for comp_id, props in response.items():
+                for prop, value in props.items():
+                    # like the renderer: every returned prop triggers its dependents
+                    key = f'{comp_id}.{prop}'
+                    self.values[key] = value
+                    next_changed.add(key)
+                    if prop == 'children':
+                        new_ids |= self._add_components(value)
+        # components rendered by a callback fire their own initial callbacks
+        if new_ids:
+            for cb in self.callbacks:
+                if (not cb.get('prevent_initial_call') and self._ready(cb)
+                        and any(i['id'] in new_ids for i in cb['inputs'])):
+                    next_changed.add(f"{cb['inputs'][0]['id']}.{cb['inputs'][0]['property']}")
+        self.fire(next_changed, depth + 1)
+
+    def load(self):
+        """Initial callbacks of a page load."""
+        self.fire(set(), initial=True)
+
+    def set(self, key, value):
+        self.values[key] = value
+        self.fire({key})
+
+    def click(self, component_id):
+        key = f'{component_id}.n_clicks'
+        self.set(key, (self.values.get(key) or 0) + 1)
+
+
+def run_sequence(session, contents, selection):
+    session.values['upload-input.filename'] = ['synthetic.dat'] # State only
+    session.set('upload-input.contents', [contents])
+    session.values['text-selection-input.value'] = selection # State only
+    session.values['moment-mag-in.value'] = 3.0
+    session.values['moment-theta-in.value'] = 90.0
+    session.values['moment-phi-in.value'] = 45.0
+    session.click('update-moment-button')
+    session.set('moment-rotate-check.value', ['show'])
+    session.values['rotation-theta-input.value'] = 30.0
+    session.values['rotation-phi-input.value'] = 60.0
+    session.values['text-selection-input.value'] = selection
+    session.click('rotate-moments-button')
+    session.click('generate-magmom-button')
+    session.click('generate-openmx-button2')
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, label, seconds, ok):
+        with self.lock:
+            self.latencies[label].append(seconds)
+            if not ok:
+                self.errors[label] += 1
+
+    def summary(self, wall_time):
+        rows = []
+        for label in sorted(self.latencies):
+            lat = np.array(self.latencies[label]) * 1e3
+            rows.append({'callback': label, 'count': len(lat), 'errors': self.errors[label],
+                         'throughput_per_s': len(lat) / wall_time,
+                         'p50_ms': float(np.percentile(lat, 50)), 'p95_ms': float(np.percentile(lat, 95)),
+                         'p99_ms': float(np.percentile(lat, 99))})
+        return rows
+
+
+def _start_local_server():
+    import logging
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.WARNING) # no line per request
+    from app import app
+    server = make_server('127.0.0.1', 0, app.server, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='base URL of a running app (default: start one in-process)')
+    parser.add_argument('--sessions', type=int, default=8, help='concurrent simulated sessions')
+    parser.add_argument('--iterations', type=int, default=3, help='sequences per session')
+    parser.add_argument('--natoms', type=int, default=200, help='size of the uploaded OpenMX structure')
+    parser.add_argument('--selection', default='all', help='selection expression used for set/rotate')
+    parser.add_argument('--output', help='write the summary as JSON to this file')
+    args = parser.parse_args(argv)
+
+    server = None
+    base_url = args.url
+    if base_url is None:
+        server, base_url = _start_local_server()
+
+    text, natoms = synthetic_openmx(args.natoms, noncollinear=True)
+    contents = as_upload_contents(text)
+    _status, layout = _http(base_url.rstrip('/') + '/_dash-layout')
+    _status, dependencies = _http(base_url.rstrip('/') + '/_dash-dependencies')
+    callbacks = [cb for cb in dependencies if not cb.get('clientside_function')]
+
+    stats = Stats()
+
+    def worker():
+        session = Session(base_url, callbacks, layout, stats)
+        session.load()
+        for _ in range(args.iterations):
+            run_sequence(session, contents, args.selection)
+
+    print(f'{args.sessions} sessions x {args.iterations} sequences, {natoms} atoms, against {base_url}')
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(args.sessions)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall_time = time.perf_counter() - start
+
+    rows = stats.summary(wall_time)
+    total = sum(r['count'] for r in rows)
+    print(f"{'callback':70s} {'count':>6s} {'err':>4s} {'req/s':>7s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s}")
+    for r in rows:
+        print(f"{r['callback'][:70]:70s} {r['count']:6d} {r['errors']:4d} {r['throughput_per_s']:7.2f} "
+              f"{r['p50_ms']:8.1f} {r['p95_ms']:8.1f} {r['p99_ms']:8.1f}")
+    print(f'total: {total} requests in {wall_time:.1f} s ({total / wall_time:.1f} req/s, '
+          f'{args.sessions * args.iterations / wall_time:.2f} sequences/s)')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'sessions': args.sessions, 'iterations': args.iterations, 'natoms': natoms,
+                       'wall_time_s': wall_time, 'requests': total, 'callbacks': rows}, f, indent=1)
+    if server is not None:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
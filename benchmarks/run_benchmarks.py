@@ -0,0 +1,226 @@
+"""
+Timing benchmarks of the main code paths on synthetic structures.
+
+    python -m benchmarks.run_benchmarks                         # 10 ... 1e5 atoms
+    python -m benchmarks.run_benchmarks --sizes 10 1000 --cases input_parser_poscar
+    python -m benchmarks.run_benchmarks --compare old.json new.json
+    python -m benchmarks.run_benchmarks --cases input_parser_openmx --memory   # + peak traced memory
+
+Results are written as JSON (one record per case and size) so runs of two
+versions can be compared with --compare.
+"""
+import argparse
+import importlib.util
+import json
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+import numpy as np
+from .synthetic import synthetic_poscar, synthetic_openmx, random_moments, as_upload_contents
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 100000]
+
+
+# --- cases: each takes a target size and returns (function to time, actual natoms) ---
+
+def case_input_parser_poscar(natoms):
+    from VaspOMXMomentSetter.input_parsers.parser_wraper import input_parser
+    text, n = synthetic_poscar(natoms)
+    contents = as_upload_contents(text)
+    return (lambda: input_parser(contents)), n
+
+
+def case_input_parser_openmx(natoms):
+    from VaspOMXMomentSetter.input_parsers.parser_wraper import input_parser
+    text, n = synthetic_openmx(natoms, noncollinear=True)
+    contents = as_upload_contents(text)
+    return (lambda: input_parser(contents)), n
+
+
+def case_structure_to_fig(natoms):
+    from VaspOMXMomentSetter.input_parsers.parser_wraper import input_parser
+    from VaspOMXMomentSetter.view.figure_components import structure_to_fig
+    text, n = synthetic_poscar(natoms)
+    structure = input_parser(as_upload_contents(text))['structure']
+    moments = {str(i): m for i, m in enumerate(random_moments(n).tolist())}
+    species = list(structure.symbol_set)
+    return (lambda: structure_to_fig(structure, species, 4.0, 4.0, True, [1, 0, 0],
+                                     [], moments, [])), n
+
+
+def case_generate_magmom_collinear(natoms):
+    from VaspOMXMomentSetter.utils.format_magmom_vasp import generate_magmom_string
+    moments = {str(i): m for i, m in enumerate(random_moments(natoms).tolist())}
+    return (lambda: generate_magmom_string(natoms, moments, True)), natoms
+
+
+def case_generate_magmom_noncollinear(natoms):
+    from VaspOMXMomentSetter.utils.format_magmom_vasp import generate_magmom_string
+    moments = {str(i): m for i, m in enumerate(random_moments(natoms).tolist())}
+    return (lambda: generate_magmom_string(natoms, moments, False)), natoms
+
+
+def case_parse_magmom(natoms):
+    from VaspOMXMomentSetter.utils.format_magmom_vasp import parse_magmom_string, generate_magmom_string
+    moments = {str(i): m for i, m in enumerate(random_moments(natoms).tolist())}
+    magmom_str = generate_magmom_string(natoms, moments, False)
+    return (lambda: parse_magmom_string(magmom_str, natoms)), natoms
+
+
+def case_modify_openmx_spins(natoms):
+    from VaspOMXMomentSetter.input_parsers.parser_wraper import input_parser
+    from VaspOMXMomentSetter.input_creators.modify_openmx_moments import modify_openmx_spins
+    text, n = synthetic_openmx(natoms, noncollinear=True)
+    structure = input_parser(as_upload_contents(text))['structure']
+    moments = random_moments(n, seed=1)
+    return (lambda: modify_openmx_spins(text, moments, True, structure.cart_coords)), n
+
+
+def case_omx_default_input_str(natoms):
+    if importlib.util.find_spec('poscar2openmx') is None:
+        return None, None
+    from VaspOMXMomentSetter.input_parsers.parser_wraper import input_parser
+    from VaspOMXMomentSetter.input_creators.omx_parameter_setup import omx_default_input_str
+    from VaspOMXMomentSetter.utils.coordinate_transform import cartesian_to_spherical
+    text, n = synthetic_poscar(natoms)
+    structure = input_parser(as_upload_contents(text))['structure'].as_dict()
+    cart = random_moments(n).tolist()
+    moments = {'cartesian': {str(i): m for i, m in enumerate(cart)},
+               'spherical': {str(i): cartesian_to_spherical(m) for i, m in enumerate(cart)}}
+    return (lambda: omx_default_input_str(structure, 'noncollinear', moments)), n
+
+
+CASES = {
+    'input_parser_poscar': case_input_parser_poscar,
+    'input_parser_openmx': case_input_parser_openmx,
+    'structure_to_fig': case_structure_to_fig,
+    'generate_magmom_collinear': case_generate_magmom_collinear,
+    'generate_magmom_noncollinear': case_generate_magmom_noncollinear,
+    'parse_magmom_string': case_parse_magmom,
+    'modify_openmx_spins': case_modify_openmx_spins,
+    'omx_default_input_str': case_omx_default_input_str,
+}
+
+
+def _quiet(func):
+    """Runs func with stdout discarded (the parsers print progress per call)."""
+    import contextlib
+    import io
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func()
+
+
+def time_case(func, repeat, budget):
+    """Times func up to `repeat` times while the total stays within `budget` seconds."""
+    times = []
+    total = 0.0
+    while len(times) < repeat and (not times or total + times[-1] <= budget):
+        start = time.perf_counter()
+        _quiet(func)
+        elapsed = time.perf_counter() - start
+        times.append(elapsed)
+        total += elapsed
+    return times
+
+
+def peak_memory(func):
+    """Peak memory (bytes) allocated by one call of func, traced with tracemalloc."""
+    import tracemalloc
+    tracemalloc.start()
+    try:
+        _quiet(func)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(cases, sizes, repeat, budget, memory=False):
+    results = []
+    for name in cases:
+        predicted_rate = 0.0 # seconds per atom of the last measured size
+        for size in sizes:
+            record = {'case': name, 'target_atoms': size}
+            if predicted_rate * size > budget:
+                # linear extrapolation from the last size says this one won't fit the budget
+                record['status'] = 'skipped'
+                results.append(record)
+                continue
+            func, natoms = _quiet(lambda: CASES[name](size))
+            if func is None:
+                record['status'] = 'unavailable'
+                results.append(record)
+                print(f'{name:32s} {size:>8d}  unavailable')
+                break
+            try:
+                times = time_case(func, repeat, budget)
+            except Exception as e:
+                record.update({'status': 'error', 'natoms': natoms, 'error': f'{type(e).__name__}: {e}'})
+                results.append(record)
+                print(f"{name:32s} {natoms:>8d}  error: {record['error']}")
+                break
+            record.update({'status': 'ok', 'natoms': natoms, 'runs': len(times),
+                           'best_s': min(times), 'median_s': float(np.median(times))})
+            line = f"{name:32s} {natoms:>8d}  best {record['best_s']:10.5f} s  median {record['median_s']:10.5f} s"
+            if memory:
+                record['peak_mb'] = peak_memory(func) / 1024**2
+                line += f"  peak {record['peak_mb']:9.1f} MB"
+            results.append(record)
+            print(line)
+            predicted_rate = min(times) / natoms
+    return results
+
+
+def _metadata():
+    def version(module):
+        try:
+            return importlib.import_module(module).__version__
+        except (ImportError, AttributeError):
+            return None
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, cwd=Path(__file__).parent).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'git_commit': commit,
+            'python': platform.python_version(), 'platform': platform.platform(),
+            'numpy': version('numpy'), 'plotly': version('plotly'), 'dash': version('dash')}
+
+
+def compare(old_path, new_path):
+    """Prints best-time ratios (new/old) for records present in both files."""
+    old = {(r['case'], r.get('natoms')): r for r in json.loads(Path(old_path).read_text())['results']}
+    new = json.loads(Path(new_path).read_text())['results']
+    print(f"{'case':32s} {'atoms':>8s} {'old [s]':>10s} {'new [s]':>10s} {'new/old':>8s}")
+    for r in new:
+        prev = old.get((r['case'], r.get('natoms')))
+        if r.get('status') != 'ok' or not prev or prev.get('status') != 'ok':
+            continue
+        print(f"{r['case']:32s} {r['natoms']:>8d} {prev['best_s']:10.5f} {r['best_s']:10.5f} "
+              f"{r['best_s'] / prev['best_s']:8.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--cases', nargs='+', choices=sorted(CASES), default=list(CASES))
+    parser.add_argument('--repeat', type=int, default=5, help='maximum timed runs per case and size')
+    parser.add_argument('--budget', type=float, default=30.0,
+                        help='seconds per case and size; sizes whose extrapolated run time exceeds it are skipped')
+    parser.add_argument('--memory', action='store_true', help='also record the peak traced memory of one run')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = run(args.cases, sorted(args.sizes), args.repeat, args.budget, args.memory)
+    Path(args.output).write_text(json.dumps({'meta': _metadata(), 'results': results}, indent=1))
+    print(f'Results written to {args.output}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
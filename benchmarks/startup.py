@@ -0,0 +1,112 @@
+"""
+Cold start of the app: imports `app` (layout built, callbacks registered) in
+fresh interpreters with `python -X importtime` and reports the import time
+of the app, per top-level package and of the slowest modules of this repo.
+
+    python -m benchmarks.startup                         # 5 runs, budget 1500 ms
+    python -m benchmarks.startup --runs 10 --budget-ms 900 --output startup.json
+
+The median import time of `app` is checked against --budget-ms; the exit
+status is 1 when it is over, so CI can track it. One untimed run first
+writes the .pyc files, as a built container image has them.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from .run_benchmarks import _metadata
+
+ROOT = Path(__file__).resolve().parent.parent
+OWN_PACKAGE = 'VaspOMXMomentSetter'
+
+
+def parse_importtime(stderr):
+    """[(module, self_us, cumulative_us), ...] of -X importtime output, in import order."""
+    records = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            self_us, cumulative_us = int(fields[0]), int(fields[1])
+        except (IndexError, ValueError):
+            # the header line
+            continue
+        records.append((fields[2].strip(), self_us, cumulative_us))
+    return records
+
+
+def import_once(module, env=None):
+    """-X importtime records of importing module in a new interpreter."""
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          capture_output=True, text=True, cwd=ROOT, env=env)
+    if proc.returncode != 0:
+        raise RuntimeError(f'import {module} failed:\n{proc.stderr[-2000:]}')
+    return parse_importtime(proc.stderr)
+
+
+def by_package(records):
+    """Self time (us) summed per top-level package."""
+    totals = {}
+    for name, self_us, _ in records:
+        top = name.split('.', 1)[0]
+        totals[top] = totals.get(top, 0) + self_us
+    return totals
+
+
+def run(module, runs):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(ROOT), os.environ.get('PYTHONPATH')])))
+    import_once(module, env)
+    totals, packages, modules = [], {}, {}
+    for _ in range(runs):
+        records = import_once(module, env)
+        top = [r for r in records if r[0] == module]
+        totals.append(top[-1][2] / 1000)
+        for name, ms in by_package(records).items():
+            packages.setdefault(name, []).append(ms / 1000)
+        for name, self_us, _ in records:
+            if name.startswith(OWN_PACKAGE):
+                modules.setdefault(name, []).append(self_us / 1000)
+    median = {name: statistics.median(values) for name, values in packages.items()}
+    own = {name: statistics.median(values) for name, values in modules.items()}
+    return {'module': module, 'runs': runs, 'median_ms': statistics.median(totals),
+            'min_ms': min(totals), 'max_ms': max(totals), 'packages_ms': median, 'own_modules_ms': own}
+
+
+def report(result, top=12):
+    print(f"import {result['module']}: median {result['median_ms']:.0f} ms "
+          f"(min {result['min_ms']:.0f}, max {result['max_ms']:.0f}, {result['runs']} runs)")
+    print(f"\n{'package':40s} {'self [ms]':>10s}")
+    for name, ms in sorted(result['packages_ms'].items(), key=lambda item: -item[1])[:top]:
+        print(f'{name:40s} {ms:10.1f}')
+    print(f"\n{'module of ' + OWN_PACKAGE:60s} {'self [ms]':>10s}")
+    for name, ms in sorted(result['own_modules_ms'].items(), key=lambda item: -item[1])[:top]:
+        print(f'{name:60s} {ms:10.1f}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='app', help='module whose import is timed')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=1500.0,
+                        help='maximum median import time; over it the exit status is 1')
+    parser.add_argument('--output', help='also write the result as JSON')
+    args = parser.parse_args(argv)
+
+    result = run(args.module, args.runs)
+    result['budget_ms'] = args.budget_ms
+    report(result)
+    if args.output:
+        Path(args.output).write_text(json.dumps({'meta': _metadata(), 'results': [result]}, indent=1))
+        print(f'Results written to {args.output}')
+
+    over = result['median_ms'] > args.budget_ms
+    print(f"\n{'OVER' if over else 'within'} budget: {result['median_ms']:.0f} ms of {args.budget_ms:.0f} ms")
+    return 1 if over else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,151 @@
+"""
+Synthetic POSCAR / OpenMX inputs of arbitrary size, built as supercells of the
+structures in examples/.
+"""
+import base64
+import re
+from pathlib import Path
+import numpy as np
+from VaspOMXMomentSetter.input_parsers.parser_vasp import simple_poscar_parser
+from VaspOMXMomentSetter.input_parsers.parser_omx import simple_openmx_dat_parser
+
+EXAMPLES_DIR = Path(__file__).resolve().parent.parent / 'examples'
+POSCAR_TEMPLATE = EXAMPLES_DIR / 'vasp' / 'RbV2Se2O' / 'rbv2se2o.vasp'
+OMX_COL_TEMPLATE = EXAMPLES_DIR / 'openmx' / 'input_V2Se2O_col.dat'
+OMX_NONCOL_TEMPLATE = EXAMPLES_DIR / 'openmx' / 'input_HoAgGe_noncol.dat'
+
+
+def supercell_reps(lattice, n_base, target_atoms):
+    """Smallest repetitions (na, nb, nc) with at least target_atoms, grown along the shortest axis."""
+    reps = np.array([1, 1, 1])
+    lengths = np.linalg.norm(np.asarray(lattice), axis=1)
+    while reps.prod() * n_base < target_atoms:
+        reps[np.argmin(lengths * reps)] += 1
+    return reps
+
+
+def make_supercell(lattice, species, frac_coords, reps):
+    """
+    Repeats a cell reps times. Atoms of the same base site stay together,
+    so species grouped in the base cell stay grouped (as POSCAR needs).
+    Returns lattice, species, fractional coordinates of the supercell.
+    """
+    reps = np.asarray(reps)
+    shifts = np.array(np.meshgrid(*[np.arange(r) for r in reps], indexing='ij')).reshape(3, -1).T
+    frac = (np.asarray(frac_coords)[:, None, :] + shifts[None, :, :]) / reps
+    new_species = np.repeat(np.asarray(species), len(shifts)).tolist()
+    return np.asarray(lattice) * reps[:, None], new_species, frac.reshape(-1, 3)
+
+
+def random_moments(natoms, seed=0, magnitude=3.0):
+    """N-by-3 random moment vectors of fixed magnitude."""
+    vec = np.random.default_rng(seed).normal(size=(natoms, 3))
+    return magnitude * vec / np.linalg.norm(vec, axis=1)[:, None]
+
+
+def poscar_text(lattice, species, frac_coords, comment='synthetic supercell'):
+    """POSCAR string in Direct coordinates; species must be grouped."""
+    names = list(dict.fromkeys(species))
+    counts = [species.count(name) for name in names]
+    lines = [comment, '1.0']
+    lines += [' '.join(f'{x:20.10f}' for x in vec) for vec in lattice]
+    lines.append(' '.join(f'{name:>4s}' for name in names))
+    lines.append(' '.join(f'{count:>4d}' for count in counts))
+    lines.append('Direct')
+    body = np.char.mod('%18.9f', np.asarray(frac_coords))
+    lines += [' '.join(row) for row in body]
+    return '\n'.join(lines) + '\n'
+
+
+def synthetic_poscar(target_atoms, template=POSCAR_TEMPLATE):
+    """POSCAR text with at least target_atoms atoms. Returns (text, natoms)."""
+    lattice, species, coords, is_cartesian = simple_poscar_parser(Path(template).read_text())
+    frac = coords @ np.linalg.inv(lattice) if is_cartesian else coords
+    reps = supercell_reps(lattice, len(species), target_atoms)
+    lattice, species, frac = make_supercell(lattice, species, frac, reps)
+    return poscar_text(lattice, species, frac, comment=f'supercell {reps.tolist()} of {Path(template).name}'), len(species)
+
+
+def synthetic_openmx(target_atoms, noncollinear=False, seed=0):
+    """
+    OpenMX .dat text with at least target_atoms atoms, made from the collinear
+    (V2Se2O, Frac) or non-collinear (HoAgGe, Ang) example. Returns (text, natoms).
+    """
+    template = OMX_NONCOL_TEMPLATE if noncollinear else OMX_COL_TEMPLATE
+    content = template.read_text()
+    lattice, species, coords, is_cartesian, _magmom, valence, _data = simple_openmx_dat_parser(content)
+    frac = coords @ np.linalg.inv(lattice) if is_cartesian else coords
+
+    reps = supercell_reps(lattice, len(species), target_atoms)
+    n_images = reps.prod()
+    lattice, species, frac = make_supercell(lattice, species, frac, reps)
+    valence = np.repeat(valence, n_images)
+    natoms = len(species)
+
+    moments = random_moments(natoms, seed)
+    mag = np.linalg.norm(moments, axis=1)
+    if not noncollinear:
+        # collinear: up or down along the sign of the x component
+        mag = mag * np.sign(moments[:, 0])
+    up, dn = 0.5 * (valence + mag), 0.5 * (valence - mag)
+
+    if noncollinear:
+        coords_out = frac @ lattice
+        theta = np.degrees(np.arccos(moments[:, 2] / mag))
+        phi = np.degrees(np.arctan2(moments[:, 1], moments[:, 0]))
+        tails = [f'{u:6.2f} {d:6.2f} {t:8.2f} {p:8.2f} {t:8.2f} {p:8.2f} 1 on'
+                 for u, d, t, p in zip(up, dn, theta, phi)]
+    else:
+        coords_out = frac
+        tails = [f'{u:5.2f} {d:5.2f}   on' for u, d in zip(up, dn)]
+
+    xyz = np.char.mod('%14.8f', coords_out)
+    atom_lines = [f'{i + 1:6d}  {s:<4s}{x}{y}{z}   {tail}'
+                  for i, (s, (x, y, z), tail) in enumerate(zip(species, xyz, tails))]
+
+    vectors = '\n'.join(' '.join(f'{x:12.6f}' for x in vec) for vec in lattice)
+    content = re.sub(r'(<Atoms\.UnitVectors[^\n]*\n).*?(\n\s*Atoms\.UnitVectors>)',
+                     lambda m: m.group(1) + vectors + m.group(2), content, flags=re.S)
+    content = re.sub(r'(?m)^(Atoms\.Number\s+)\d+', lambda m: f'{m.group(1)}{natoms}', content)
+    content = re.sub(r'(<Atoms\.SpeciesAndCoordinates[^\n]*\n).*?(\n\s*Atoms\.SpeciesAndCoordinates>)',
+                     lambda m: m.group(1) + '\n'.join(atom_lines) + m.group(2), content, flags=re.S)
+    return content, natoms
+
+
+def as_upload_contents(text):
+    """Wraps file text the way dcc.Upload delivers it (base64 data URL)."""
+    return 'data:application/octet-stream;base64,' + base64.b64encode(text.encode('utf-8')).decode('ascii')
+
+
+def write_synthetic_trajectory(directory, target_atoms, nframes, seed=0, amplitude=0.05):
+    """
+    XDATCAR and per-step moments (.npy) of a jittering, precessing supercell,
+    written frame by frame so long runs never sit in memory.
+    Returns (xdatcar path, moments path, natoms).
+    """
+    lattice, species, coords, is_cartesian = simple_poscar_parser(POSCAR_TEMPLATE.read_text())
+    frac = coords @ np.linalg.inv(lattice) if is_cartesian else coords
+    reps = supercell_reps(lattice, len(species), target_atoms)
+    lattice, species, frac = make_supercell(lattice, species, frac, reps)
+    natoms = len(species)
+    rng = np.random.default_rng(seed)
+    base_moments = random_moments(natoms, seed)
+
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    xdatcar_path = directory / 'XDATCAR'
+    moments_path = directory / 'moments.npy'
+    header = poscar_text(lattice, species, frac).split('\n')[:7]
+    moments = np.lib.format.open_memmap(moments_path, mode='w+', dtype=np.float32, shape=(nframes, natoms, 3))
+    with open(xdatcar_path, 'w') as f:
+        f.write('\n'.join(header) + '\n')
+        for step in range(nframes):
+            jitter = frac + amplitude * rng.normal(size=frac.shape) / np.linalg.norm(lattice, axis=1)
+            f.write(f'Direct configuration= {step + 1:5d}\n')
+            f.write('\n'.join(' '.join(row) for row in np.char.mod('%12.8f', jitter % 1.0)) + '\n')
+            angle = 2 * np.pi * step / max(nframes, 1)
+            rot = np.array([[np.cos(angle), -np.sin(angle), 0], [np.sin(angle), np.cos(angle), 0], [0, 0, 1]])
+            moments[step] = base_moments @ rot.T
+    moments.flush()
+    del moments
+    return xdatcar_path, moments_path, natoms
@@ -0,0 +1,101 @@
+"""
+Memory and time of trajectory playback: builds the frame cache of a synthetic
+XDATCAR + moments run, then scrubs through every frame the way the slider
+callback does (read frame, Patch the figure, encode it as JSON).
+
+    python -m benchmarks.trajectory_memory --frames 10000 --natoms 1000
+
+Resident memory is sampled from /proc (Linux) during each phase: 'anon' is
+memory the process owns, 'file' the pages of memory-mapped files it has touched,
+which the kernel can drop at any time.
+"""
+import argparse
+import json
+import tempfile
+import threading
+import time
+import numpy as np
+from .synthetic import write_synthetic_trajectory
+
+
+def _rss_mb():
+    """(anonymous, file-backed) resident memory in MB."""
+    values = {}
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(('RssAnon:', 'RssFile:')):
+                key, kb, _unit = line.split()
+                values[key] = int(kb) / 1024
+    return values.get('RssAnon:', 0.0), values.get('RssFile:', 0.0)
+
+
+class PeakMemory:
+    """Samples resident memory in a thread while the block runs."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak_anon = self.peak_file = 0.0
+
+    def _sample(self):
+        while not self._stop.is_set():
+            anon, file = _rss_mb()
+            self.peak_anon = max(self.peak_anon, anon)
+            self.peak_file = max(self.peak_file, file)
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.start_anon, self.start_file = _rss_mb()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def report(self, label, seconds):
+        print(f'{label:10s} {seconds:8.2f} s   anon {self.start_anon:7.1f} -> peak {self.peak_anon:7.1f} MB'
+              f'   mapped file peak {self.peak_file:7.1f} MB')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=10000)
+    parser.add_argument('--natoms', type=int, default=1000)
+    parser.add_argument('--workdir', help='where the trajectory and cache are written (default: a temp dir)')
+    args = parser.parse_args(argv)
+
+    from dash import Patch
+    from plotly.utils import PlotlyJSONEncoder
+    from VaspOMXMomentSetter.session.trajectory import build_trajectory_cache, open_trajectory
+    from VaspOMXMomentSetter.view.figure_components import patch_frame, figure_trace_map
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='trajectory_bench_')
+    start = time.perf_counter()
+    xdatcar, moments, natoms = write_synthetic_trajectory(workdir, args.natoms, args.frames)
+    print(f'{args.frames} frames of {natoms} atoms in {workdir} '
+          f'(XDATCAR {xdatcar.stat().st_size / 1024**2:.0f} MB, written in {time.perf_counter() - start:.1f} s)')
+
+    cache_dir = f'{workdir}/cache'
+    with PeakMemory() as mem:
+        start = time.perf_counter()
+        key = build_trajectory_cache(cache_dir, str(xdatcar), str(moments))
+    mem.report('build', time.perf_counter() - start)
+
+    frames = open_trajectory(cache_dir, key)
+    trace_map = figure_trace_map(sorted(set(frames.species)), frames.species, with_arrows=True)
+    sizes = []
+    with PeakMemory() as mem:
+        start = time.perf_counter()
+        for index in range(frames.nframes):
+            lattice, positions, frame_moments = frames.frame(index)
+            patch = patch_frame(Patch(), trace_map, frames.species, lattice, positions, frame_moments)
+            sizes.append(len(json.dumps(patch, cls=PlotlyJSONEncoder)))
+    elapsed = time.perf_counter() - start
+    mem.report('scrub', elapsed)
+    print(f'per frame: {1e3 * elapsed / frames.nframes:.2f} ms, patch {np.mean(sizes) / 1024:.0f} kB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+"""
+gunicorn settings of the app, read from the working directory:
+
+    gunicorn                     # from the repository root, serves app:server on :8000
+    GUNICORN_THREADS=16 gunicorn --bind 0.0.0.0:8050
+
+Every setting can still be given on the command line (it wins over this file).
+"""
+import gc
+import os
+
+wsgi_app = 'app:server'
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+# The app is created once in the master and the workers are forked from it:
+# imported modules, the element table and the parsed examples are shared
+# copy-on-write, and the warm-up (MOMENT_SETTER_WARM_UP) runs once for all workers.
+preload_app = True
+raw_env = [f"MOMENT_SETTER_WARM_UP={os.environ.get('MOMENT_SETTER_WARM_UP', '1')}"]
+
+# Threaded workers: callbacks mostly wait on numpy, file I/O and the background
+# job processes, which release the GIL. The undo history and the moments of
+# structures switched away from live in worker memory and gunicorn does not
+# route a session back to the same worker, so there is one worker by default.
+# Set WEB_CONCURRENCY above 1 only behind a proxy with sticky sessions.
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# large uploads are parsed inside the request when background callbacks are off
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+
+
+def when_ready(server):
+    # Objects created so far move to the permanent generation: the collector
+    # of a worker no longer writes to them, so their pages stay shared.
+    gc.freeze()
+    server.log.info(f'{gc.get_freeze_count()} objects frozen before forking workers')